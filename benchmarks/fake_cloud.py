@@ -0,0 +1,591 @@
+"""In process fakes of the nova, neutron and juju interfaces the scripts use.
+
+A FakeCloud holds servers, ports and hypervisors and counts every call made
+to it. Calls can be given a latency and a probability of failing, and
+server and port state changes only complete after a transition delay, so
+the orchestration code sees the same kind of asynchronous behaviour it
+would against a real cloud without any network or sleeps longer than those
+configured.
+"""
+
+import asyncio
+import collections
+import datetime
+import itertools
+import random
+import re
+import threading
+import time
+import uuid
+
+import novaclient.exceptions
+
+
+class FakeAPIError(Exception):
+    """Injected or simulated API failure."""
+
+
+def _now():
+    return time.monotonic()
+
+
+def _timestamp():
+    return datetime.datetime.now(datetime.timezone.utc).strftime(
+        '%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+class FakeCloud(object):
+    """Servers, ports and hypervisors of a fake undercloud and juju model."""
+
+    def __init__(self, latency=0.0, juju_latency=0.0, connect_latency=0.0,
+                 transition_delay=0.0, failures=None, seed=0):
+        """Create an empty cloud.
+
+        :param latency: Seconds each nova or neutron call takes
+        :type latency: float
+        :param juju_latency: Seconds each juju command or action takes
+        :type juju_latency: float
+        :param connect_latency: Seconds opening the juju model connection
+                                takes
+        :type connect_latency: float
+        :param transition_delay: Seconds a server or port state change takes
+        :type transition_delay: float
+        :param failures: Map of call name, or 'transition', to the
+                         probability of it failing, '*' applies to all calls
+        :type failures: Union[Dict[str, float], None]
+        :param seed: Seed of the failure injection
+        :type seed: int
+        """
+        self.latency = latency
+        self.juju_latency = juju_latency
+        self.connect_latency = connect_latency
+        self.transition_delay = transition_delay
+        self.failures = failures or {}
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = collections.Counter()
+        self.networks = {}
+        self.ports = collections.OrderedDict()
+        self.servers = collections.OrderedDict()
+        self.deleted_servers = {}
+        self.hypervisors = []
+        self.units = collections.OrderedDict()
+        self.macs = itertools.count(1)
+
+    def _should_fail(self, name):
+        rate = self.failures.get(name, self.failures.get('*', 0))
+        return rate and self.random.random() < rate
+
+    def call(self, name, latency=None):
+        """Count a call, wait for its latency and maybe fail it.
+
+        :param name: Name of call, eg nova.servers.list
+        :type name: str
+        :param latency: Seconds call takes, defaults to the cloud latency
+        :type latency: Union[float, None]
+        :raises: FakeAPIError
+        """
+        with self.lock:
+            self.calls[name] += 1
+            fail = self._should_fail(name)
+        latency = self.latency if latency is None else latency
+        if latency:
+            time.sleep(latency)
+        if fail:
+            raise FakeAPIError('Injected failure of {}'.format(name))
+
+    async def async_call(self, name, latency=None):
+        """Count a call made from a coroutine, see call().
+
+        :param name: Name of call
+        :type name: str
+        :param latency: Seconds call takes, defaults to the juju latency
+        :type latency: Union[float, None]
+        :raises: FakeAPIError
+        """
+        with self.lock:
+            self.calls[name] += 1
+            fail = self._should_fail(name)
+        latency = self.juju_latency if latency is None else latency
+        if latency:
+            await asyncio.sleep(latency)
+        if fail:
+            raise FakeAPIError('Injected failure of {}'.format(name))
+
+    def populate(self, network_name, application_name, units,
+                 hypervisors=None, crowded=False, ports=False,
+                 attached=False, name_prefix=None):
+        """Add a network, hypervisors and one server and unit per unit.
+
+        :param network_name: Name of network to create
+        :type network_name: str
+        :param application_name: Name of juju application of the units
+        :type application_name: str
+        :param units: Number of servers and units
+        :type units: int
+        :param hypervisors: Number of hypervisors, default one per 8 units
+        :type hypervisors: Union[int, None]
+        :param crowded: Place all servers on a quarter of the hypervisors
+        :type crowded: bool
+        :param ports: Create a sriov port for each server
+        :type ports: bool
+        :param attached: Attach the sriov ports to the servers
+        :type attached: bool
+        :param name_prefix: Name servers prefix-N rather than after their
+                            juju machine
+        :type name_prefix: Union[str, None]
+        """
+        network = {
+            'id': str(uuid.uuid4()),
+            'name': network_name}
+        self.networks[network['id']] = network
+        hypervisor_count = hypervisors or max(2, units // 8)
+        self.hypervisors = [
+            'compute-{}.maas'.format(i) for i in range(hypervisor_count)]
+        used_hypervisors = self.hypervisors
+        if crowded:
+            used_hypervisors = self.hypervisors[:max(1, hypervisor_count // 4)]
+        for i in range(units):
+            server_id = str(uuid.uuid4())
+            name = ('{}-{}'.format(name_prefix, i) if name_prefix
+                    else 'juju-{}-{}'.format(application_name, i))
+            self.servers[server_id] = {
+                'id': server_id,
+                'name': name,
+                'host': used_hypervisors[i % len(used_hypervisors)],
+                'state': 'active',
+                'pending': None,
+                'updated': _timestamp(),
+                'networks': {network_name: ['10.9.{}.{}'.format(
+                    i // 250, i % 250 + 2)]},
+                'flavor': {'vcpus': 2, 'ram': 4096}}
+            self.units['{}/{}'.format(application_name, i)] = {
+                'machine': str(i),
+                'instance-id': server_id}
+            if ports:
+                port = self.add_port({
+                    'name': 'sriov_{}_{}'.format(network_name, i),
+                    'network_id': network['id']})
+                if attached:
+                    port['device_id'] = server_id
+
+    def add_port(self, config):
+        """Create a port from a port request body.
+
+        :param config: Port attributes
+        :type config: Dict
+        :returns: Port
+        :rtype: Dict
+        """
+        port_id = str(uuid.uuid4())
+        mac = next(self.macs)
+        port = dict(config)
+        port.update({
+            'id': port_id,
+            'mac_address': 'fa:16:3e:{:02x}:{:02x}:{:02x}'.format(
+                mac >> 16 & 0xff,
+                mac >> 8 & 0xff,
+                mac & 0xff),
+            'device_id': '',
+            'pending': None})
+        self.ports[port_id] = port
+        return port
+
+    def _transition(self, record, key, value):
+        if key == 'state' and self._should_fail('transition'):
+            value = 'error'
+        # Like nova setting the task state, starting a change updates server
+        record['updated'] = _timestamp()
+        if self.transition_delay:
+            record['pending'] = (key, value, _now() + self.transition_delay)
+        else:
+            record[key] = value
+
+    def _settle(self, record):
+        pending = record.get('pending')
+        if pending and _now() >= pending[2]:
+            record[pending[0]] = pending[1]
+            record['pending'] = None
+            record['updated'] = _timestamp()
+
+    def server_action(self, server_id, action, **kwargs):
+        """Carry out a nova server action.
+
+        :param server_id: Id of server
+        :type server_id: str
+        :param action: stop, start, migrate, confirm_resize,
+                       interface_attach, interface_detach or interface_list
+        :type action: str
+        :raises: FakeAPIError
+        """
+        self.call('nova.servers.{}'.format(action))
+        expected = {
+            'stop': 'active',
+            'start': 'stopped',
+            'migrate': 'stopped',
+            'confirm_resize': 'resized'}
+        with self.lock:
+            record = self.servers.get(server_id)
+            if not record:
+                raise FakeAPIError('Server {} not found'.format(server_id))
+            self._settle(record)
+            if action in expected and (
+                    record['pending'] or
+                    record['state'] != expected[action]):
+                raise FakeAPIError('Cannot {} server {} in {} state'.format(
+                    action,
+                    server_id,
+                    record['state']))
+            if action == 'stop':
+                self._transition(record, 'state', 'stopped')
+            elif action == 'start':
+                self._transition(record, 'state', 'active')
+            elif action == 'migrate':
+                record['host'] = kwargs.get('host') or self.random.choice(
+                    self.hypervisors)
+                record['updated'] = _timestamp()
+                self._transition(record, 'state', 'resized')
+            elif action == 'confirm_resize':
+                self._transition(record, 'state', 'stopped')
+            elif action == 'delete':
+                self._transition(record, 'state', 'deleted')
+            elif action == 'interface_attach':
+                port = self.ports[kwargs['port_id']]
+                port['device_id'] = server_id
+            elif action == 'interface_detach':
+                port = self.ports[kwargs['port_id']]
+                self._transition(port, 'device_id', '')
+            elif action == 'interface_list':
+                return [dict(p) for p in self.ports.values()
+                        if p['device_id'] == server_id]
+
+    def server_views(self, server_ids=None, changes_since=None):
+        """Return the current view of servers as nova would list them.
+
+        :param server_ids: Ids of servers, default all
+        :type server_ids: Union[Iterable[str], None]
+        :param changes_since: Only return servers, including deleted ones,
+                              updated at or after this timestamp
+        :type changes_since: Union[str, None]
+        :returns: Servers
+        :rtype: List[FakeServer]
+        """
+        with self.lock:
+            records = ([self.servers[i] for i in server_ids
+                        if i in self.servers]
+                       if server_ids is not None
+                       else list(self.servers.values()))
+            for record in records:
+                self._settle(record)
+                if record['state'] == 'deleted':
+                    self._remove_server(record)
+            if changes_since:
+                return [
+                    FakeServer(self, r)
+                    for r in records + list(self.deleted_servers.values())
+                    if r['updated'] >= changes_since]
+            return [FakeServer(self, r) for r in records
+                    if r['state'] != 'deleted']
+
+    def _remove_server(self, record):
+        del self.servers[record['id']]
+        self.deleted_servers[record['id']] = record
+        for port in self.ports.values():
+            if port['device_id'] == record['id']:
+                port['device_id'] = ''
+
+    def port_views(self, port_ids=None):
+        """Return copies of the current state of ports.
+
+        :param port_ids: Ids of ports, default all
+        :type port_ids: Union[Iterable[str], None]
+        :returns: Ports
+        :rtype: List[Dict]
+        """
+        with self.lock:
+            ports = ([self.ports[i] for i in port_ids if i in self.ports]
+                     if port_ids is not None
+                     else list(self.ports.values()))
+            for port in ports:
+                self._settle(port)
+            return [
+                {k: v for k, v in p.items() if k != 'pending'}
+                for p in ports]
+
+
+class FakeServer(object):
+    """Snapshot of a server, as returned by novaclient."""
+
+    def __init__(self, cloud, record):
+        self._cloud = cloud
+        self.id = record['id']
+        self.name = record['name']
+        self.networks = record['networks']
+        self.flavor = record['flavor']
+        self.status = record['state'].upper()
+        self.updated = record['updated']
+        setattr(self, 'OS-EXT-STS:vm_state', record['state'])
+        setattr(self, 'OS-EXT-SRV-ATTR:hypervisor_hostname', record['host'])
+
+    def stop(self):
+        self._cloud.server_action(self.id, 'stop')
+
+    def start(self):
+        self._cloud.server_action(self.id, 'start')
+
+    def migrate(self, host=None):
+        self._cloud.server_action(self.id, 'migrate', host=host)
+
+    def confirm_resize(self):
+        self._cloud.server_action(self.id, 'confirm_resize')
+
+    def interface_attach(self, port_id, net_id, fixed_ip):
+        self._cloud.server_action(self.id, 'interface_attach',
+                                  port_id=port_id)
+
+    def interface_detach(self, port_id):
+        self._cloud.server_action(self.id, 'interface_detach',
+                                  port_id=port_id)
+
+    def interface_list(self):
+        return self._cloud.server_action(self.id, 'interface_list')
+
+
+class FakeServerManager(object):
+
+    def __init__(self, cloud):
+        self.cloud = cloud
+
+    def list(self, detailed=True, search_opts=None, limit=None, **kwargs):
+        self.cloud.call('nova.servers.list')
+        servers = self.cloud.server_views(
+            changes_since=(search_opts or {}).get('changes-since'))
+        name = (search_opts or {}).get('name')
+        if name:
+            servers = [s for s in servers if re.search(name, s.name)]
+        return servers
+
+    def get(self, server_id):
+        self.cloud.call('nova.servers.get')
+        servers = self.cloud.server_views([server_id])
+        if not servers:
+            raise novaclient.exceptions.NotFound(
+                404,
+                'Server {} not found'.format(server_id))
+        return servers[0]
+
+    def delete(self, server):
+        self.cloud.server_action(getattr(server, 'id', server), 'delete')
+
+    def interface_detach(self, server, port_id):
+        self.cloud.server_action(
+            getattr(server, 'id', server),
+            'interface_detach',
+            port_id=port_id)
+
+    def find(self, name):
+        self.cloud.call('nova.servers.find')
+        for server in self.cloud.server_views():
+            if server.name == name:
+                return server
+        raise FakeAPIError('Server {} not found'.format(name))
+
+
+class FakeHypervisor(object):
+
+    def __init__(self, hostname, servers):
+        self.hypervisor_hostname = hostname
+        self.state = 'up'
+        self.status = 'enabled'
+        self.vcpus = 64
+        self.memory_mb = 262144
+        self.vcpus_used = sum(s['flavor']['vcpus'] for s in servers)
+        self.memory_mb_used = sum(s['flavor']['ram'] for s in servers)
+
+
+class FakeHypervisorManager(object):
+
+    def __init__(self, cloud):
+        self.cloud = cloud
+
+    def list(self, detailed=False):
+        self.cloud.call('nova.hypervisors.list')
+        with self.cloud.lock:
+            servers = collections.defaultdict(list)
+            for record in self.cloud.servers.values():
+                servers[record['host']].append(record)
+            return [FakeHypervisor(h, servers[h])
+                    for h in self.cloud.hypervisors]
+
+
+class FakeNova(object):
+    """The parts of novaclient.v2.client.Client the scripts use."""
+
+    def __init__(self, cloud):
+        self.servers = FakeServerManager(cloud)
+        self.hypervisors = FakeHypervisorManager(cloud)
+
+
+class FakeNeutron(object):
+    """The parts of neutronclient.v2_0.client.Client the scripts use."""
+
+    FILTERS = ('id', 'name', 'network_id', 'device_id')
+
+    def __init__(self, cloud):
+        self.cloud = cloud
+
+    def list_networks(self, name=None):
+        self.cloud.call('neutron.list_networks')
+        return {'networks': [
+            dict(n) for n in self.cloud.networks.values()
+            if name is None or n['name'] == name]}
+
+    def list_ports(self, fields=None, retrieve_all=True, limit=None,
+                   **filters):
+        self.cloud.call('neutron.list_ports')
+        ids = filters.get('id')
+        if isinstance(ids, str):
+            ids = [ids]
+        ports = self.cloud.port_views(ids)
+        for key in self.FILTERS:
+            value = filters.get(key)
+            if value is None or key == 'id':
+                continue
+            values = value if isinstance(value, (list, tuple)) else [value]
+            ports = [p for p in ports if p.get(key) in values]
+        if fields:
+            ports = [{k: p.get(k) for k in fields} for p in ports]
+        return {'ports': ports}
+
+    def show_port(self, port_id):
+        self.cloud.call('neutron.show_port')
+        ports = self.cloud.port_views([port_id])
+        if not ports:
+            raise FakeAPIError('Port {} not found'.format(port_id))
+        return {'port': ports[0]}
+
+    def create_port(self, body):
+        self.cloud.call('neutron.create_port')
+        with self.cloud.lock:
+            if 'ports' in body:
+                return {'ports': [
+                    dict(self.cloud.add_port(p)) for p in body['ports']]}
+            return {'port': dict(self.cloud.add_port(body['port']))}
+
+    def delete_port(self, port_id):
+        self.cloud.call('neutron.delete_port')
+        with self.cloud.lock:
+            if not self.cloud.ports.pop(port_id, None):
+                raise FakeAPIError('Port {} not found'.format(port_id))
+
+
+class FakeMachine(object):
+
+    def __init__(self, machine_id, instance_id):
+        self.entity_id = machine_id
+        self.data = {'instance-id': instance_id}
+
+
+class FakeUnit(object):
+
+    def __init__(self, cloud, unit_name, unit):
+        self.cloud = cloud
+        self.entity_id = unit_name
+        self.data = {'machine-id': unit['machine']}
+        self.machine = FakeMachine(unit['machine'], unit['instance-id'])
+
+    async def run(self, command, timeout=None, block=False):
+        await self.cloud.async_call('juju.run_on_unit')
+        mac = re.search(r'^MAC=(\S+)$', command, re.MULTILINE)
+        if not mac:
+            return FakeAction('completed', results={
+                'return-code': 0, 'stdout': '', 'stderr': ''})
+        instance_id = self.machine.data['instance-id']
+        with self.cloud.lock:
+            attached = any(
+                p['mac_address'] == mac.group(1) and
+                p['device_id'] == instance_id
+                for p in self.cloud.ports.values())
+        if attached:
+            return FakeAction('completed', results={
+                'return-code': 0, 'stdout': 'RESULT ens7 changed\n',
+                'stderr': ''})
+        return FakeAction('completed', results={
+            'return-code': 1, 'stdout': '', 'stderr': (
+                'No interface found with mac address {}'.format(
+                    mac.group(1)))})
+
+    async def run_action(self, action_name, **params):
+        await self.cloud.async_call('juju.run_action')
+        return FakeAction('running')
+
+
+class FakeApplication(object):
+
+    def __init__(self, units):
+        self.units = units
+
+
+class FakeAction(object):
+
+    def __init__(self, status, message='', results=None):
+        self.status = status
+        self.results = results or {}
+        self.data = {'status': status, 'message': message}
+
+    async def wait(self):
+        self.status = self.data['status'] = 'completed'
+        return self
+
+
+class FakeModel(object):
+    """The libjuju model, and juju and ssh commands, the scripts use.
+
+    Like libjuju the model state is held locally once connected, so only
+    connecting, commands and actions are calls to the cloud.
+    """
+
+    def __init__(self, cloud):
+        self.cloud = cloud
+
+    async def connect(self, *args, **kwargs):
+        await self.cloud.async_call(
+            'juju.connect',
+            self.cloud.connect_latency)
+
+    async def disconnect(self):
+        pass
+
+    @property
+    def units(self):
+        return {name: FakeUnit(self.cloud, name, unit)
+                for name, unit in self.cloud.units.items()}
+
+    @property
+    def applications(self):
+        applications = collections.defaultdict(list)
+        for unit in self.units.values():
+            applications[unit.entity_id.split('/')[0]].append(unit)
+        return {name: FakeApplication(units)
+                for name, units in applications.items()}
+
+    def subprocess_call(self, cmd, **kwargs):
+        """Stand in for subprocess.call of juju ssh shutdown."""
+        self.cloud.call('juju.ssh', self.cloud.juju_latency)
+        if cmd[:2] == ['juju', 'ssh'] and 'shutdown' in cmd[-1]:
+            instance_id = self.cloud.units[cmd[2]]['instance-id']
+            with self.cloud.lock:
+                record = self.cloud.servers[instance_id]
+                self.cloud._settle(record)
+                if record['state'] == 'active':
+                    self.cloud._transition(record, 'state', 'stopped')
+        return 0
+
+    async def async_wait_for_ssh(self, ip, timeout=600, interval=5):
+        await self.cloud.async_call('ssh.connect')
+
+    async def async_add_new_hostkey(self, ip):
+        await self.cloud.async_call('ssh.keyscan')
+
+    async def async_add_machine(self, ip):
+        await self.cloud.async_call('juju.add-machine')
@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+"""Measure how the orchestration in the manage-* scripts scales with units.
+
+The real create_ports, cleanup, add_port_to_netplan, balance and
+add_machines functions, and a cleanup which also removes the add_servers
+servers, are run against fake nova, neutron and juju backends
+at several unit counts. The wall clock time, number of API calls and peak
+memory of each run are reported and can be compared with an earlier run to
+catch regressions without a lab.
+"""
+
+import argparse
+import collections
+import contextlib
+import importlib
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+import types
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import fake_cloud
+import juju_session
+import status_waiter
+import undercloud_cache
+
+manage_sriov_ports = importlib.import_module('manage-sriov-ports')
+manage_magpie_units = importlib.import_module('manage-magpie-units')
+
+NETWORK_NAME = 'bench-net'
+APPLICATION_NAME = 'bench'
+
+# The scripts log every unit at INFO, the benchmark logs its results with its
+# own logger so they can be quietened separately.
+LOG = logging.getLogger('benchmark')
+
+Result = collections.namedtuple(
+    'Result',
+    ['scenario', 'units', 'wall_time', 'calls', 'peak_memory', 'failed'])
+
+
+def setup_create_ports(cloud, units):
+    cloud.populate(NETWORK_NAME, APPLICATION_NAME, units)
+
+
+def run_create_ports(nova_client, neutron_client, parallel):
+    results = manage_sriov_ports.create_ports(
+        nova_client,
+        neutron_client,
+        NETWORK_NAME,
+        APPLICATION_NAME,
+        'direct',
+        parallel=parallel)
+    return len(results[manage_sriov_ports.FAILED])
+
+
+def setup_attached(cloud, units):
+    cloud.populate(NETWORK_NAME, APPLICATION_NAME, units, ports=True,
+                   attached=True)
+
+
+def run_cleanup(nova_client, neutron_client, parallel):
+    results = manage_sriov_ports.cleanup(
+        nova_client,
+        neutron_client,
+        NETWORK_NAME,
+        APPLICATION_NAME,
+        parallel=parallel)
+    return len(results[manage_sriov_ports.FAILED])
+
+
+def setup_teardown(cloud, units):
+    cloud.populate(NETWORK_NAME, APPLICATION_NAME, units, ports=True,
+                   attached=True,
+                   name_prefix=manage_sriov_ports.MACHINE_PREFIX)
+    network_id = next(iter(cloud.networks))
+    for server in list(cloud.servers.values()):
+        port = cloud.add_port({
+            'name': '{}_port'.format(server['name']),
+            'network_id': network_id})
+        port['device_id'] = server['id']
+
+
+def run_teardown(nova_client, neutron_client, parallel):
+    results = manage_sriov_ports.cleanup(
+        nova_client,
+        neutron_client,
+        NETWORK_NAME,
+        parallel=parallel,
+        remove_servers=True)
+    return len(results[manage_sriov_ports.FAILED])
+
+
+def run_add_port_to_netplan(nova_client, neutron_client, parallel):
+    results = manage_sriov_ports.add_port_to_netplan(
+        neutron_client,
+        NETWORK_NAME,
+        APPLICATION_NAME,
+        parallel=parallel)
+    return len([r for r in results if r.error])
+
+
+def setup_balance(cloud, units):
+    cloud.populate(NETWORK_NAME, APPLICATION_NAME, units, crowded=True)
+
+
+def run_balance(nova_client, neutron_client, parallel):
+    return len(manage_magpie_units.balance(
+        nova_client,
+        APPLICATION_NAME,
+        parallel=parallel))
+
+
+def run_watch(nova_client, neutron_client, parallel):
+    manage_magpie_units.watch(
+        nova_client,
+        APPLICATION_NAME,
+        interval=0,
+        iterations=10)
+    return 0
+
+
+def setup_add_machines(cloud, units):
+    cloud.populate(NETWORK_NAME, APPLICATION_NAME, units,
+                   name_prefix=manage_sriov_ports.MACHINE_PREFIX)
+
+
+def run_add_machines(nova_client, neutron_client, parallel):
+    report = manage_sriov_ports.add_machines(nova_client, parallel=parallel)
+    return len(report['failed'])
+
+
+Scenario = collections.namedtuple('Scenario', ['setup', 'run'])
+
+SCENARIOS = collections.OrderedDict([
+    ('create_ports', Scenario(setup_create_ports, run_create_ports)),
+    ('cleanup', Scenario(setup_attached, run_cleanup)),
+    ('teardown', Scenario(setup_teardown, run_teardown)),
+    ('add_port_to_netplan', Scenario(setup_attached, run_add_port_to_netplan)),
+    ('balance', Scenario(setup_balance, run_balance)),
+    ('watch', Scenario(setup_balance, run_watch)),
+    ('add_machines', Scenario(setup_add_machines, run_add_machines)),
+])
+
+
+@contextlib.contextmanager
+def fake_backends(cloud, poll_interval):
+    """Point the juju and ssh calls of the scripts at the fake cloud.
+
+    Each scenario gets its own juju session, so pays for one connection.
+
+    :param cloud: Fake cloud
+    :type cloud: fake_cloud.FakeCloud
+    :param poll_interval: Shortest time between server status polls
+    :type poll_interval: float
+    """
+    model = fake_cloud.FakeModel(cloud)
+    waiter_init = status_waiter.StatusWaiter.__init__
+
+    def fast_waiter_init(self, min_interval=poll_interval,
+                         max_interval=poll_interval * 10, **kwargs):
+        waiter_init(
+            self,
+            min_interval=min_interval,
+            max_interval=max_interval,
+            **kwargs)
+
+    def close_session():
+        if juju_session._session:
+            juju_session._session.close()
+
+    async def add_machine(ip):
+        try:
+            await model.async_add_machine(ip)
+        except fake_cloud.FakeAPIError as e:
+            raise manage_sriov_ports.AddMachineError(str(e))
+
+    patches = [
+        (juju_session.juju.model, 'Model', lambda: model),
+        (juju_session, '_session', None),
+        (manage_magpie_units, 'subprocess', types.SimpleNamespace(
+            call=model.subprocess_call)),
+        (manage_sriov_ports, 'async_wait_for_ssh', model.async_wait_for_ssh),
+        (manage_sriov_ports, 'async_add_new_hostkey',
+         model.async_add_new_hostkey),
+        (manage_sriov_ports, 'async_add_machine', add_machine),
+        (status_waiter.StatusWaiter, '__init__', fast_waiter_init),
+    ]
+    with contextlib.ExitStack() as stack:
+        for target, attribute, value in patches:
+            stack.enter_context(mock.patch.object(target, attribute, value))
+        stack.callback(close_session)
+        yield
+
+
+def run_scenario(name, units, parallel, poll_interval, **cloud_args):
+    """Run a scenario against a newly populated fake cloud.
+
+    :param name: Name of scenario
+    :type name: str
+    :param units: Number of units
+    :type units: int
+    :param parallel: Number of units the function may work on at once
+    :type parallel: int
+    :param poll_interval: Shortest time between server status polls
+    :type poll_interval: float
+    :param cloud_args: Latency and failure settings of the fake cloud
+    :type cloud_args: Dict
+    :returns: Measurements
+    :rtype: Result
+    """
+    scenario = SCENARIOS[name]
+    cloud = fake_cloud.FakeCloud(**cloud_args)
+    scenario.setup(cloud, units)
+    undercloud_cache.get_cache().invalidate()
+    nova_client = fake_cloud.FakeNova(cloud)
+    neutron_client = fake_cloud.FakeNeutron(cloud)
+    with fake_backends(cloud, poll_interval):
+        tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            failed = scenario.run(nova_client, neutron_client, parallel)
+        except Exception as e:
+            LOG.error("{} with {} units failed: {}".format(
+                name,
+                units,
+                e))
+            failed = units
+        wall_time = time.perf_counter() - start
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return Result(
+        name,
+        units,
+        wall_time,
+        dict(cloud.calls),
+        peak_memory,
+        failed)
+
+
+def log_results(results, show_calls=False):
+    """Log a table of results.
+
+    :param results: Results
+    :type results: List[Result]
+    :param show_calls: Whether to log the count of each API call
+    :type show_calls: bool
+    """
+    LOG.info("{:<20} {:>6} {:>9} {:>9} {:>9} {:>7}".format(
+        'scenario', 'units', 'wall', 'calls', 'peak mem', 'failed'))
+    for result in results:
+        LOG.info(
+            "{:<20} {:>6} {:>8.2f}s {:>9} {:>6.1f}MiB {:>7}".format(
+                result.scenario,
+                result.units,
+                result.wall_time,
+                sum(result.calls.values()),
+                result.peak_memory / 2**20,
+                result.failed))
+        if show_calls:
+            for call, count in sorted(result.calls.items()):
+                LOG.info("    {:<40} {:>7}".format(call, count))
+
+
+def find_regressions(results, baseline, threshold):
+    """Compare results with those of an earlier run.
+
+    :param results: Results
+    :type results: List[Result]
+    :param baseline: Results of earlier run
+    :type baseline: List[Result]
+    :param threshold: Percentage increase tolerated
+    :type threshold: float
+    :returns: Description of each regression
+    :rtype: List[str]
+    """
+    previous = {(r.scenario, r.units): r for r in baseline}
+    regressions = []
+    for result in results:
+        base = previous.get((result.scenario, result.units))
+        if not base:
+            continue
+        # Small absolute changes of short runs are noise
+        for measure, value, base_value, noise in (
+                ('wall time', result.wall_time, base.wall_time, 0.1),
+                ('API calls', sum(result.calls.values()),
+                 sum(base.calls.values()), 0),
+                ('peak memory', result.peak_memory, base.peak_memory,
+                 2**20)):
+            if (base_value and value - base_value > noise and
+                    value > base_value * (1 + threshold / 100.0)):
+                regressions.append(
+                    "{} with {} units: {} up {:.0f}% ({:.6g} -> {:.6g})"
+                    "".format(
+                        result.scenario,
+                        result.units,
+                        measure,
+                        (value / base_value - 1) * 100,
+                        base_value,
+                        value))
+    return regressions
+
+
+def parse_failures(values):
+    """Parse CALL=PROBABILITY failure injection settings.
+
+    :param values: Settings
+    :type values: List[str]
+    :returns: Map of call name to probability of failing
+    :rtype: Dict[str, float]
+    """
+    failures = {}
+    for value in values or []:
+        call, _, probability = value.partition('=')
+        failures[call] = float(probability)
+    return failures
+
+
+def parse_args(args):
+    """Parse command line arguments.
+
+    :returns: Parsed arguments
+    :rtype: Namespace
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--scenario', dest='scenarios',
+                        help='Scenario to run, may be repeated: {}'.format(
+                            ', '.join(SCENARIOS)),
+                        choices=list(SCENARIOS),
+                        action='append')
+    parser.add_argument('-u', '--units', dest='units',
+                        help='Comma separated unit counts to run at')
+    parser.add_argument('--parallel', dest='parallel',
+                        help='Number of units to operate on at once',
+                        type=int)
+    parser.add_argument('--latency', dest='latency',
+                        help='Seconds each nova or neutron call takes',
+                        type=float)
+    parser.add_argument('--juju-latency', dest='juju_latency',
+                        help='Seconds each juju command or action takes',
+                        type=float)
+    parser.add_argument('--connect-latency', dest='connect_latency',
+                        help='Seconds connecting to the juju model takes',
+                        type=float)
+    parser.add_argument('--transition-delay', dest='transition_delay',
+                        help='Seconds a server or port state change takes',
+                        type=float)
+    parser.add_argument('--poll-interval', dest='poll_interval',
+                        help='Shortest time between server status polls',
+                        type=float)
+    parser.add_argument('--fail', dest='failures',
+                        help='CALL=PROBABILITY, inject failures of an API '
+                             'call, eg nova.servers.stop=0.01. CALL may be '
+                             '* for all calls or transition for state '
+                             'changes ending in error. May be repeated',
+                        action='append')
+    parser.add_argument('--seed', dest='seed',
+                        help='Seed of the failure injection',
+                        type=int)
+    parser.add_argument('--calls', dest='show_calls',
+                        help='Log the count of each API call',
+                        action='store_true')
+    parser.add_argument('-o', '--output', dest='output',
+                        help='JSON file to write results to')
+    parser.add_argument('-b', '--baseline', dest='baseline',
+                        help='JSON results of an earlier run to compare with, '
+                             'exits non zero on regressions')
+    parser.add_argument('-t', '--threshold', dest='threshold',
+                        help='Percentage increase over the baseline tolerated',
+                        type=float)
+    parser.add_argument('--log', dest='loglevel',
+                        help='Loglevel of the scripts being benchmarked '
+                             '[DEBUG|INFO|WARN|ERROR|CRITICAL]')
+    parser.set_defaults(
+        loglevel='WARNING',
+        units='10,100,1000',
+        parallel=20,
+        latency=0.002,
+        juju_latency=0.01,
+        connect_latency=0.05,
+        transition_delay=0.02,
+        poll_interval=0.01,
+        seed=0,
+        show_calls=False,
+        threshold=20)
+    return parser.parse_args(args)
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    logging.basicConfig(
+        level=args.loglevel.upper(),
+        format='%(asctime)s [%(levelname)s] %(message)s')
+    LOG.setLevel(logging.INFO)
+    results = []
+    for name in args.scenarios or list(SCENARIOS):
+        for units in [int(u) for u in args.units.split(',')]:
+            result = run_scenario(
+                name,
+                units,
+                args.parallel,
+                args.poll_interval,
+                latency=args.latency,
+                juju_latency=args.juju_latency,
+                connect_latency=args.connect_latency,
+                transition_delay=args.transition_delay,
+                failures=parse_failures(args.failures),
+                seed=args.seed)
+            LOG.info("{} with {} units took {:.2f}s".format(
+                name,
+                units,
+                result.wall_time))
+            results.append(result)
+    log_results(results, show_calls=args.show_calls)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump([r._asdict() for r in results], f, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = [Result(**r) for r in json.load(f)]
+        regressions = find_regressions(results, baseline, args.threshold)
+        for regression in regressions:
+            LOG.error(regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
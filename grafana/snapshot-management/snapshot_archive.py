@@ -0,0 +1,315 @@
+# An archive of Grafana snapshots which stores each dashboard model once and
+# the series data of each snapshot compressed with numeric arrays packed.
+#
+# Layout of an archive directory:
+#   index.json               snapshot key -> name, updated, dashboard, data
+#   dashboards/<sha256>.gz   dashboard model without snapshotData or the
+#                            fields which differ between snapshots
+#   data/<key>.<zst|gz>      compressed series data and snapshot fields of
+#                            one snapshot
+
+import array
+import gzip
+import hashlib
+import json
+import os
+import re
+import struct
+import sys
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+SAFE_FN = r"[^\w\d-]"
+INDEX_FILE = "index.json"
+DATA_MAGIC = b"GSNAPDAT"
+
+# Dashboard fields Grafana sets per snapshot, kept with the data of each
+# snapshot so snapshots of the same dashboard share one model
+SNAPSHOT_FIELDS = ("id", "uid", "version", "time", "snapshot", "iteration")
+
+# Largest magnitude of an integer which survives a round trip through float64
+MAX_EXACT_INT = 2 ** 53
+
+# Keep timestamp deltas within int64
+MAX_TIMESTAMP = 2 ** 62
+
+
+def compress(data, compression):
+    if compression == "zstd":
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data)
+
+
+def decompress(data, compression):
+    if compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is needed to read zstd compressed data")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def _canonical(obj):
+    return json.dumps(obj, sort_keys=True, separators=(",", ":")).encode()
+
+
+def strip_snapshot_data(obj, path=()):
+    """Remove snapshotData from every panel of a dashboard.
+
+    :returns: List of (path of panel, snapshotData) removed
+    """
+    found = []
+    if isinstance(obj, dict):
+        if "snapshotData" in obj:
+            found.append((list(path), obj.pop("snapshotData")))
+        for key, value in obj.items():
+            found.extend(strip_snapshot_data(value, path + (key,)))
+    elif isinstance(obj, list):
+        for i, value in enumerate(obj):
+            found.extend(strip_snapshot_data(value, path + (i,)))
+    return found
+
+
+def pop_snapshot_fields(dashboard):
+    """Remove the fields which differ between snapshots from a dashboard.
+
+    :returns: Map of field to value removed
+    """
+    return {
+        field: dashboard.pop(field)
+        for field in SNAPSHOT_FIELDS
+        if field in dashboard
+    }
+
+
+def _exact_number(value):
+    """Return whether a value is a number packing keeps exactly."""
+    if type(value) is float:
+        return True
+    return type(value) is int and abs(value) <= MAX_EXACT_INT
+
+
+def _packable(series):
+    """Return whether a series is a list of [value, timestamp] numbers.
+
+    Values are stored as float64, so series with integers too large for a
+    float64 to hold exactly are not packable.
+    """
+    if not isinstance(series, dict):
+        return False
+    if not isinstance(series.get("datapoints"), list):
+        return False
+    for point in series["datapoints"]:
+        if (
+            not isinstance(point, list)
+            or len(point) != 2
+            or type(point[1]) is not int
+            or abs(point[1]) > MAX_TIMESTAMP
+            or not (point[0] is None or _exact_number(point[0]))
+        ):
+            return False
+    return True
+
+
+def pack_data(meta, panels, fields=None):
+    """Pack the snapshotData and snapshot fields of a snapshot into bytes.
+
+    Series of [value, timestamp] pairs are stored as arrays of float64
+    values, with NaN for nulls, and int64 timestamp deltas. Anything else,
+    and the fields removed by pop_snapshot_fields, is kept as JSON in the
+    header.
+    """
+    blobs = []
+    offset = 0
+    header_panels = []
+    for path, snapshot_data in panels:
+        entries = []
+        for series in snapshot_data if isinstance(snapshot_data, list) else []:
+            if not _packable(series):
+                entries.append({"json": series})
+                continue
+            points = series["datapoints"]
+            values = array.array(
+                "d", [float("nan") if v is None else v for v, _ in points]
+            )
+            timestamps = [ts for _, ts in points]
+            deltas = array.array(
+                "q", [t - p for p, t in zip([0] + timestamps[:-1], timestamps)]
+            )
+            rest = {k: v for k, v in series.items() if k != "datapoints"}
+            entries.append(
+                {
+                    "series": rest,
+                    "offset": offset,
+                    "count": len(points),
+                    "int_values": all(
+                        type(v) is int for v, _ in points if v is not None
+                    ),
+                }
+            )
+            for packed in (values, deltas):
+                blob = packed.tobytes()
+                blobs.append(blob)
+                offset += len(blob)
+        if isinstance(snapshot_data, list):
+            header_panels.append({"path": path, "series": entries})
+        else:
+            header_panels.append({"path": path, "json": snapshot_data})
+    header = _canonical(
+        {
+            "meta": meta,
+            "fields": fields or {},
+            "panels": header_panels,
+            "byteorder": sys.byteorder,
+        }
+    )
+    return b"".join(
+        [DATA_MAGIC, struct.pack("<I", len(header)), header] + blobs
+    )
+
+
+def unpack_data(data):
+    """Reverse pack_data.
+
+    :returns: meta, list of (path of panel, snapshotData) and snapshot fields
+    """
+    if not data.startswith(DATA_MAGIC):
+        raise ValueError("Not packed snapshot data")
+    start = len(DATA_MAGIC) + 4
+    (length,) = struct.unpack("<I", data[len(DATA_MAGIC):start])
+    header = json.loads(data[start:start + length].decode())
+    body = memoryview(data)[start + length:]
+    swap = header["byteorder"] != sys.byteorder
+    panels = []
+    for panel in header["panels"]:
+        if "json" in panel:
+            panels.append((panel["path"], panel["json"]))
+            continue
+        snapshot_data = []
+        for entry in panel["series"]:
+            if "json" in entry:
+                snapshot_data.append(entry["json"])
+                continue
+            count = entry["count"]
+            values = array.array("d")
+            values.frombytes(body[entry["offset"]:entry["offset"] + 8 * count])
+            deltas = array.array("q")
+            deltas.frombytes(
+                body[entry["offset"] + 8 * count:entry["offset"] + 16 * count]
+            )
+            if swap:
+                values.byteswap()
+                deltas.byteswap()
+            points = []
+            timestamp = 0
+            for value, delta in zip(values, deltas):
+                timestamp += delta
+                if value != value:
+                    value = None
+                elif entry["int_values"]:
+                    value = int(value)
+                points.append([value, timestamp])
+            series = dict(entry["series"])
+            series["datapoints"] = points
+            snapshot_data.append(series)
+        panels.append((panel["path"], snapshot_data))
+    return header["meta"], panels, header.get("fields", {})
+
+
+def restore_snapshot_data(dashboard, panels):
+    for path, snapshot_data in panels:
+        obj = dashboard
+        for key in path:
+            obj = obj[key]
+        obj["snapshotData"] = snapshot_data
+    return dashboard
+
+
+def _write_atomic(path, data):
+    tmp = "{}.{}.tmp".format(path, threading.get_ident())
+    with open(tmp, "wb") as afile:
+        afile.write(data)
+    os.replace(tmp, path)
+
+
+class SnapshotArchive(object):
+    """A directory of deduplicated, compressed snapshots.
+
+    Adding snapshots is safe from several threads, the index is written by
+    save_index.
+    """
+
+    def __init__(self, path, compression=None):
+        self.path = path
+        self.compression = compression or ("zstd" if zstandard else "gzip")
+        for subdir in ("dashboards", "data"):
+            os.makedirs(os.path.join(path, subdir), exist_ok=True)
+        self.lock = threading.Lock()
+        index_path = os.path.join(path, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path, "r") as ifile:
+                self.index = json.load(ifile)
+        else:
+            self.index = {}
+
+    def save_index(self):
+        with self.lock:
+            data = json.dumps(self.index, indent=2, sort_keys=True).encode()
+        _write_atomic(os.path.join(self.path, INDEX_FILE), data)
+
+    def add(self, key, payload, name=None, updated=None):
+        """Add a snapshot as returned by /api/snapshots/<key>."""
+        dashboard = json.loads(_canonical(payload["dashboard"]))
+        panels = strip_snapshot_data(dashboard)
+        fields = pop_snapshot_fields(dashboard)
+        model = _canonical(dashboard)
+        digest = hashlib.sha256(model).hexdigest()
+        dashboard_path = os.path.join(self.path, "dashboards", digest + ".gz")
+        if not os.path.exists(dashboard_path):
+            _write_atomic(dashboard_path, gzip.compress(model))
+        extension = "zst" if self.compression == "zstd" else "gz"
+        data_file = "{}.{}".format(re.sub(SAFE_FN, "_", key), extension)
+        packed = pack_data(payload.get("meta", {}), panels, fields)
+        _write_atomic(
+            os.path.join(self.path, "data", data_file),
+            compress(packed, self.compression),
+        )
+        with self.lock:
+            previous = self.index.get(key, {}).get("data")
+            self.index[key] = {
+                "name": name or dashboard.get("title"),
+                "updated": updated,
+                "dashboard": digest,
+                "data": data_file,
+                "compression": self.compression,
+                "series": sum(
+                    len(d) for _, d in panels if isinstance(d, list)
+                ),
+            }
+        if previous and previous != data_file:
+            os.remove(os.path.join(self.path, "data", previous))
+
+    def entries(self):
+        with self.lock:
+            return dict(self.index)
+
+    def load_dashboard(self, digest):
+        path = os.path.join(self.path, "dashboards", digest + ".gz")
+        with open(path, "rb") as dfile:
+            return json.loads(gzip.decompress(dfile.read()).decode())
+
+    def extract(self, key):
+        """Rebuild the payload of a snapshot."""
+        entry = self.index[key]
+        with open(os.path.join(self.path, "data", entry["data"]), "rb") as dfile:
+            data = decompress(dfile.read(), entry["compression"])
+        meta, panels, fields = unpack_data(data)
+        dashboard = restore_snapshot_data(
+            self.load_dashboard(entry["dashboard"]), panels
+        )
+        dashboard.update(fields)
+        return {"meta": meta, "dashboard": dashboard}
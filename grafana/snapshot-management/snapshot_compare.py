@@ -0,0 +1,370 @@
+# Compare the series of two Grafana snapshots, eg a baseline benchmark run
+# and a candidate run, without needing access to Grafana or Prometheus.
+
+import collections
+import re
+
+import numpy as np
+
+Series = collections.namedtuple("Series", ["name", "metrics", "times", "values"])
+
+PROMQL_WORDS = {
+    "abs",
+    "avg",
+    "avg_over_time",
+    "bool",
+    "by",
+    "ceil",
+    "count",
+    "delta",
+    "deriv",
+    "floor",
+    "histogram_quantile",
+    "idelta",
+    "increase",
+    "irate",
+    "max",
+    "max_over_time",
+    "min",
+    "min_over_time",
+    "offset",
+    "on",
+    "quantile",
+    "quantile_over_time",
+    "rate",
+    "round",
+    "sum",
+    "sum_over_time",
+    "topk",
+    "bottomk",
+    "without",
+    "ignoring",
+    "group_left",
+    "group_right",
+}
+METRIC_RE = re.compile(r"([a-zA-Z_:][a-zA-Z0-9_:]*)\s*(\{|\[|\)|$|\s)")
+GROUPING_RE = r"\b(by|without|on|ignoring|group_left|group_right)\s*\([^)]*\)"
+LOWER_IS_BETTER = r"(lat|latency|clat|iowait)"
+
+
+def expr_metrics(expr):
+    """Return the metric names used in a PromQL expression."""
+    expr = re.sub(r"\{[^}]*\}", "{}", expr)
+    expr = re.sub(r"\[[^\]]*\]", "[]", expr)
+    expr = re.sub(GROUPING_RE, "", expr)
+    return sorted(
+        {
+            m
+            for m, _ in METRIC_RE.findall(expr)
+            if m not in PROMQL_WORDS and not m.startswith("$")
+        }
+    )
+
+
+def walk_panels(panels):
+    for panel in panels:
+        yield panel
+        for nested in walk_panels(panel.get("panels", [])):
+            yield nested
+
+
+def dashboard_panels(dashboard):
+    panels = list(walk_panels(dashboard.get("panels", [])))
+    for row in dashboard.get("rows", []):
+        panels.extend(walk_panels(row.get("panels", [])))
+    return panels
+
+
+def target_metrics(dashboards):
+    """Map panels and refIds to metric names for the targets of dashboards.
+
+    Snapshots do not keep panel targets, so the dashboards the snapshots
+    were taken from are used to find the metrics behind each series. Targets
+    are keyed by panel id and refId, and by panel title and refId where the
+    title is unique.
+
+    :returns: Map of ("id", panel id, refId) and ("title", panel title, refId)
+              to metric names
+    """
+    metrics = {}
+    titles = collections.defaultdict(set)
+    for dashboard in dashboards:
+        for panel in dashboard_panels(dashboard):
+            for target in panel.get("targets", []):
+                if "expr" not in target:
+                    continue
+                names = expr_metrics(target["expr"])
+                ref_id = target.get("refId")
+                metrics[("id", panel.get("id"), ref_id)] = names
+                titles[(panel.get("title"), ref_id)].add(tuple(names))
+    for (title, ref_id), names in titles.items():
+        if len(names) == 1:
+            metrics[("title", title, ref_id)] = list(names.pop())
+    return metrics
+
+
+def _series_metrics(metrics, panel, ref_id):
+    return metrics.get(
+        ("id", panel.get("id"), ref_id),
+        metrics.get(("title", panel.get("title"), ref_id), []),
+    )
+
+
+def _frame_series(frame):
+    """Yield (name, labels, times, values) from a data frame."""
+    fields = frame.get("fields", [])
+    times = [f for f in fields if f.get("type") == "time" or f.get("name") == "Time"]
+    if not times:
+        return
+    for field in fields:
+        if field is times[0] or field.get("type") not in ("number", None):
+            continue
+        name = (
+            field.get("config", {}).get("displayName")
+            or frame.get("name")
+            or field.get("name")
+        )
+        yield name, field.get("labels") or {}, times[0]["values"], field["values"]
+
+
+def _legacy_series(series):
+    points = series.get("datapoints", [])
+    return (
+        series.get("target"),
+        series.get("tags") or {},
+        [ts for _, ts in points],
+        [v for v, _ in points],
+    )
+
+
+def extract_series(payload, metrics=None):
+    """Extract every series of a snapshot as numpy arrays.
+
+    Times are seconds since the earliest sample of the snapshot, so that
+    runs made at different times can be aligned.
+
+    :param payload: Snapshot as returned by /api/snapshots/<key>, or just its
+                    dashboard
+    :param metrics: Map of (panel title, refId) to metric names
+    :returns: List of Series
+    """
+    dashboard = payload.get("dashboard", payload)
+    metrics = dict(metrics or {})
+    metrics.update(target_metrics([dashboard]))
+    raw = []
+    for panel in dashboard_panels(dashboard):
+        title = panel.get("title") or str(panel.get("id"))
+        for entry in panel.get("snapshotData") or []:
+            if "fields" in entry:
+                found = list(_frame_series(entry))
+            else:
+                found = [_legacy_series(entry)]
+            for name, labels, times, values in found:
+                if labels and len(found) > 1:
+                    name = "{}{{{}}}".format(
+                        name,
+                        ",".join(
+                            "{}={}".format(k, v) for k, v in sorted(labels.items())
+                        ),
+                    )
+                raw.append(
+                    (
+                        "{}/{}".format(title, str(name).strip()),
+                        _series_metrics(metrics, panel, entry.get("refId")),
+                        np.asarray(times, dtype=np.float64) / 1000.0,
+                        np.asarray(
+                            [np.nan if v is None else v for v in values],
+                            dtype=np.float64,
+                        ),
+                    )
+                )
+    starts = [times.min() for _, _, times, _ in raw if len(times)]
+    start = min(starts) if starts else 0.0
+    seen = collections.Counter()
+    series = []
+    for name, names, times, values in raw:
+        seen[name] += 1
+        if seen[name] > 1:
+            name = "{}#{}".format(name, seen[name])
+        order = np.argsort(times, kind="stable")
+        series.append(Series(name, names, times[order] - start, values[order]))
+    return series
+
+
+def steady_window(times, warmup=0.1, cooldown=0.1):
+    """Return a mask of the samples between warmup and cooldown.
+
+    warmup and cooldown are fractions of the run to discard at each end.
+    """
+    if not len(times):
+        return np.zeros(0, dtype=bool)
+    span = times[-1] - times[0]
+    return (times >= times[0] + span * warmup) & (times <= times[-1] - span * cooldown)
+
+
+def summarise(series, warmup=0.1, cooldown=0.1):
+    """Return summary statistics of a series."""
+    values = series.values[~np.isnan(series.values)]
+    if not len(values):
+        return None
+    steady = series.values[steady_window(series.times, warmup, cooldown)]
+    steady = steady[~np.isnan(steady)]
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {
+        "count": int(len(values)),
+        "mean": float(values.mean()),
+        "median": float(p50),
+        "p90": float(p90),
+        "p99": float(p99),
+        "max": float(values.max()),
+        "steady_mean": float(steady.mean()) if len(steady) else float(values.mean()),
+    }
+
+
+def _interp(series, grid):
+    ok = ~np.isnan(series.values)
+    if ok.sum() < 2:
+        return np.full(len(grid), np.nan)
+    return np.interp(
+        grid, series.times[ok], series.values[ok], left=np.nan, right=np.nan
+    )
+
+
+def aligned_change(baseline, candidate):
+    """Return the median relative change between two series over time.
+
+    Both series are interpolated onto a common grid of relative times
+    covering the part of the run they both have samples for.
+    """
+    if len(baseline.times) < 2 or len(candidate.times) < 2:
+        return np.nan
+    step = max(np.median(np.diff(baseline.times)), np.median(np.diff(candidate.times)))
+    end = min(baseline.times[-1], candidate.times[-1])
+    start = max(baseline.times[0], candidate.times[0])
+    if step <= 0 or end <= start:
+        return np.nan
+    grid = np.arange(start, end + step / 2, step)
+    base = _interp(baseline, grid)
+    cand = _interp(candidate, grid)
+    ok = ~np.isnan(base) & ~np.isnan(cand) & (base != 0)
+    if not ok.any():
+        return np.nan
+    return float(np.median((cand[ok] - base[ok]) / np.abs(base[ok])) * 100)
+
+
+def compare(
+    baseline,
+    candidate,
+    pattern=None,
+    threshold=5.0,
+    warmup=0.1,
+    cooldown=0.1,
+    lower_is_better=LOWER_IS_BETTER,
+):
+    """Compare the series two snapshots have in common.
+
+    :param baseline: Series of the baseline run
+    :param candidate: Series of the candidate run
+    :param pattern: Regex matching the names or metrics of series to compare
+    :param threshold: Percentage change in the steady state mean beyond which
+                      a series has regressed
+    :param lower_is_better: Regex matching series where a decrease is an
+                            improvement
+    :returns: List of comparisons, one dict per series
+    """
+    candidates = {s.name: s for s in candidate}
+    results = []
+    for base in baseline:
+        cand = candidates.get(base.name)
+        if cand is None:
+            continue
+        if pattern and not any(
+            re.search(pattern, n) for n in [base.name] + list(base.metrics)
+        ):
+            continue
+        base_summary = summarise(base, warmup, cooldown)
+        cand_summary = summarise(cand, warmup, cooldown)
+        if not base_summary or not cand_summary:
+            continue
+        lower = any(
+            re.search(lower_is_better, n, re.IGNORECASE)
+            for n in [base.name] + list(base.metrics)
+        )
+        if base_summary["steady_mean"]:
+            change = (
+                (cand_summary["steady_mean"] - base_summary["steady_mean"])
+                / abs(base_summary["steady_mean"])
+                * 100
+            )
+        else:
+            change = np.nan
+        worse = -change if not lower else change
+        if np.isnan(change) or abs(change) <= threshold:
+            verdict = "same"
+        elif worse > 0:
+            verdict = "REGRESSION"
+        else:
+            verdict = "better"
+        results.append(
+            {
+                "series": base.name,
+                "metrics": list(base.metrics),
+                "lower_is_better": lower,
+                "baseline": base_summary,
+                "candidate": cand_summary,
+                "change": float(change),
+                "aligned_change": aligned_change(base, cand),
+                "verdict": verdict,
+            }
+        )
+    return results
+
+
+def json_results(results):
+    """Return comparisons with NaN, which JSON cannot represent, as None.
+
+    Changes are NaN where a series has nothing to compare against, eg a zero
+    baseline or runs which do not overlap.
+    """
+
+    def _clean(value):
+        if isinstance(value, dict):
+            return {k: _clean(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [_clean(v) for v in value]
+        if isinstance(value, float) and np.isnan(value):
+            return None
+        return value
+
+    return _clean(results)
+
+
+def comparison_table(results):
+    header = "{:<50} {:>12} {:>12} {:>8} {:>8} {:>12} {:>12}  {}".format(
+        "series",
+        "base steady",
+        "cand steady",
+        "change%",
+        "aligned%",
+        "base p99",
+        "cand p99",
+        "verdict",
+    )
+    lines = [header, "-" * len(header)]
+    for r in results:
+        lines.append(
+            (
+                "{:<50} {:>12.4g} {:>12.4g} {:>8.1f} {:>8.1f} {:>12.4g} "
+                "{:>12.4g}  {}"
+            ).format(
+                r["series"][:50],
+                r["baseline"]["steady_mean"],
+                r["candidate"]["steady_mean"],
+                r["change"],
+                r["aligned_change"],
+                r["baseline"]["p99"],
+                r["candidate"]["p99"],
+                r["verdict"],
+            )
+        )
+    return "\n".join(lines)
@@ -0,0 +1,248 @@
+"""Share one juju model connection between all the juju calls of a run.
+
+The zaza.model sync wrappers each set up and tear down a model connection,
+which dominates the time of scripts making hundreds of calls. Here one
+libjuju model connection is opened in a background event loop thread the
+first time it is needed and kept until exit. Units and machines are read
+from the model state libjuju keeps up to date, and commands and actions
+started from any thread or event loop are multiplexed over the connection.
+"""
+
+import asyncio
+import atexit
+import collections
+import logging
+import os
+import threading
+
+import juju.model
+
+import tracing
+
+
+UnitMachine = collections.namedtuple(
+    'UnitMachine',
+    ['unit_name', 'machine_id', 'instance_id'])
+
+ModelSnapshot = collections.namedtuple(
+    'ModelSnapshot',
+    ['units', 'machines', 'unit_machines'])
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class Session(object):
+    """A juju model connection served by a background event loop."""
+
+    def __init__(self, model_name=None):
+        """Connect to model.
+
+        :param model_name: Name of model, defaults to $JUJU_MODEL or the
+                           current model
+        :type model_name: Union[str, None]
+        """
+        self.model_name = model_name or os.environ.get('JUJU_MODEL')
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self.loop.run_forever,
+            name='juju-session',
+            daemon=True)
+        self.thread.start()
+        try:
+            with tracing.span('juju.connect'):
+                self.model = self.run(self._connect())
+        except Exception:
+            self._stop()
+            raise
+        # libjuju builds every unit object on each access of model.units
+        self.units = {}
+        logging.debug("Connected to model {}".format(
+            self.model_name or 'current'))
+
+    async def _connect(self):
+        model = juju.model.Model()
+        if self.model_name:
+            await model.connect(self.model_name)
+        else:
+            await model.connect()
+        return model
+
+    def run(self, coro):
+        """Run a coroutine on the connection loop and return its result.
+
+        :param coro: Coroutine
+        :type coro: Coroutine
+        :returns: Result of coroutine
+        :rtype: Any
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def async_run(self, coro):
+        """Await a coroutine run on the connection loop from another loop.
+
+        :param coro: Coroutine
+        :type coro: Coroutine
+        :returns: Result of coroutine
+        :rtype: Any
+        """
+        return await asyncio.wrap_future(
+            asyncio.run_coroutine_threadsafe(coro, self.loop))
+
+    def close(self):
+        """Disconnect from the model and stop the loop."""
+        if self.loop.is_closed():
+            return
+        try:
+            self.run(self.model.disconnect())
+        finally:
+            self._stop()
+
+    def _stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def snapshot(self, application_name):
+        """Return the units and machines of an application.
+
+        :param application_name: Name of application
+        :type application_name: str
+        :returns: Units, machines and the map of unit to machine and
+                  instance id
+        :rtype: ModelSnapshot
+        """
+        units = list(self.model.applications[application_name].units)
+        self.units.update({unit.entity_id: unit for unit in units})
+        machines = []
+        unit_machines = {}
+        for unit in units:
+            machine = unit.machine
+            machines.append(machine)
+            unit_machines[unit.entity_id] = UnitMachine(
+                unit.entity_id,
+                machine.entity_id,
+                machine.data.get('instance-id'))
+        return ModelSnapshot(units, machines, unit_machines)
+
+    def get_unit(self, unit_name):
+        """Return a unit of the model.
+
+        :param unit_name: Name of unit
+        :type unit_name: str
+        :returns: Unit
+        :rtype: juju.unit.Unit
+        """
+        if unit_name not in self.units:
+            self.units = self.model.units
+        return self.units[unit_name]
+
+    async def _run_on_unit(self, unit_name, command, timeout=None):
+        unit = self.get_unit(unit_name)
+        action = await unit.run(command, timeout=timeout)
+        await action.wait()
+        results = dict(
+            getattr(action, 'results', None) or
+            action.data.get('results') or {})
+        # Juju 3 reports lower case keys and a numeric return code
+        for key, old_key in (('Code', 'return-code'),
+                             ('Stdout', 'stdout'),
+                             ('Stderr', 'stderr')):
+            if old_key in results:
+                results.setdefault(key, results.pop(old_key))
+        if 'Code' in results:
+            results['Code'] = str(results['Code'])
+        return results
+
+    async def _run_action(self, unit_name, action_name, action_params=None):
+        unit = self.get_unit(unit_name)
+        action = await unit.run_action(action_name, **(action_params or {}))
+        await action.wait()
+        results = getattr(action, 'results', None)
+        if results and 'results' not in action.data:
+            action.data['results'] = results
+        return action
+
+
+def get_session():
+    """Return the session of this run, connecting on first use.
+
+    :returns: Session
+    :rtype: Session
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = Session()
+            atexit.register(_session.close)
+        return _session
+
+
+def snapshot(application_name):
+    """Return the units and machines of an application.
+
+    :param application_name: Name of application
+    :type application_name: str
+    :returns: Units, machines and the map of unit to machine and instance id
+    :rtype: ModelSnapshot
+    """
+    return get_session().snapshot(application_name)
+
+
+def get_units(application_name):
+    """Return the units of an application.
+
+    :param application_name: Name of application
+    :type application_name: str
+    :returns: Units
+    :rtype: List[juju.unit.Unit]
+    """
+    return snapshot(application_name).units
+
+
+def get_machines(application_name):
+    """Return the machines of the units of an application.
+
+    :param application_name: Name of application
+    :type application_name: str
+    :returns: Machines
+    :rtype: List[juju.machine.Machine]
+    """
+    return snapshot(application_name).machines
+
+
+async def async_run_on_unit(unit_name, command, timeout=None):
+    """Run a command on a unit over the shared connection.
+
+    :param unit_name: Name of unit
+    :type unit_name: str
+    :param command: Command to run
+    :type command: str
+    :param timeout: Seconds to allow the command to run
+    :type timeout: Union[int, None]
+    :returns: Results {'Code': '', 'Stderr': '', 'Stdout': ''}
+    :rtype: Dict[str, str]
+    """
+    session = get_session()
+    return await session.async_run(
+        session._run_on_unit(unit_name, command, timeout=timeout))
+
+
+async def async_run_action(unit_name, action_name, action_params=None):
+    """Run an action on a unit over the shared connection and wait for it.
+
+    :param unit_name: Name of unit
+    :type unit_name: str
+    :param action_name: Name of action
+    :type action_name: str
+    :param action_params: Parameters for action
+    :type action_params: Union[Dict, None]
+    :returns: Finished action
+    :rtype: juju.action.Action
+    """
+    session = get_session()
+    return await session.async_run(
+        session._run_action(
+            unit_name,
+            action_name,
+            action_params=action_params))
@@ -0,0 +1,387 @@
+#!/usr/bin/python3
+# Load fio JSON results into a columnar store and compare devices
+
+import argparse
+import json
+import os
+import re
+
+import numpy as np
+
+
+RESULT_DTYPE = np.dtype([
+    ('device', 'U32'),
+    ('operation', 'U16'),
+    ('block_size', 'U8'),
+    ('job', 'U32'),
+    ('direction', 'U8'),
+    ('numjobs', 'i4'),
+    ('iodepth', 'i4'),
+    ('io_bytes', 'i8'),
+    ('runtime_ms', 'f8'),
+    ('iops', 'f8'),
+    ('bw_bytes', 'f8'),
+    ('clat_mean_ns', 'f8'),
+    ('clat_p50_ns', 'f8'),
+    ('clat_p90_ns', 'f8'),
+    ('clat_p99_ns', 'f8'),
+    ('clat_p99_9_ns', 'f8'),
+])
+
+PERCENTILES = {
+    'clat_p50_ns': '50.000000',
+    'clat_p90_ns': '90.000000',
+    'clat_p99_ns': '99.000000',
+    'clat_p99_9_ns': '99.900000',
+}
+
+DIRECTIONS = ('read', 'write', 'trim')
+
+RESULT_FILE_RE = re.compile(
+    r'^(?P<device>.+)-(?P<operation>[a-z]+)-(?P<block_size>[0-9]+[kKmM]?)'
+    r'\.json$')
+
+DEVICE_ORDER = ('hdd', 'ssd', 'optane')
+
+READ_SIZE = 2 ** 16
+
+
+class _JSONStream(object):
+    """Decode JSON values from a file without reading all of it.
+
+    :param fp: File to read
+    :type fp: io.TextIOBase
+    """
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.buffer = ''
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        """Read more of the file, at least as much as is buffered.
+
+        Reading more each time a value does not fit keeps decoding a large
+        value linear in its size.
+        """
+        pending = self.buffer[self.pos:]
+        chunk = self.fp.read(max(READ_SIZE, len(pending)))
+        if not chunk:
+            return False
+        self.buffer = pending + chunk
+        self.pos = 0
+        return True
+
+    def skip_to(self, char):
+        """Skip any text before char."""
+        while True:
+            index = self.buffer.find(char, self.pos)
+            if index >= 0:
+                self.pos = index
+                return
+            self.pos = len(self.buffer)
+            if not self._fill():
+                raise ValueError('No {} in fio output'.format(char))
+
+    def peek(self):
+        """Return the next character which is not whitespace."""
+        while True:
+            while (self.pos < len(self.buffer) and
+                   self.buffer[self.pos].isspace()):
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                raise ValueError('Unexpected end of fio output')
+
+    def expect(self, chars):
+        """Consume the next character, which must be one of chars."""
+        char = self.peek()
+        if char not in chars:
+            raise ValueError('Expected {} in fio output, found {}'.format(
+                ' or '.join(chars),
+                char))
+        self.pos += 1
+        return char
+
+    def value(self):
+        """Decode the next value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number may carry on in the next chunk
+            if end == len(self.buffer) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def items(self):
+        """Yield the keys and values of the object which comes next."""
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key, self.value() if key != 'jobs' else self.elements()
+            if self.expect(',}') == '}':
+                return
+
+    def elements(self):
+        """Yield the values of the array which comes next."""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(',]') == ']':
+                return
+
+
+def _iter_json(path):
+    """Yield the top level keys and values of a fio JSON output file.
+
+    Any text fio wrote before the JSON is skipped. The value of jobs is an
+    iterator over the jobs which decodes one job at a time, so memory use is
+    bounded by the largest job rather than the whole file. It must be
+    consumed before moving on to the next key.
+    """
+    with open(path, 'r') as fp:
+        stream = _JSONStream(fp)
+        stream.skip_to('{')
+        for key, value in stream.items():
+            yield key, value
+            if key == 'jobs':
+                # Consume any jobs the caller did not
+                for _ in value:
+                    pass
+
+
+def _clat(stats):
+    """Return completion latency stats in nanoseconds."""
+    if 'clat_ns' in stats:
+        return stats['clat_ns'], 1
+    return stats.get('clat', {}), 1000
+
+
+def parse_result_file(path, device=None, operation=None, block_size=None):
+    """Return one row per job and direction of a fio JSON output file.
+
+    Device, operation and block size default to those in file names of the
+    form device-operation-blocksize.json as written by run-fio-tests.sh.
+    The file is decoded one job at a time and only the fields needed for
+    RESULT_DTYPE are kept, the rest of each job, including latency
+    histograms, is discarded once it has been parsed.
+
+    :param path: Path of fio JSON output
+    :type path: str
+    :param device: Device name
+    :type device: Union[str, None]
+    :param operation: fio operation
+    :type operation: Union[str, None]
+    :param block_size: fio block size
+    :type block_size: Union[str, None]
+    :returns: Result rows
+    :rtype: List[Tuple]
+    """
+    match = RESULT_FILE_RE.match(os.path.basename(path))
+    if match:
+        device = device or match.group('device')
+        operation = operation or match.group('operation')
+        block_size = block_size or match.group('block_size')
+    global_options = {}
+    rows = []
+    for name, value in _iter_json(path):
+        if name == 'global options':
+            global_options = value
+        if name != 'jobs':
+            continue
+        # fio writes the global options before the jobs
+        for job in value:
+            options = dict(global_options)
+            options.update(job.get('job options', {}))
+            for direction in DIRECTIONS:
+                stats = job.get(direction)
+                if not stats or not stats.get('io_bytes'):
+                    continue
+                clat, scale = _clat(stats)
+                percentiles = clat.get('percentile', {})
+                rows.append((
+                    device or '',
+                    operation or options.get('rw', ''),
+                    block_size or options.get('bs', ''),
+                    job.get('jobname', ''),
+                    direction,
+                    int(options.get('numjobs', 1)),
+                    int(options.get('iodepth', 1)),
+                    stats['io_bytes'],
+                    stats.get('runtime', 0),
+                    stats.get('iops', 0),
+                    stats.get('bw_bytes', stats.get('bw', 0) * 1024),
+                    clat.get('mean', np.nan) * scale) + tuple(
+                        percentiles.get(key, np.nan) * scale
+                        for key in PERCENTILES.values()))
+    return rows
+
+
+def load_results(paths):
+    """Load fio JSON output files into a structured array.
+
+    Files are parsed one at a time so only one is held in memory.
+
+    :param paths: Paths of fio JSON output
+    :type paths: List[str]
+    :returns: Results
+    :rtype: numpy.ndarray
+    """
+    rows = []
+    for path in paths:
+        rows.extend(parse_result_file(path))
+    return np.array(rows, dtype=RESULT_DTYPE)
+
+
+def save_store(path, results):
+    """Save results to a .npy store."""
+    np.save(path, results, allow_pickle=False)
+
+
+def load_store(path):
+    """Load results from a .npy store."""
+    return np.load(path, allow_pickle=False)
+
+
+def aggregate(results, keys=('device', 'operation', 'block_size',
+                             'direction')):
+    """Aggregate results across jobs.
+
+    IOPS and bandwidth are summed, mean latency is weighted by IOPS and
+    latency percentiles are the worst of any job.
+
+    :param results: Results
+    :type results: numpy.ndarray
+    :param keys: Fields to group by
+    :type keys: Tuple[str]
+    :returns: Aggregated results, one row per group
+    :rtype: numpy.ndarray
+    """
+    if not len(results):
+        return results[:0]
+    group_keys = np.rec.fromarrays([results[k] for k in keys], names=keys)
+    groups, inverse = np.unique(group_keys, return_inverse=True)
+    count = len(groups)
+    out = np.zeros(count, dtype=RESULT_DTYPE)
+    for k in keys:
+        out[k] = groups[k]
+    for field in ('io_bytes', 'iops', 'bw_bytes'):
+        out[field] = np.bincount(
+            inverse,
+            weights=results[field],
+            minlength=count)
+    out['numjobs'] = np.bincount(
+        inverse,
+        weights=results['numjobs'],
+        minlength=count)
+    runtime = np.full(count, -np.inf)
+    np.maximum.at(runtime, inverse, results['runtime_ms'])
+    out['runtime_ms'] = runtime
+    weights = np.bincount(inverse, weights=results['iops'], minlength=count)
+    weighted = np.bincount(
+        inverse,
+        weights=np.nan_to_num(results['clat_mean_ns']) * results['iops'],
+        minlength=count)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        out['clat_mean_ns'] = weighted / weights
+    for field in PERCENTILES:
+        worst = np.full(count, -np.inf)
+        np.fmax.at(worst, inverse, results[field])
+        worst[np.isinf(worst)] = np.nan
+        out[field] = worst
+    out['iodepth'] = results['iodepth'][
+        np.unique(inverse, return_index=True)[1]]
+    return out
+
+
+def device_sort_key(device):
+    """Order devices hdd, ssd, optane then bcache devices."""
+    if device in DEVICE_ORDER:
+        return (DEVICE_ORDER.index(device), device)
+    return (len(DEVICE_ORDER), device)
+
+
+def comparison_table(results, per_job=False):
+    """Return a text table comparing devices for each workload.
+
+    :param results: Results
+    :type results: numpy.ndarray
+    :param per_job: Whether to show each job rather than totals per device
+    :type per_job: bool
+    :returns: Table
+    :rtype: str
+    """
+    keys = ('device', 'operation', 'block_size', 'direction')
+    if per_job:
+        keys += ('job',)
+    totals = aggregate(results, keys)
+    header = '{:<10} {:<10} {:>5} {:<6} {:>10} {:>10} {:>10} {:>10} ' \
+        '{:>10}'.format(
+            'device', 'operation', 'bs', 'dir', 'IOPS', 'MiB/s',
+            'mean ms', 'p99 ms', 'p99.9 ms')
+    if per_job:
+        header += ' job'
+    lines = [header, '-' * len(header)]
+    order = sorted(
+        range(len(totals)),
+        key=lambda i: (
+            totals['operation'][i],
+            totals['block_size'][i],
+            totals['direction'][i],
+            device_sort_key(totals['device'][i]),
+            totals['job'][i]))
+    for i in order:
+        row = totals[i]
+        line = (
+            '{:<10} {:<10} {:>5} {:<6} {:>10.0f} {:>10.1f} {:>10.3f} '
+            '{:>10.3f} {:>10.3f}'.format(
+                row['device'],
+                row['operation'],
+                row['block_size'],
+                row['direction'],
+                row['iops'],
+                row['bw_bytes'] / 2 ** 20,
+                row['clat_mean_ns'] / 1e6,
+                row['clat_p99_ns'] / 1e6,
+                row['clat_p99_9_ns'] / 1e6))
+        if per_job:
+            line += ' {}'.format(row['job'])
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Compare fio JSON results across devices')
+    parser.add_argument('files', nargs='*',
+                        help='fio JSON output files')
+    parser.add_argument('--store',
+                        help='.npy store to save results to, or load them '
+                             'from if no files are given')
+    parser.add_argument('--per-job', action='store_true',
+                        help='Show each job rather than totals per device')
+    args = parser.parse_args()
+    if args.files:
+        results = load_results(args.files)
+        if args.store:
+            save_store(args.store, results)
+    elif args.store:
+        results = load_store(args.store)
+    else:
+        parser.error('No fio result files or store given')
+    print(comparison_table(results, per_job=args.per_job))
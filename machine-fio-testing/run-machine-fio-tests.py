@@ -0,0 +1,329 @@
+#!/usr/bin/python3
+# Run fio against the devices in fio.conf, in parallel where they do not
+# share any underlying disk.
+
+import argparse
+import collections
+import concurrent.futures
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+import time
+
+
+Section = collections.namedtuple('Section', ['name', 'filename'])
+Workload = collections.namedtuple(
+    'Workload',
+    ['operation', 'block_size', 'numjobs'])
+Job = collections.namedtuple('Job', ['section', 'workload', 'disks'])
+
+WORKLOADS = [
+    Workload('randread', '4k', 8),
+    Workload('randwrite', '4k', 8),
+    Workload('read', '128k', 1),
+    Workload('write', '128k', 1),
+]
+
+SECTION_RE = re.compile(r'^\[job (?P<name>[^\]]+)\]$')
+
+
+def read_sections(config):
+    """Return the job sections of a fio config file.
+
+    :param config: Path of fio config
+    :type config: str
+    :returns: Job sections in file order
+    :rtype: List[Section]
+    """
+    sections = []
+    name = None
+    with open(config, 'r') as fp:
+        for line in fp:
+            line = line.strip()
+            match = SECTION_RE.match(line)
+            if match:
+                name = match.group('name')
+            elif line.startswith('['):
+                name = None
+            elif name and line.startswith('filename='):
+                sections.append(Section(name, line.split('=', 1)[1]))
+    names = [s.name for s in sections]
+    for duplicate in set(n for n in names if names.count(n) > 1):
+        raise ValueError(
+            'Section "job {}" is defined more than once in {}'.format(
+                duplicate,
+                config))
+    return sections
+
+
+def _disk_of(name, sysfs):
+    """Return the whole disk a block device or partition is on."""
+    path = os.path.realpath(os.path.join(sysfs, 'class', 'block', name))
+    if os.path.exists(os.path.join(path, 'partition')):
+        return os.path.basename(os.path.dirname(path))
+    return name
+
+
+def get_disks(filename, sysfs='/sys'):
+    """Return the disks that IO to a device ends up on.
+
+    For bcache devices this is the backing device and the cache devices
+    of its cache set, as well as the bcache device itself.
+
+    :param filename: Path of block device
+    :type filename: str
+    :param sysfs: Path sysfs is mounted on
+    :type sysfs: str
+    :returns: Names of disks
+    :rtype: Set[str]
+    """
+    name = os.path.basename(os.path.realpath(filename))
+    disks = {name}
+    block = os.path.join(sysfs, 'block', name)
+    slaves = os.path.join(block, 'slaves')
+    if os.path.isdir(slaves):
+        disks.update(_disk_of(s, sysfs) for s in os.listdir(slaves))
+    cache_set = os.path.join(block, 'bcache', 'cache')
+    if os.path.isdir(cache_set):
+        for entry in os.listdir(cache_set):
+            if re.match(r'^cache\d+$', entry):
+                cache_dev = os.path.dirname(os.path.realpath(
+                    os.path.join(cache_set, entry)))
+                disks.add(_disk_of(os.path.basename(cache_dev), sysfs))
+    return disks
+
+
+def fio_command(config, job, runtime, output, steadystate=None,
+                steadystate_duration=60, steadystate_ramp_time=30):
+    """Return the fio command for a job.
+
+    :param config: Path of fio config
+    :type config: str
+    :param job: Job to run
+    :type job: Job
+    :param runtime: Maximum seconds to run for
+    :type runtime: int
+    :param output: Path to write JSON results to
+    :type output: str
+    :param steadystate: fio steadystate criterion eg iops_slope:0.1%
+    :type steadystate: Union[str, None]
+    :param steadystate_duration: Seconds the criterion must hold for
+    :type steadystate_duration: int
+    :param steadystate_ramp_time: Seconds before steady state is checked
+    :type steadystate_ramp_time: int
+    :returns: Command
+    :rtype: List[str]
+    """
+    cmd = [
+        'fio',
+        '--bs={}'.format(job.workload.block_size),
+        '--numjobs={}'.format(job.workload.numjobs),
+        '--rw={}'.format(job.workload.operation),
+        '--section', 'job {}'.format(job.section.name),
+        '--runtime={}'.format(runtime),
+        '--time_based',
+        '--output-format=json',
+        '--output={}'.format(output)]
+    if steadystate:
+        cmd.extend([
+            '--steadystate={}'.format(steadystate),
+            '--steadystate_duration={}'.format(steadystate_duration),
+            '--steadystate_ramp_time={}'.format(steadystate_ramp_time)])
+    cmd.append(config)
+    return cmd
+
+
+def output_name(job):
+    """Return the name of the JSON output file for a job."""
+    return '{}-{}-{}.json'.format(
+        job.section.name,
+        job.workload.operation,
+        job.workload.block_size)
+
+
+def _steadystate_attained(output):
+    """Return whether fio reported steady state in its JSON output."""
+    try:
+        with open(output, 'r') as fp:
+            text = fp.read()
+        data = json.loads(text[text.index('{'):])
+    except (OSError, ValueError):
+        return None
+    states = [job['steadystate'].get('attained')
+              for job in data.get('jobs', []) if 'steadystate' in job]
+    if not states:
+        return None
+    return all(states)
+
+
+def run_job(cmd, output):
+    """Run fio and return a record of the run.
+
+    :param cmd: fio command
+    :type cmd: List[str]
+    :param output: Path fio writes JSON results to
+    :type output: str
+    :returns: Record of run
+    :rtype: Dict
+    """
+    start = time.time()
+    proc = subprocess.run(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        universal_newlines=True)
+    return {
+        'returncode': proc.returncode,
+        'started': start,
+        'duration': time.time() - start,
+        'steadystate_attained': _steadystate_attained(output),
+        'log': proc.stdout[-2000:] if proc.returncode else ''}
+
+
+def schedule(jobs, run, parallel):
+    """Run jobs in parallel, never running two jobs sharing a disk at once.
+
+    :param jobs: Jobs to run in order of preference
+    :type jobs: List[Job]
+    :param run: Function which runs a job and returns its record
+    :type run: Callable[[Job], Dict]
+    :param parallel: Maximum number of jobs to run at once
+    :type parallel: int
+    :returns: List of (job, record) in completion order
+    :rtype: List[Tuple[Job, Dict]]
+    """
+    queued = list(jobs)
+    busy = set()
+    records = []
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=parallel) as executor:
+        running = {}
+        while queued or running:
+            for job in list(queued):
+                if len(running) >= parallel:
+                    break
+                if job.disks & busy:
+                    continue
+                queued.remove(job)
+                busy |= job.disks
+                running[executor.submit(run, job)] = job
+            done, _ = concurrent.futures.wait(
+                running,
+                return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                job = running.pop(future)
+                busy -= job.disks
+                records.append((job, future.result()))
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run fio against the devices in a fio config')
+    parser.add_argument('-c', '--config', default='fio.conf',
+                        help='fio config file')
+    parser.add_argument('-d', '--devices', nargs='*',
+                        help='Sections to run, defaults to all')
+    parser.add_argument('-r', '--runtime', type=int, default=360,
+                        help='Maximum seconds to run each job for')
+    parser.add_argument('-s', '--steadystate', default='iops_slope:0.1%',
+                        help='fio steadystate criterion to stop jobs early, '
+                             'empty to always run for the full runtime')
+    parser.add_argument('--steadystate-duration', type=int, default=60,
+                        help='Seconds the steady state criterion must hold')
+    parser.add_argument('--steadystate-ramp-time', type=int, default=30,
+                        help='Seconds before steady state is checked')
+    parser.add_argument('-p', '--parallel', type=int, default=8,
+                        help='Maximum number of devices to test at once')
+    parser.add_argument('-o', '--output-dir', default='.',
+                        help='Directory to write results to')
+    parser.add_argument('--sysfs', default='/sys',
+                        help='Path sysfs is mounted on')
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help='Log the commands and schedule only')
+    parser.add_argument('--log', dest='loglevel', default='INFO',
+                        help='Loglevel [DEBUG|INFO|WARN|ERROR|CRITICAL]')
+    args = parser.parse_args()
+    logging.basicConfig(
+        format='%(asctime)s [%(levelname)s] %(message)s',
+        level=args.loglevel.upper())
+
+    sections = read_sections(args.config)
+    if args.devices:
+        sections = [s for s in sections if s.name in args.devices]
+    jobs = []
+    for workload in WORKLOADS:
+        for section in sections:
+            jobs.append(Job(
+                section,
+                workload,
+                frozenset(get_disks(section.filename, args.sysfs))))
+    first_jobs = jobs[:len(sections)]
+    for i, job in enumerate(first_jobs):
+        for other in first_jobs[:i]:
+            if other.disks & job.disks:
+                logging.info(
+                    'Not running {} and {} at the same time, they share '
+                    '{}'.format(
+                        job.section.name,
+                        other.section.name,
+                        ', '.join(sorted(other.disks & job.disks))))
+
+    if not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    def _command(job):
+        output = os.path.join(args.output_dir, output_name(job))
+        return fio_command(
+            args.config,
+            job,
+            args.runtime,
+            output,
+            steadystate=args.steadystate or None,
+            steadystate_duration=args.steadystate_duration,
+            steadystate_ramp_time=args.steadystate_ramp_time), output
+
+    def _run(job):
+        cmd, output = _command(job)
+        logging.info('Running {}'.format(' '.join(cmd)))
+        if args.dry_run:
+            return {'returncode': 0, 'dry_run': True}
+        record = run_job(cmd, output)
+        log = logging.error if record['returncode'] else logging.info
+        log('Finished {} {} {} in {:.0f}s{}'.format(
+            job.section.name,
+            job.workload.operation,
+            job.workload.block_size,
+            record['duration'],
+            ', fio exited {}'.format(record['returncode'])
+            if record['returncode'] else ''))
+        return record
+
+    results = []
+    for job, record in schedule(jobs, _run, args.parallel):
+        cmd, output = _command(job)
+        record.update({
+            'section': job.section.name,
+            'filename': job.section.filename,
+            'disks': sorted(job.disks),
+            'operation': job.workload.operation,
+            'block_size': job.workload.block_size,
+            'numjobs': job.workload.numjobs,
+            'runtime': args.runtime,
+            'steadystate': args.steadystate or None,
+            'steadystate_duration': args.steadystate_duration,
+            'steadystate_ramp_time': args.steadystate_ramp_time,
+            'command': cmd,
+            'output': output})
+        results.append(record)
+    with open(os.path.join(args.output_dir, 'runs.json'), 'w') as fp:
+        json.dump(results, fp, indent=2, sort_keys=True)
+    if any(r['returncode'] for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
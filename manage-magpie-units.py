@@ -1,23 +1,37 @@
 #!/usr/bin/env python3
 
 import argparse
+import asyncio
 import collections
+import concurrent.futures
 import copy
+import itertools
 import logging
 import subprocess
 import sys
 import time
 
-import zaza.model
 import zaza.utilities.cli as cli_utils
-import zaza.utilities.juju as zaza_juju
 import zaza.openstack.utilities.openstack as zaza_os
 import novaclient.exceptions
 
+import juju_session
+import status_waiter
+import tracing
+import undercloud_cache
+
 
 Unit = collections.namedtuple('Unit', ['unit_name', 'server'])
+Capacity = collections.namedtuple('Capacity', ['vcpus', 'ram'])
+Move = collections.namedtuple('Move', ['unit', 'source', 'target'])
+PlacementChange = collections.namedtuple(
+    'PlacementChange',
+    ['unit_name', 'source', 'target'])
+ActionResult = collections.namedtuple(
+    'ActionResult',
+    ['unit_name', 'status', 'duration', 'message'])
 
-def move(nova_client, unit, target_hypervisor):
+def move(nova_client, unit, target_hypervisor, waiter):
     """Move a guest to a different hypervisor
 
     :param nova_client: Nova client
@@ -26,48 +40,153 @@ def move(nova_client, unit, target_hypervisor):
     :type unit: Unit
     :param target_hypervisor: Hypervisor to move unit to.
     :type target_hypervisor: str
+    :param waiter: Waiter for server status changes
+    :type waiter: status_waiter.ServerWaiter
     """
     logging.info("Stopping {} ({})".format(unit.unit_name, unit.server.id))
     if getattr(unit.server, 'OS-EXT-STS:vm_state').lower() != 'stopped':
-        subprocess.call(
-            ['juju', 'ssh', unit.unit_name, 'sudo shutdown -h now'])
-        zaza_os.resource_reaches_status(
-            nova_client.servers,
-            unit.server.id,
-            resource_attribute='OS-EXT-STS:vm_state',
-            expected_status="stopped",
-            msg="Server stopped")
+        with tracing.span('subprocess.juju ssh'):
+            subprocess.call(
+                ['juju', 'ssh', unit.unit_name, 'sudo shutdown -h now'])
+        waiter.wait(unit.server.id, 'stopped', msg="Server stopped")
     logging.info("Migrating {} ({}) to {} ".format(
         unit.unit_name,
         unit.server.id,
         target_hypervisor))
     try:
-        unit.server.migrate(host=target_hypervisor)
-        zaza_os.resource_reaches_status(
-            nova_client.servers,
-            unit.server.id,
-            resource_attribute='OS-EXT-STS:vm_state',
-            expected_status='resized',
-            msg="Server moved")
-        unit.server.confirm_resize()
+        with tracing.span('nova.server.migrate'):
+            unit.server.migrate(host=target_hypervisor)
+        waiter.wait(unit.server.id, 'resized', msg="Server moved")
+        with tracing.span('nova.server.confirm_resize'):
+            unit.server.confirm_resize()
     except novaclient.exceptions.BadRequest:
-        logging.warn("Migration failed")
-    zaza_os.resource_reaches_status(
-        nova_client.servers,
-        unit.server.id,
-        resource_attribute='OS-EXT-STS:vm_state',
-        expected_status='stopped',
-        msg="Server stopped")
+        logging.warning("Migration failed")
+    waiter.wait(unit.server.id, 'stopped', msg="Server stopped")
     logging.info("Starting {} ({})".format(unit.unit_name, unit.server.id))
-    unit.server.start()
-    zaza_os.resource_reaches_status(
-        nova_client.servers,
-        unit.server.id,
-        resource_attribute='OS-EXT-STS:vm_state',
-        expected_status='active',
-        msg="Server stopped")
+    with tracing.span('nova.server.start'):
+        unit.server.start()
+    waiter.wait(unit.server.id, 'active', msg="Server started")
+
+
+def get_hypervisor(server):
+    """Return the short name of the hypervisor a server is on.
+
+    :param server: Server
+    :type server: novaclient.v2.servers.Server
+    :returns: Hypervisor, None if server is not on one
+    :rtype: Union[str, None]
+    """
+    hostname = getattr(server, 'OS-EXT-SRV-ATTR:hypervisor_hostname', None)
+    return hostname.split('.')[0] if hostname else None
+
+
+class PlacementIndex(object):
+    """In memory index of which hypervisor each unit is on.
+
+    Built from one detailed listing of all servers joined with the instance
+    ids of the juju machines. Refreshes only list the servers nova reports
+    as changed since the newest update already seen, which uses the clock
+    of the cloud so no change is missed through clock skew.
+    """
+
+    def __init__(self, nova_client, application_name):
+        """Fetch hypervisors, units and servers.
+
+        :param nova_client: Nova client
+        :type nova_client: novaclient.v2.client.Client
+        :param application_name: Name of application
+        :type application_name: Str
+        """
+        self.nova_client = nova_client
+        self.application_name = application_name
+        self.hypervisors = [
+            h.split('.')[0]
+            for h in undercloud_cache.cached(
+                'hypervisors',
+                lambda: [h.hypervisor_hostname
+                         for h in nova_client.hypervisors.list()])]
+        self.units = {}
+        self.servers = {}
+        self.changes_since = None
+        self.refresh()
 
+    def locations(self):
+        """Return the hypervisor of each unit.
 
+        :returns: Map of unit name to hypervisor
+        :rtype: Dict[str, str]
+        """
+        return {
+            unit_name: get_hypervisor(self.servers[instance_id])
+            for instance_id, unit_name in self.units.items()
+            if instance_id in self.servers}
+
+    def placement(self):
+        """Return the units on each hypervisor.
+
+        :returns: Map of units on each hypervisor
+        :rtype: Dict[str, List[Unit]]
+        """
+        unit_map = {h: [] for h in self.hypervisors}
+        for instance_id, unit_name in self.units.items():
+            server = self.servers.get(instance_id)
+            if server is None:
+                continue
+            unit_map.setdefault(get_hypervisor(server), []).append(
+                Unit(unit_name, server))
+        return unit_map
+
+    @tracing.traced('placement.refresh')
+    def refresh(self):
+        """Update the index from the cloud.
+
+        :returns: Units whose hypervisor changed, source is None for new
+                  units and target is None for units which went away
+        :rtype: List[PlacementChange]
+        """
+        with tracing.span('juju.snapshot'):
+            snapshot = juju_session.snapshot(self.application_name)
+        units = collections.OrderedDict(
+            (um.instance_id, um.unit_name)
+            for um in snapshot.unit_machines.values())
+        search_opts = {}
+        if self.changes_since:
+            search_opts['changes-since'] = self.changes_since
+        servers = dict(self.servers)
+        for server in self.nova_client.servers.list(
+                detailed=True,
+                search_opts=search_opts,
+                limit=-1):
+            self.changes_since = max(
+                self.changes_since or server.updated,
+                server.updated)
+            if server.status == 'DELETED':
+                servers.pop(server.id, None)
+            elif server.id in units:
+                servers[server.id] = server
+        # Servers of units added since the last refresh may not have changed
+        if search_opts:
+            for instance_id in set(units) - set(self.units) - set(servers):
+                try:
+                    servers[instance_id] = self.nova_client.servers.get(
+                        instance_id)
+                except novaclient.exceptions.NotFound:
+                    pass
+        for instance_id in set(units) - set(servers) - set(self.units):
+            logging.warning("No server {} found for {}".format(
+                instance_id,
+                units[instance_id]))
+        old = self.locations()
+        self.units = units
+        self.servers = {i: s for i, s in servers.items() if i in units}
+        new = self.locations()
+        return [
+            PlacementChange(unit_name, old.get(unit_name), new.get(unit_name))
+            for unit_name in list(new) + [n for n in old if n not in new]
+            if old.get(unit_name) != new.get(unit_name)]
+
+
+@tracing.traced()
 def get_placement(nova_client, application_name):
     """Find which hypervisor each unit is on.
 
@@ -78,21 +197,20 @@ def get_placement(nova_client, application_name):
     :returns: Map of units on each hypervisor
     :rtype: Dict[str, List[Unit]]
     """
-    unit_map = {h.hypervisor_hostname.split('.')[0]:[]
-                for h in nova_client.hypervisors.list()}
-    for machine in zaza.model.get_machines(application_name=application_name):
-        server = nova_client.servers.get(machine.data['instance-id'])
-        hypervisor = getattr(
-            server,
-            'OS-EXT-SRV-ATTR:hypervisor_hostname').split('.')[0]
-        unt_name = zaza_juju.get_unit_name_from_host_name(
-            server.name,
-            application=application_name)
-        unit_map[hypervisor].append(
-            Unit(
-                unt_name,
-                server))
-    return unit_map
+    return PlacementIndex(nova_client, application_name).placement()
+
+
+def log_placement(placement):
+    """Display which hypervisor each unit is on.
+
+    :param placement: Map of units on each hypervisor
+    :type placement: Dict[str, List[Unit]]
+    """
+    for hypervisor, units in placement.items():
+        logging.info("{}: {}".format(
+            hypervisor,
+            ', '.join([u.unit_name for u in units])))
+
 
 def summary(nova_client, application_name):
     """Display which hypervisor each unit is on.
@@ -102,59 +220,429 @@ def summary(nova_client, application_name):
     :param application_name: Name of application
     :type application_name: Str
     """
-    placement = get_placement(nova_client, application_name)
-    for hypervisor, units in placement.items():
-        logging.info("{}: {}".format(
-            hypervisor,
-            ', '.join([u.unit_name for u in units])))
+    log_placement(get_placement(nova_client, application_name))
+
 
-def balance(nova_client, application_name):
-    """Move units onto hypervisor with no units.
+def watch(nova_client, application_name, interval=10, iterations=None):
+    """Display which hypervisor each unit is on and then each move.
 
     :param nova_client: Nova client
     :type nova_client: novaclient.v2.client.Client
     :param application_name: Name of application
     :type application_name: Str
+    :param interval: Seconds between refreshes
+    :type interval: float
+    :param iterations: Number of refreshes, default until interrupted
+    :type iterations: Union[int, None]
     """
-    placement = get_placement(nova_client, application_name)
-    new_placement = {h:[] for h in placement.keys()}
+    index = PlacementIndex(nova_client, application_name)
+    log_placement(index.placement())
+    refreshes = itertools.count() if iterations is None else range(
+        iterations)
+    for _ in refreshes:
+        time.sleep(interval)
+        for change in index.refresh():
+            logging.info("{}: {} -> {}".format(
+                change.unit_name,
+                change.source or 'new',
+                change.target or 'gone'))
+
+
+@tracing.traced()
+def get_hypervisor_capacity(nova_client, cpu_allocation_ratio=16.0,
+                            ram_allocation_ratio=1.5):
+    """Find the free capacity of each usable hypervisor.
+
+    :param nova_client: Nova client
+    :type nova_client: novaclient.v2.client.Client
+    :param cpu_allocation_ratio: vCPU overcommit ratio of the hypervisors
+    :type cpu_allocation_ratio: float
+    :param ram_allocation_ratio: RAM overcommit ratio of the hypervisors
+    :type ram_allocation_ratio: float
+    :returns: Map of hypervisor to free capacity
+    :rtype: Dict[str, Capacity]
+    """
+    capacity = {}
+    for h in nova_client.hypervisors.list(detailed=True):
+        if h.state != 'up' or h.status != 'enabled':
+            continue
+        capacity[h.hypervisor_hostname.split('.')[0]] = Capacity(
+            h.vcpus * cpu_allocation_ratio - h.vcpus_used,
+            h.memory_mb * ram_allocation_ratio - h.memory_mb_used)
+    return capacity
+
+
+def get_unit_size(unit):
+    """Return the resources a unit uses on its hypervisor.
+
+    :param unit: Unit to size
+    :type unit: Unit
+    :returns: Resources used by unit
+    :rtype: Capacity
+    """
+    return Capacity(unit.server.flavor['vcpus'], unit.server.flavor['ram'])
+
+
+def plan_moves(placement, capacity):
+    """Plan the fewest moves which spread units evenly over hypervisors.
+
+    Every usable hypervisor is given a quota of units so that quotas differ
+    by at most one, with the larger quotas going to the hypervisors which
+    already have the most units. Units over quota are then moved to
+    hypervisors under quota which have room for them. Hypervisors which are
+    not usable get a quota of zero. Units whose server is not on a
+    hypervisor, eg shelved or in error, are left out.
+
+    :param placement: Map of units on each hypervisor
+    :type placement: Dict[Union[str, None], List[Unit]]
+    :param capacity: Map of usable hypervisor to free capacity
+    :type capacity: Dict[str, Capacity]
+    :returns: Moves to make
+    :rtype: List[Move]
+    """
+    if placement.get(None):
+        logging.warning("Not balancing {}, not on a hypervisor".format(
+            ', '.join(u.unit_name for u in placement[None])))
+    placement = {h: units for h, units in placement.items() if h is not None}
+    total_units = sum(len(units) for units in placement.values())
+    hypervisors = sorted(
+        capacity.keys(),
+        key=lambda h: (-len(placement.get(h, [])), h))
+    if not hypervisors:
+        logging.warning("No usable hypervisors")
+        return []
+    base, extra = divmod(total_units, len(hypervisors))
+    quota = {h: base + (1 if i < extra else 0)
+             for i, h in enumerate(hypervisors)}
     spares = []
-    for hypervisor, units in placement.items():
-        if len(units) > 1:
-            spares.extend(units[1:])
-    for hypervisor, units in placement.items():
-        if len(units) == 0:
-            try:
-                new_placement[hypervisor].append(spares.pop())
-            except IndexError as e:
-                logging.warn("Run out of spares")
-    for hypervisor, units in new_placement.items():
-        for unit in units:
-            logging.info("Move {} to {}".format(unit.unit_name, hypervisor))
-            move(nova_client, unit, hypervisor)
-
-def advertise(application_name):
-    """Advertise ip addresses to peers.
+    for hypervisor, units in sorted(placement.items()):
+        spares.extend(
+            (hypervisor, unit) for unit in units[quota.get(hypervisor, 0):])
+    free = dict(capacity)
+    need = {h: quota[h] - len(placement.get(h, [])) for h in hypervisors}
+    moves = []
+    for source, unit in spares:
+        size = get_unit_size(unit)
+        candidates = [
+            h for h in hypervisors
+            if need[h] > 0 and
+            free[h].vcpus >= size.vcpus and
+            free[h].ram >= size.ram]
+        if not candidates:
+            logging.warning("No hypervisor has room for {}".format(
+                unit.unit_name))
+            continue
+        target = max(candidates, key=lambda h: (need[h], free[h].ram))
+        need[target] -= 1
+        free[target] = Capacity(
+            free[target].vcpus - size.vcpus,
+            free[target].ram - size.ram)
+        moves.append(Move(unit, source, target))
+    return moves
+
+
+def _next_runnable(moves, busy, per_hypervisor):
+    """Pop the first move whose hypervisors have a free migration slot."""
+    for i, m in enumerate(moves):
+        if (busy[m.source] < per_hypervisor and
+                busy[m.target] < per_hypervisor):
+            return moves.pop(i)
+    return None
+
+
+def estimate_duration(moves, parallel, per_hypervisor, move_time):
+    """Estimate the wall clock time to carry out moves.
+
+    :param moves: Moves to make
+    :type moves: List[Move]
+    :param parallel: Maximum number of moves to run at once
+    :type parallel: int
+    :param per_hypervisor: Maximum moves at once in or out of a hypervisor
+    :type per_hypervisor: int
+    :param move_time: Seconds a single move takes
+    :type move_time: float
+    :returns: Estimated seconds
+    :rtype: float
+    """
+    queued = list(moves)
+    busy = collections.Counter()
+    running = []
+    now = 0
+    while queued or running:
+        while len(running) < parallel:
+            m = _next_runnable(queued, busy, per_hypervisor)
+            if not m:
+                break
+            busy[m.source] += 1
+            busy[m.target] += 1
+            running.append((now + move_time, m))
+        running.sort(key=lambda r: r[0])
+        now, m = running.pop(0)
+        busy[m.source] -= 1
+        busy[m.target] -= 1
+    return now
+
+
+@tracing.traced()
+def run_moves(nova_client, moves, parallel, per_hypervisor):
+    """Carry out moves concurrently.
+
+    No more than per_hypervisor moves run in or out of a single hypervisor
+    at once so a compute nodes migration bandwidth is not saturated.
 
+    :param nova_client: Nova client
+    :type nova_client: novaclient.v2.client.Client
+    :param moves: Moves to make
+    :type moves: List[Move]
+    :param parallel: Maximum number of moves to run at once
+    :type parallel: int
+    :param per_hypervisor: Maximum moves at once in or out of a hypervisor
+    :type per_hypervisor: int
+    :returns: Names of units which failed to move
+    :rtype: List[str]
+    """
+    queued = list(moves)
+    busy = collections.Counter()
+    failed = []
+    waiter = status_waiter.ServerWaiter(nova_client)
+
+    def _move(m):
+        with tracing.span(
+                'move',
+                unit=m.unit.unit_name,
+                server=m.unit.server.id,
+                source=m.source,
+                target=m.target):
+            move(nova_client, m.unit, m.target, waiter)
+
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=parallel) as executor:
+        running = {}
+        while queued or running:
+            while len(running) < parallel:
+                m = _next_runnable(queued, busy, per_hypervisor)
+                if not m:
+                    break
+                busy[m.source] += 1
+                busy[m.target] += 1
+                logging.info("Move {} from {} to {}".format(
+                    m.unit.unit_name,
+                    m.source,
+                    m.target))
+                running[executor.submit(_move, m)] = m
+            done, _ = concurrent.futures.wait(
+                running,
+                return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                m = running.pop(future)
+                busy[m.source] -= 1
+                busy[m.target] -= 1
+                try:
+                    future.result()
+                except Exception as e:
+                    logging.error("Moving {} failed: {}".format(
+                        m.unit.unit_name,
+                        e))
+                    failed.append(m.unit.unit_name)
+    waiter.log_timings()
+    return failed
+
+
+@tracing.traced()
+def balance(nova_client, application_name, parallel=10, per_hypervisor=1,
+            dry_run=False, move_time=300, cpu_allocation_ratio=16.0,
+            ram_allocation_ratio=1.5):
+    """Spread units evenly over hypervisors with room for them.
+
+    :param nova_client: Nova client
+    :type nova_client: novaclient.v2.client.Client
     :param application_name: Name of application
     :type application_name: Str
+    :param parallel: Maximum number of moves to run at once
+    :type parallel: int
+    :param per_hypervisor: Maximum moves at once in or out of a hypervisor
+    :type per_hypervisor: int
+    :param dry_run: Only display the plan
+    :type dry_run: bool
+    :param move_time: Seconds a single move is estimated to take
+    :type move_time: float
+    :param cpu_allocation_ratio: vCPU overcommit ratio of the hypervisors
+    :type cpu_allocation_ratio: float
+    :param ram_allocation_ratio: RAM overcommit ratio of the hypervisors
+    :type ram_allocation_ratio: float
+    :returns: Names of units which failed to move
+    :rtype: List[str]
+    """
+    placement = get_placement(nova_client, application_name)
+    capacity = get_hypervisor_capacity(
+        nova_client,
+        cpu_allocation_ratio=cpu_allocation_ratio,
+        ram_allocation_ratio=ram_allocation_ratio)
+    moves = plan_moves(placement, capacity)
+    for m in moves:
+        logging.info("Plan: move {} from {} to {}".format(
+            m.unit.unit_name,
+            m.source,
+            m.target))
+    logging.info("Plan: {} moves, estimated {:.0f}s".format(
+        len(moves),
+        estimate_duration(moves, parallel, per_hypervisor, move_time)))
+    if dry_run:
+        return []
+    failed = run_moves(nova_client, moves, parallel, per_hypervisor)
+    if failed:
+        logging.error("Failed to move: {}".format(', '.join(failed)))
+    return failed
+
+
+@tracing.traced()
+def run_action_on_units(unit_names, action_name, action_params=None,
+                        parallel=50, max_failures=10):
+    """Run an action on many units at once.
+
+    All actions are queued together and up to parallel run at once. Once
+    more than max_failures units have failed no further actions are
+    started.
+
+    :param unit_names: Names of units to run action on
+    :type unit_names: List[str]
+    :param action_name: Name of action
+    :type action_name: str
+    :param action_params: Parameters for action
+    :type action_params: Union[Dict, None]
+    :param parallel: Maximum number of actions to run at once
+    :type parallel: int
+    :param max_failures: Number of failures to tolerate before giving up
+    :type max_failures: int
+    :returns: Result for each unit
+    :rtype: List[ActionResult]
     """
-    for unit in zaza.model.get_units(application_name):
-        zaza.model.run_action(unit.entity_id, 'advertise')
+    async def _run_actions():
+        semaphore = asyncio.Semaphore(parallel)
+        failures = []
 
-def listen(application_name, cidr, listner_count=10):
+        async def _run_action(unit_name):
+            async with semaphore:
+                if len(failures) > max_failures:
+                    return ActionResult(unit_name, 'skipped', 0, '')
+                start = time.monotonic()
+                try:
+                    with tracing.span(
+                            'juju.run_action',
+                            unit=unit_name,
+                            juju_action=action_name):
+                        action = await juju_session.async_run_action(
+                            unit_name,
+                            action_name,
+                            action_params=action_params)
+                    status = action.status
+                    message = action.data.get('message', '')
+                except Exception as e:
+                    status = 'error'
+                    message = str(e)
+                if status != 'completed':
+                    failures.append(unit_name)
+                    if len(failures) == max_failures + 1:
+                        logging.error(
+                            "{} units failed {}, not starting any "
+                            "more".format(len(failures), action_name))
+                return ActionResult(
+                    unit_name,
+                    status,
+                    time.monotonic() - start,
+                    message)
+        return await asyncio.gather(*[
+            _run_action(unit_name) for unit_name in unit_names])
+    results = asyncio.run(_run_actions())
+    for result in results:
+        log = logging.info if result.status == 'completed' else logging.error
+        log("{:<20} {:<10} {:>7.1f}s {}".format(
+            result.unit_name,
+            result.status,
+            result.duration,
+            result.message))
+    return results
+
+
+def advertise(application_name, parallel=50, max_failures=10):
     """Advertise ip addresses to peers.
 
     :param application_name: Name of application
     :type application_name: Str
+    :param parallel: Maximum number of units to run action on at once
+    :type parallel: int
+    :param max_failures: Number of failures to tolerate before giving up
+    :type max_failures: int
+    :returns: Result for each unit
+    :rtype: List[ActionResult]
     """
-    for unit in zaza.model.get_units(application_name):
-        zaza.model.run_action(
-            unit.entity_id,
-            'listen',
-            action_params={
-                'network-cidr': cidr,
-                'listner-count': listner_count})
+    with tracing.span('juju.get_units'):
+        units = juju_session.get_units(application_name)
+    return run_action_on_units(
+        [unit.entity_id for unit in units],
+        'advertise',
+        parallel=parallel,
+        max_failures=max_failures)
+
+
+def listen(application_name, cidr, listner_count=10, parallel=50,
+           max_failures=10):
+    """Start listeners on units.
+
+    :param application_name: Name of application
+    :type application_name: Str
+    :param cidr: Network cidr to listen on
+    :type cidr: str
+    :param listner_count: Number of listeners
+    :type listner_count: int
+    :param parallel: Maximum number of units to run action on at once
+    :type parallel: int
+    :param max_failures: Number of failures to tolerate before giving up
+    :type max_failures: int
+    :returns: Result for each unit
+    :rtype: List[ActionResult]
+    """
+    with tracing.span('juju.get_units'):
+        units = juju_session.get_units(application_name)
+    return run_action_on_units(
+        [unit.entity_id for unit in units],
+        'listen',
+        action_params={
+            'network-cidr': cidr,
+            'listner-count': listner_count},
+        parallel=parallel,
+        max_failures=max_failures)
+
+
+def get_nova_client():
+    """Return a nova client for the undercloud, traced if enabled.
+
+    :returns: Nova client
+    :rtype: Union[novaclient.v2.client.Client, tracing.TracedClient]
+    """
+    with tracing.span('keystone.session'):
+        session = undercloud_cache.get_keystone_session()
+    return tracing.trace_client(
+        zaza_os.get_nova_session_client(session, version=2.56),
+        'nova',
+        tracing.NOVA_MANAGERS)
+
+
+def positive_int(value):
+    """Parse a command line integer which must be at least one.
+
+    :param value: Command line value
+    :type value: str
+    :returns: Integer
+    :rtype: int
+    :raises: argparse.ArgumentTypeError
+    """
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(
+            "{} is not a positive integer".format(value))
+    return number
+
 
 def parse_args(args):
     """Parse command line arguments.
@@ -164,7 +652,8 @@ def parse_args(args):
     """
     parser = argparse.ArgumentParser()
     parser.add_argument('action',
-                        help='Action to run: add, cleanup, listen or advertise')
+                        help='Action to run: summary, watch, balance, '
+                             'listen or advertise')
     parser.add_argument('-a', '--application', dest='application_name',
                         help='Name of Juju application to add port to',
                         required=True)
@@ -174,47 +663,113 @@ def parse_args(args):
     parser.add_argument('-l', '--listeners', dest='listener_count',
                         help='Number of listeners',
                         required=False)
+    parser.add_argument('--parallel', dest='parallel',
+                        help='Number of units to move or run actions on at '
+                             'once, the default depends on the action',
+                        type=positive_int)
+    parser.add_argument('--max-failures', dest='max_failures',
+                        help='Number of units an action may fail on before '
+                             'giving up',
+                        type=int)
+    parser.add_argument('--per-hypervisor', dest='per_hypervisor',
+                        help='Number of units to move in or out of a '
+                             'hypervisor at once',
+                        type=positive_int)
+    parser.add_argument('--move-time', dest='move_time',
+                        help='Seconds a move takes, used for estimates',
+                        type=float)
+    parser.add_argument('--cpu-allocation-ratio',
+                        dest='cpu_allocation_ratio',
+                        help='vCPU overcommit ratio of the hypervisors',
+                        type=float)
+    parser.add_argument('--ram-allocation-ratio',
+                        dest='ram_allocation_ratio',
+                        help='RAM overcommit ratio of the hypervisors',
+                        type=float)
+    parser.add_argument('--interval', dest='interval',
+                        help='Seconds between placement refreshes of watch',
+                        type=float)
+    parser.add_argument('--dry-run', dest='dry_run',
+                        help='Only display the balance plan',
+                        action='store_true')
+    parser.add_argument('--refresh-cache', dest='refresh_cache',
+                        help='Discard cached undercloud lookups',
+                        action='store_true')
+    parser.add_argument('--cache-ttl', dest='cache_ttl',
+                        help='Seconds undercloud lookups are cached for',
+                        type=float)
+    parser.add_argument('--trace', dest='trace_file',
+                        help='Time API calls, subprocesses and waits, log a '
+                             'summary and write a Chrome trace to file at '
+                             'exit')
     parser.add_argument('--log', dest='loglevel',
                         help='Loglevel [DEBUG|INFO|WARN|ERROR|CRITICAL]')
-    parser.set_defaults(loglevel='INFO', vnic_binding_type='direct', listener_count=10)
+    parser.set_defaults(loglevel='INFO', listener_count=10,
+                        parallel=None, max_failures=10, per_hypervisor=1,
+                        move_time=300, interval=10,
+                        cpu_allocation_ratio=16.0, ram_allocation_ratio=1.5,
+                        dry_run=False, refresh_cache=False,
+                        cache_ttl=undercloud_cache.DEFAULT_TTL)
     return parser.parse_args(args)
 
 
 def main():
     args = parse_args(sys.argv[1:])
     cli_utils.setup_logging(log_level=args.loglevel.upper())
+    if args.trace_file:
+        tracing.enable(args.trace_file, action=args.action)
+    undercloud_cache.configure(
+        ttl=args.cache_ttl,
+        refresh=args.refresh_cache)
     #session = zaza_os.get_undercloud_keystone_session()
     #neutron_client = zaza_os.get_neutron_session_client(session)
     #nova_client = zaza_os.get_nova_session_client(session, version=2.56)
-    if args.vnic_binding_type == 'dummy':
-        logging.warn('Running in dummy mode')
-        binding_type = None
-    else:
-        binding_type = args.vnic_binding_type
+    parallel = {'parallel': args.parallel} if args.parallel else {}
     if args.action == 'summary':
         logging.info('Running Summary')
         summary(
-            zaza_os.get_nova_session_client(
-                zaza_os.get_undercloud_keystone_session(),
-                version=2.56),
+            get_nova_client(),
             args.application_name)
+    elif args.action == 'watch':
+        logging.info('Running watch')
+        try:
+            watch(
+                get_nova_client(),
+                args.application_name,
+                interval=args.interval)
+        except KeyboardInterrupt:
+            pass
     elif args.action == 'balance':
         logging.info('Running balance')
-        balance(
-            zaza_os.get_nova_session_client(
-                zaza_os.get_undercloud_keystone_session(),
-                version=2.56),
-            args.application_name)
+        failed = balance(
+            get_nova_client(),
+            args.application_name,
+            **parallel,
+            per_hypervisor=args.per_hypervisor,
+            dry_run=args.dry_run,
+            move_time=args.move_time,
+            cpu_allocation_ratio=args.cpu_allocation_ratio,
+            ram_allocation_ratio=args.ram_allocation_ratio)
+        if failed:
+            sys.exit(1)
     elif args.action == 'advertise':
         logging.info('Running advertise')
-        advertise(
-            args.application_name)
+        results = advertise(
+            args.application_name,
+            max_failures=args.max_failures,
+            **parallel)
+        if any(r.status != 'completed' for r in results):
+            sys.exit(1)
     elif args.action == 'listen':
         logging.info('Running listen')
-        listen(
+        results = listen(
             args.application_name,
             args.cidr,
-            int(args.listener_count))
+            int(args.listener_count),
+            max_failures=args.max_failures,
+            **parallel)
+        if any(r.status != 'completed' for r in results):
+            sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -2,24 +2,50 @@
 
 import asyncio
 import argparse
+import collections
+import concurrent.futures
+import importlib
+import json
 import logging
+import math
 import os
+import re
 import sys
 import subprocess
 import tenacity
 import textwrap
 import tempfile
+import threading
 import time
 from pathlib import Path
+import novaclient.exceptions
 import yaml
-import novaclient
-import zaza.model
 import zaza.utilities.cli as cli_utils
 import zaza.openstack.utilities.openstack as zaza_os
 
+import juju_session
+import status_waiter
+import tracing
+import undercloud_cache
+
+manage_magpie_units = importlib.import_module('manage-magpie-units')
+
 MACHINE_PREFIX = "ps5-bench"
 CONTROLLER_NAME = "{}-controller".format(MACHINE_PREFIX)
 CLOUD_NAME = "{}-manual".format(MACHINE_PREFIX)
+# Names of the servers add_servers creates, which excludes the controller
+BENCH_SERVER_RE = re.compile(r'^{}-[0-9]+$'.format(MACHINE_PREFIX))
+BENCH_PORT_RE = re.compile(r'^{}-[0-9]+_port$'.format(MACHINE_PREFIX))
+
+NetplanResult = collections.namedtuple(
+    'NetplanResult',
+    ['unit_name', 'interface', 'changed', 'error'])
+
+PORT_BATCH_SIZE = 100
+
+SUCCEEDED = 'succeeded'
+SKIPPED = 'skipped'
+FAILED = 'failed'
 
 
 def get_network(neutron_client, network_name):
@@ -32,28 +58,12 @@ def get_network(neutron_client, network_name):
     :returns: Network
     :rtype: Dict
     """
-    networks = neutron_client.list_networks(name=network_name)['networks']
-    assert len(networks) == 1, "ERROR: {} networks found".format(len(networks))
-    return networks[0]
-
-
-def get_port(neutron_client, port_name):
-    """Return port that matches name.
-
-    :param neutron_client: Neutron client
-    :type neutron_client: neutronclient.v2_0.client.Client
-    :param port_name: Name of port
-    :type port_name: Str
-    :returns: Port
-    :rtype: Dict
-    """
-    port = None
-    existing_ports = neutron_client.list_ports(name=port_name)['ports']
-    if existing_ports:
-        assert len(existing_ports) == 1, "ERROR: {} ports found".format(
-            len(existing_ports))
-        port = existing_ports[0]
-    return port
+    def _lookup():
+        networks = neutron_client.list_networks(name=network_name)['networks']
+        assert len(networks) == 1, "ERROR: {} networks found".format(
+            len(networks))
+        return networks[0]
+    return undercloud_cache.cached('network/{}'.format(network_name), _lookup)
 
 
 def get_port_name(network, machine):
@@ -61,125 +71,598 @@ def get_port_name(network, machine):
 
     :param network: Dict of network data
     :param network: Dict
-    :type machine: juju.machine.Machine
-    :type machine: juju.machine.Machine
+    :param machine: Machine port is for, None to return the common prefix
+    :type machine: Union[juju.machine.Machine, None]
     :returns: Port name
     :rtype: str
     """
-    return 'sriov_{}_{}'.format(network['name'], machine.entity_id)
+    return 'sriov_{}_{}'.format(
+        network['name'],
+        machine.entity_id if machine else '')
+
+
+class Inventory(object):
+    """In memory index of the sriov ports and servers of a deployment.
+
+    All ports on the network and all servers are fetched with a few bulk,
+    paginated list calls rather than being looked up one machine at a time.
+    Whether a port is attached to a server is answered from the ports
+    device_id so no per server interface listing is needed.
+    """
+
+    PAGE_SIZE = 500
+    PORT_FIELDS = ['id', 'name', 'mac_address', 'device_id', 'network_id']
+
+    def __init__(self, neutron_client, network, nova_client=None):
+        """Fetch ports and, if a nova client is supplied, servers.
+
+        :param neutron_client: Neutron client
+        :type neutron_client: neutronclient.v2_0.client.Client
+        :param network: Dict of network data
+        :type network: Dict
+        :param nova_client: Nova client
+        :type nova_client: Union[novaclient.v2.client.Client, None]
+        """
+        self.neutron_client = neutron_client
+        self.nova_client = nova_client
+        self.network = network
+        self.lock = threading.Lock()
+        self.ports_by_name = {}
+        self.ports_by_id = {}
+        self.servers = {}
+        self.refresh()
+
+    def refresh(self):
+        """Rebuild the index from the cloud."""
+        prefix = get_port_name(self.network, None)
+        ports = self.neutron_client.list_ports(
+            network_id=self.network['id'],
+            fields=self.PORT_FIELDS,
+            limit=self.PAGE_SIZE,
+            retrieve_all=True)['ports']
+        ports_by_name = {}
+        for port in ports:
+            if not port['name'].startswith(prefix):
+                continue
+            assert port['name'] not in ports_by_name, \
+                "ERROR: multiple ports named {} found".format(port['name'])
+            ports_by_name[port['name']] = port
+        servers = {}
+        if self.nova_client:
+            servers = {
+                s.id: s
+                for s in self.nova_client.servers.list(
+                    detailed=True,
+                    limit=-1)}
+        with self.lock:
+            self.ports_by_name = ports_by_name
+            self.ports_by_id = {p['id']: p for p in ports_by_name.values()}
+            self.servers = servers
+        logging.debug("Inventory has {} ports and {} servers".format(
+            len(self.ports_by_name),
+            len(self.servers)))
+
+    def get_port(self, port_name):
+        """Return port that matches name.
+
+        :param port_name: Name of port
+        :type port_name: Str
+        :returns: Port
+        :rtype: Union[Dict, None]
+        """
+        return self.ports_by_name.get(port_name)
+
+    def add_port(self, port):
+        """Record a newly created port.
+
+        :param port: Port
+        :type port: Dict
+        """
+        with self.lock:
+            self.ports_by_name[port['name']] = port
+            self.ports_by_id[port['id']] = port
+
+    def remove_port(self, port):
+        """Forget a deleted port.
+
+        :param port: Port
+        :type port: Dict
+        """
+        with self.lock:
+            self.ports_by_name.pop(port['name'], None)
+            self.ports_by_id.pop(port['id'], None)
+
+    def get_server(self, instance_id):
+        """Return server with given id.
+
+        Servers created since the inventory was built are fetched
+        individually.
+
+        :param instance_id: Id of server
+        :type instance_id: str
+        :returns: Server
+        :rtype: novaclient.v2.servers.Server
+        """
+        server = self.servers.get(instance_id)
+        if not server:
+            server = self.nova_client.servers.get(instance_id)
+            with self.lock:
+                self.servers[instance_id] = server
+        return server
+
+    def is_port_attached(self, server, port_id):
+        """Whether port with given id is attached to server
+
+        :param server: Server to check for port.
+        :type server: novaclient.v2.servers.Server
+        :param port_id: Id of port to check
+        :type port_id: str
+        :returns: Whether port is attached
+        :rtype: bool
+        """
+        port = self.ports_by_id.get(port_id)
+        return bool(port) and port.get('device_id') == server.id
+
+    def set_port_device(self, port_id, device_id):
+        """Record which server a port is attached to.
+
+        :param port_id: Id of port
+        :type port_id: str
+        :param device_id: Id of server or '' if detached
+        :type device_id: str
+        """
+        with self.lock:
+            port = self.ports_by_id.get(port_id)
+            if port:
+                port['device_id'] = device_id
+
+
+def run_concurrently(func, items, parallel, action):
+    """Call func on each item, up to parallel at once.
+
+    :param func: Function to call with each item
+    :type func: Callable[[Any], Any]
+    :param items: Map of item description to item
+    :type items: Dict[str, Any]
+    :param parallel: Maximum number of calls at once
+    :type parallel: int
+    :param action: Description of func used in log messages
+    :type action: str
+    :returns: Descriptions of the items func raised an exception for
+    :rtype: List[str]
+    """
+    failed = []
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=parallel) as executor:
+        futures = {
+            executor.submit(func, item): desc
+            for desc, item in items.items()}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                logging.error("{} {} failed: {}".format(
+                    action,
+                    futures[future],
+                    e))
+                failed.append(futures[future])
+    return failed
+
+
+def wait_for_all(futures, action):
+    """Wait for waiter futures, logging those which fail.
 
+    :param futures: Map of description to future
+    :type futures: Dict[str, concurrent.futures.Future]
+    :param action: Description of the wait used in log messages
+    :type action: str
+    :returns: Descriptions of the futures which failed
+    :rtype: List[str]
+    """
+    failed = []
+    for desc, future in sorted(futures.items()):
+        try:
+            future.result()
+        except Exception as e:
+            logging.error("{} {} failed: {}".format(action, desc, e))
+            failed.append(desc)
+    return failed
+
+
+@tracing.traced()
+def cleanup(nova_client, neutron_client, network_name, application_name=None,
+            parallel=10, remove_servers=False):
+    """Remove ports from servers and delete.
 
-def is_port_attached(nova_client, server, port_id):
-    """Whether port with given id is attached to server
+    Every sriov port on the network is found with one port listing, or only
+    the ports of the machines of application_name if it is given. Ports are
+    detached from their servers concurrently, a single poller confirms the
+    detaches and then the ports are deleted concurrently.
 
     :param nova_client: Nova client
     :type nova_client: novaclient.v2.client.Client
-    :param server: Server to check for port.
-    :type servr: novaclient.v2.servers.Server
-    :param port_id: Id of port to check
-    :type port_id: str
-    :returns: Whether port is attached
-    :rtype: bool
+    :param neutron_client: Neutron client
+    :type neutron_client: neutronclient.v2_0.client.Client
+    :param network_name: Name of network
+    :type network_name: Str
+    :param application_name: Name of application, None for all sriov ports
+    :type application_name: Union[Str, None]
+    :param parallel: Maximum number of ports or servers to act on at once
+    :type parallel: int
+    :param remove_servers: Whether to also delete the servers, and their
+                           ports, created by add_servers
+    :type remove_servers: bool
+    :returns: Map of outcome to list of ports and servers
+    :rtype: Dict[str, List[str]]
     """
-    for interface in server.interface_list():
-        if interface.port_id == port_id:
-            return True
-    return False
+    network = get_network(neutron_client, network_name)
+    inventory = Inventory(neutron_client, network)
+    ports = dict(inventory.ports_by_name)
+    if application_name:
+        with tracing.span('juju.get_machines'):
+            machines = juju_session.get_machines(application_name)
+        port_names = {get_port_name(network, m) for m in machines}
+        ports = {n: p for n, p in ports.items() if n in port_names}
+    results = {SUCCEEDED: [], SKIPPED: [], FAILED: []}
+    port_waiter = status_waiter.PortWaiter(neutron_client)
+    detaches = {}
 
+    def _detach(port):
+        logging.info("Removing port {} from {}".format(
+            port['name'],
+            port['device_id']))
+        with tracing.span(
+                'detach-port',
+                port=port['name'],
+                server=port['device_id']):
+            nova_client.servers.interface_detach(
+                port['device_id'],
+                port['id'])
+        detaches[port['name']] = port_waiter.expect(
+            port['id'],
+            'detached',
+            msg="Port detached")
+
+    attached = {n: p for n, p in ports.items() if p['device_id']}
+    failed = run_concurrently(_detach, attached, parallel, "Detaching port")
+    failed.extend(wait_for_all(detaches, "Detaching port"))
+
+    def _delete(port):
+        logging.info("Deleting port {}".format(port['name']))
+        neutron_client.delete_port(port['id'])
+        inventory.remove_port(port)
+
+    results[FAILED].extend(failed)
+    ports = {n: p for n, p in ports.items() if n not in failed}
+    failed = run_concurrently(_delete, ports, parallel, "Deleting port")
+    results[FAILED].extend(failed)
+    results[SUCCEEDED].extend(n for n in ports if n not in failed)
+    if remove_servers:
+        server_results = remove_bench_servers(
+            nova_client,
+            neutron_client,
+            network,
+            parallel=parallel)
+        for outcome, names in server_results.items():
+            results[outcome].extend(names)
+    log_results(results, 'Cleanup')
+    port_waiter.log_timings()
+    return results
 
-def cleanup(nova_client, neutron_client, network_name, application_name):
-    """Remove ports from servers and delete.
+
+@tracing.traced()
+def remove_bench_servers(nova_client, neutron_client, network, parallel=10):
+    """Delete the servers, and then their ports, created by add_servers.
+
+    The controller of the manual cloud, and its port, are left in place.
 
     :param nova_client: Nova client
     :type nova_client: novaclient.v2.client.Client
+    :param neutron_client: Neutron client
+    :type neutron_client: neutronclient.v2_0.client.Client
+    :param network: Dict of network data
+    :type network: Dict
+    :param parallel: Maximum number of servers or ports to delete at once
+    :type parallel: int
+    :returns: Map of outcome to list of servers and ports
+    :rtype: Dict[str, List[str]]
+    """
+    results = {SUCCEEDED: [], SKIPPED: [], FAILED: []}
+    servers = {
+        server.name: server
+        for server in nova_client.servers.list(
+            search_opts={'name': BENCH_SERVER_RE.pattern},
+            limit=-1)
+        if BENCH_SERVER_RE.match(server.name)}
+    server_waiter = status_waiter.ServerWaiter(nova_client)
+    deletes = {}
+
+    def _delete_server(server):
+        logging.info("Deleting server {}".format(server.name))
+        nova_client.servers.delete(server.id)
+        deletes[server.name] = server_waiter.expect(
+            server.id,
+            'deleted',
+            msg="Server deleted")
+
+    failed = run_concurrently(
+        _delete_server,
+        servers,
+        parallel,
+        "Deleting server")
+    failed.extend(wait_for_all(deletes, "Deleting server"))
+    results[FAILED].extend(failed)
+    results[SUCCEEDED].extend(n for n in servers if n not in failed)
+    # Ports of servers which could not be deleted are still attached
+    kept = {'{}_port'.format(name) for name in failed}
+    ports = {
+        port['name']: port
+        for port in neutron_client.list_ports(
+            network_id=network['id'],
+            retrieve_all=True)['ports']
+        if BENCH_PORT_RE.match(port['name']) and
+        port['name'] not in kept}
+
+    def _delete_port(port):
+        logging.info("Deleting port {}".format(port['name']))
+        neutron_client.delete_port(port['id'])
+
+    failed = run_concurrently(_delete_port, ports, parallel, "Deleting port")
+    results[FAILED].extend(failed)
+    results[SUCCEEDED].extend(n for n in ports if n not in failed)
+    server_waiter.log_timings()
+    return results
+
+
+NETPLAN_SCRIPT = """\
+MAC={mac_address}
+NETPLAN_FILE=/etc/netplan/60-dataport.yaml
+IFACE=$(ip -br link | grep -i "$MAC" | awk '{{print $1}}' | head -n 1)
+IFACE=${{IFACE%%@*}}
+if [ -z "$IFACE" ]; then
+    echo "No interface found with mac address $MAC" >&2
+    exit 1
+fi
+if grep -EiRq "$MAC|$IFACE\\$" /etc/netplan/; then
+    echo "RESULT $IFACE unchanged"
+    exit 0
+fi
+TMP_FILE=$(mktemp)
+cat > "$TMP_FILE" <<NETPLAN
+network:
+    ethernets:
+        $IFACE:
+            dhcp4: true
+            dhcp6: false
+            optional: true
+            match:
+                macaddress: $MAC
+            set-name: $IFACE
+    version: 2
+NETPLAN
+chmod 600 "$TMP_FILE"
+mv "$TMP_FILE" "$NETPLAN_FILE"
+netplan apply
+echo "RESULT $IFACE changed"
+"""
+
+
+async def async_configure_netplan(unit_name, mac_address, timeout=300):
+    """Configure the interface with the given mac address on a unit.
+
+    The interface is found, checked for existing netplan config, written
+    and applied by a single idempotent script run on the unit.
+
+    :param unit_name: Name of unit
+    :type unit_name: str
+    :param mac_address: Mac address of the interface
+    :type mac_address: str
+    :param timeout: Seconds to allow the script to run
+    :type timeout: int
+    :returns: Result for the unit
+    :rtype: NetplanResult
+    """
+    script = NETPLAN_SCRIPT.format(mac_address=mac_address)
+    async for attempt in tenacity.AsyncRetrying(
+            stop=tenacity.stop_after_attempt(3),
+            wait=tenacity.wait_exponential(multiplier=1, min=2, max=10)):
+        with attempt, tracing.span('juju.run_on_unit', unit=unit_name):
+            output = await juju_session.async_run_on_unit(
+                unit_name,
+                script,
+                timeout=timeout)
+    if int(output.get('Code', 0)) != 0:
+        return NetplanResult(
+            unit_name,
+            None,
+            False,
+            output.get('Stderr', '').strip() or 'exit code {}'.format(
+                output.get('Code')))
+    for line in output.get('Stdout', '').splitlines():
+        if line.startswith('RESULT '):
+            _, interface, state = line.split()
+            return NetplanResult(
+                unit_name,
+                interface,
+                state == 'changed',
+                None)
+    return NetplanResult(unit_name, None, False, 'no result reported')
+
+
+@tracing.traced()
+def add_port_to_netplan(neutron_client, network_name, application_name,
+                        parallel=10):
+    """Add the sriov port of each unit in application to netplan.
+
     :param neutron_client: Neutron client
     :type neutron_client: neutronclient.v2_0.client.Client
     :param network_name: Name of network
     :type network_name: Str
     :param application_name: Name of application
     :type application_name: Str
+    :param parallel: Maximum number of units to configure at once
+    :type parallel: int
+    :returns: Result for each unit
+    :rtype: List[NetplanResult]
     """
-    network = get_network(neutron_client, network_name)
-    for machine in zaza.model.get_machines(application_name=application_name):
-        port_name = get_port_name(network, machine)
-        port = get_port(neutron_client, port_name)
-        if port:
-            server = nova_client.servers.get(machine.data['instance-id'])
-            if is_port_attached(nova_client, server, port['id']):
-                logging.info("Removing port {} from {}".format(
-                    port_name,
-                    machine.data['instance-id']))
-                server.interface_detach(port_id=port['id'])
-            logging.info("Deleting port {}".format(port_name))
-            neutron_client.delete_port(port['id'])
-
-
-def add_port_to_netplan(neutron_client, network_name, application_name):
-    units = {u.data['machine-id']: u.entity_id
-             for u in zaza.model.get_units(application_name=application_name)}
+    with tracing.span('juju.snapshot'):
+        snapshot = juju_session.snapshot(application_name)
     # Fold back into zaza.openstack.utilities.openstack
     network = get_network(neutron_client, network_name)
-    for machine in zaza.model.get_machines(application_name=application_name):
-        unit_name = units[machine.entity_id]
+    inventory = Inventory(neutron_client, network)
+    mac_addresses = {}
+    missing = []
+    for unit, machine in zip(snapshot.units, snapshot.machines):
         port_name = get_port_name(network, machine)
-        port = get_port(neutron_client, port_name)
-        mac_address = port['mac_address']
-        run_cmd_nic = "ip -f link -br -o addr|grep {}".format(mac_address)
-        logging.info("Running '{}' on {}".format(run_cmd_nic, unit_name))
-        interface = zaza.model.run_on_unit(unit_name, run_cmd_nic)
-        interface = interface['Stdout'].split(' ')[0]
-
-        run_cmd_netplan = """sudo egrep -iR '{}|{}$' /etc/netplan/
-                            """.format(mac_address, interface)
-
-        logging.info("Running '{}' on {}".format(run_cmd_netplan, unit_name))
-        netplancfg = zaza.model.run_on_unit(unit_name, run_cmd_netplan)
-
-        if (mac_address in str(netplancfg)) or (interface in str(netplancfg)):
-            logging.warn("mac address {} or nic {} already exists in "
-                         "/etc/netplan".format(mac_address, interface))
+        port = inventory.get_port(port_name)
+        if port is None:
+            logging.warning("No port {} found for {}, skipping".format(
+                port_name,
+                unit.entity_id))
+            missing.append(NetplanResult(
+                unit.entity_id,
+                None,
+                False,
+                'no port {}'.format(port_name)))
             continue
-        body_value = textwrap.dedent("""\
-            network:
-                ethernets:
-                    {0}:
-                        dhcp4: true
-                        dhcp6: false
-                        optional: true
-                        match:
-                            macaddress: {1}
-                        set-name: {0}
-                version: 2
-        """.format(interface, mac_address))
-        for attempt in tenacity.Retrying(
-                stop=tenacity.stop_after_attempt(3),
-                wait=tenacity.wait_exponential(
-                multiplier=1, min=2, max=10)):
-            with attempt:
-                with tempfile.NamedTemporaryFile(mode="w") as netplan_file:
-                    netplan_file.write(body_value)
-                    netplan_file.flush()
-                    logging.info("Copying {} to {}".format(
-                        unit_name,
-                        '/home/ubuntu/60-dataport.yaml'))
-                    subprocess.check_call([
-                        'juju',
-                        'scp',
-                        netplan_file.name,
-                        '{}:/home/ubuntu/60-dataport.yaml'.format(unit_name)])
-                run_cmd_mv = ("sudo mv /home/ubuntu/60-dataport.yaml "
-                              "/etc/netplan/")
-                logging.info(
-                    "Running '{}' on {}".format(run_cmd_mv, unit_name))
-                zaza.model.run_on_unit(unit_name, run_cmd_mv)
-                logging.info("Running netplan apply")
-                zaza.model.run_on_unit(unit_name, "sudo netplan apply")
+        mac_addresses[unit.entity_id] = port['mac_address']
+
+    async def _configure_units():
+        semaphore = asyncio.Semaphore(parallel)
+
+        async def _configure_unit(unit_name, mac_address):
+            async with semaphore:
+                logging.info("Configuring netplan on {}".format(unit_name))
+                try:
+                    with tracing.span('netplan', unit=unit_name):
+                        return await async_configure_netplan(
+                            unit_name,
+                            mac_address)
+                except Exception as e:
+                    return NetplanResult(unit_name, None, False, str(e))
+        return await asyncio.gather(*[
+            _configure_unit(unit_name, mac_address)
+            for unit_name, mac_address in mac_addresses.items()])
+    results = asyncio.run(_configure_units()) + missing
+    for result in sorted(results):
+        if result.error:
+            logging.error("{}: {}".format(result.unit_name, result.error))
+        else:
+            logging.info("{}: {} {}".format(
+                result.unit_name,
+                result.interface,
+                'changed' if result.changed else 'unchanged'))
+    return results
+
 
+def create_port_for_machine(inventory, waiter, machine, vnic_type,
+                            port_security_enabled=True, shutdown_move=True):
+    """Create a port for a machine and attach it to the machines server.
 
+    :param inventory: Inventory of ports and servers
+    :type inventory: Inventory
+    :param waiter: Waiter for server status changes
+    :type waiter: status_waiter.ServerWaiter
+    :param machine: Machine to add port to
+    :type machine: juju.machine.Machine
+    :param vnic_type: vnic type
+    :type vnic_type: Union[str, None]
+    :param port_security_enabled: Whether to enable port security
+    :type port_security_enabled: bool
+    :param shutdown_move: Whether to stop the server while attaching the port
+    :type shutdown_move: bool
+    :returns: Whether the port was attached, False if it already was.
+    :rtype: bool
+    """
+    network = inventory.network
+    port_name = get_port_name(network, machine)
+    port = inventory.get_port(port_name)
+    if port:
+        logging.warning("Skipping creating port {}".format(port_name))
+    else:
+        logging.info("Creating port {}".format(port_name))
+        port_config = {
+            'port': {
+                'admin_state_up': True,
+                'name': port_name,
+                'network_id': network['id'],
+                'port_security_enabled': port_security_enabled,
+            }
+        }
+        if vnic_type:
+            port_config['port']['binding:vnic_type'] = vnic_type
+            port_config['port']['binding:profile'] = {
+                'capabilities': 'switchdev'}
+        port = inventory.neutron_client.create_port(
+            body=port_config)['port']
+        inventory.add_port(port)
+    server = inventory.get_server(machine.data['instance-id'])
+    if inventory.is_port_attached(server, port['id']):
+        logging.warning(
+            "Skipping attaching port {} to {}, already attached".format(
+                 port_name,
+                 machine.data['instance-id']))
+        return False
+    logging.info("Shutting down {}".format(
+        machine.data['instance-id']))
+    server_state = getattr(server, 'OS-EXT-STS:vm_state').lower()
+    if shutdown_move and server_state != 'stopped':
+        with tracing.span('nova.server.stop'):
+            server.stop()
+        #subprocess.call(
+        #    ['juju', 'ssh', unit.unit_name, 'sudo shutdown -h now'])
+        waiter.wait(server.id, 'stopped', msg="Server stopped")
+    logging.info("Attaching port {} to {}".format(
+        port_name,
+        machine.data['instance-id']))
+    with tracing.span('nova.server.interface_attach', port=port['id']):
+        server.interface_attach(
+            port_id=port['id'],
+            net_id=None,
+            fixed_ip=None)
+    inventory.set_port_device(port['id'], server.id)
+    logging.info("Starting up {}".format(
+        machine.data['instance-id']))
+    if shutdown_move:
+        with tracing.span('nova.server.start'):
+            server.start()
+        waiter.wait(server.id, 'active', msg="Server start")
+    return True
+
+
+def log_results(results, action):
+    """Log a summary of the per unit results of an action.
+
+    :param results: Map of outcome to list of unit descriptions
+    :type results: Dict[str, List[str]]
+    :param action: Name of action the results are for
+    :type action: str
+    """
+    logging.info("{} summary: {} succeeded, {} skipped, {} failed".format(
+        action,
+        len(results[SUCCEEDED]),
+        len(results[SKIPPED]),
+        len(results[FAILED])))
+    for outcome in (SUCCEEDED, SKIPPED):
+        if results[outcome]:
+            logging.info("{}: {}".format(
+                outcome.capitalize(),
+                ', '.join(sorted(results[outcome]))))
+    if results[FAILED]:
+        logging.error("Failed: {}".format(
+            ', '.join(sorted(results[FAILED]))))
+
+
+@tracing.traced()
 def create_ports(nova_client, neutron_client, network_name, application_name,
-                 vnic_type, port_security_enabled=True, shutdown_move=True):
+                 vnic_type, port_security_enabled=True, shutdown_move=True,
+                 parallel=1):
     """Add ports to all units in application.
 
+    Each machine is stopped, has its port attached and is started again
+    independently of the others, up to parallel machines at a time. A
+    failure on one machine is logged and does not stop the others.
+
     :param nova_client: Nova client
     :type nova_client: novaclient.v2.client.Client
     :param neutron_client: Neutron client
@@ -192,72 +675,66 @@ def create_ports(nova_client, neutron_client, network_name, application_name,
     :type vnic_type: Union[str, None]
     :param port_security_enabled: Whether to enable port security
     :type port_security_enabled: bool
+    :param shutdown_move: Whether to stop servers while attaching ports
+    :type shutdown_move: bool
+    :param parallel: Maximum number of machines to process at once
+    :type parallel: int
+    :returns: Map of outcome to list of machines
+    :rtype: Dict[str, List[str]]
     """
     network = get_network(neutron_client, network_name)
-    for machine in zaza.model.get_machines(application_name=application_name):
-        port_name = get_port_name(network, machine)
-        port = get_port(neutron_client, port_name)
-        if port:
-            logging.warning("Skipping creating port {}".format(port_name))
-        else:
-            logging.info("Creating port {}".format(port_name))
-            port_config = {
-                'port': {
-                    'admin_state_up': True,
-                    'name': port_name,
-                    'network_id': network['id'],
-                    'port_security_enabled': port_security_enabled,
-                }
-            }
-            if vnic_type:
-                port_config['port']['binding:vnic_type'] = vnic_type
-                port_config['port']['binding:profile'] = {
-                    'capabilities': 'switchdev'}
-            port = neutron_client.create_port(body=port_config)['port']
-        server = nova_client.servers.get(machine.data['instance-id'])
-        if is_port_attached(nova_client, server, port['id']):
-            logging.warning(
-                "Skipping attaching port {} to {}, already attached".format(
-                     port_name,
-                     machine.data['instance-id']))
-        else:
-            logging.info("Shutting down {}".format(
-                machine.data['instance-id']))
-            server_state = getattr(server, 'OS-EXT-STS:vm_state').lower()
-            if shutdown_move and server_state != 'stopped':
-                server.stop()
-                #subprocess.call(
-                #    ['juju', 'ssh', unit.unit_name, 'sudo shutdown -h now'])
-                zaza_os.resource_reaches_status(
-                    nova_client.servers,
-                    server.id,
-                    resource_attribute='OS-EXT-STS:vm_state',
-                    expected_status="stopped",
-                    msg="Server stopped")
-            logging.info("Attaching port {} to {}".format(
-                port_name,
-                machine.data['instance-id']))
-            server.interface_attach(
-                port_id=port['id'],
-                net_id=None,
-                fixed_ip=None)
-            logging.info("Starting up {}".format(
-                machine.data['instance-id']))
-            if shutdown_move:
-                server.start()
-                zaza_os.resource_reaches_status(
-                    nova_client.servers,
-                    server.id,
-                    resource_attribute='OS-EXT-STS:vm_state',
-                    expected_status='active',
-                    msg="Server start")
+    inventory = Inventory(neutron_client, network, nova_client=nova_client)
+    waiter = status_waiter.ServerWaiter(nova_client)
+    results = {SUCCEEDED: [], SKIPPED: [], FAILED: []}
+
+    def _create_port(machine):
+        with tracing.span(
+                'add-port',
+                unit=machine.entity_id,
+                server=machine.data['instance-id']):
+            return create_port_for_machine(
+                inventory,
+                waiter,
+                machine,
+                vnic_type,
+                port_security_enabled=port_security_enabled,
+                shutdown_move=shutdown_move)
 
+    with tracing.span('juju.get_machines'):
+        machines = juju_session.get_machines(application_name)
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=parallel) as executor:
+        futures = {}
+        for machine in machines:
+            future = executor.submit(_create_port, machine)
+            futures[future] = '{} ({})'.format(
+                machine.entity_id,
+                machine.data['instance-id'])
+        for future in concurrent.futures.as_completed(futures):
+            machine_desc = futures[future]
+            try:
+                attached = future.result()
+            except Exception as e:
+                logging.error("Adding port to machine {} failed: {}".format(
+                    machine_desc,
+                    e))
+                results[FAILED].append(machine_desc)
+                continue
+            results[SUCCEEDED if attached else SKIPPED].append(machine_desc)
+    log_results(results, 'Add ports')
+    waiter.log_timings()
+    return results
 
+
+@tracing.traced()
 def add_servers(nova_client, neutron_client, network_name, number_of_units,
                 flavor_name, image_name, vnic_type='direct',
-                port_security_enabled=False):
+                port_security_enabled=False, parallel=1, wait=False):
     """Create a servers using pre-created ports
 
+    Ports for all missing servers are created in bulk and the servers are
+    launched up to parallel at a time.
+
     :param nova_client: Nova client
     :type nova_client: novaclient.v2.client.Client
     :param neutron_client: Neutron client
@@ -274,92 +751,268 @@ def add_servers(nova_client, neutron_client, network_name, number_of_units,
     :type vnic_type: Union[str, None]
     :param port_security_enabled: Whether to enable port security
     :type port_security_enabled: bool
+    :param parallel: Maximum number of servers to launch at once
+    :type parallel: int
+    :param wait: Whether to wait for servers to become active
+    :type wait: bool
+    :returns: Map of outcome to list of server names
+    :rtype: Dict[str, List[str]]
     """
     network = get_network(neutron_client, network_name)
 
-    image = nova_client.glance.find_image(image_name)
+    image = undercloud_cache.cached(
+        'image/{}'.format(image_name),
+        lambda: nova_client.glance.find_image(image_name).id)
 
-    flavor = nova_client.flavors.find(name=flavor_name)
+    flavor = undercloud_cache.cached(
+        'flavor/{}'.format(flavor_name),
+        lambda: nova_client.flavors.find(name=flavor_name).id)
 
-    net = neutron_client.find_resource("network", network_name)
     meta = {}
 
     # Add ~/.ssh/id_rsa.pub if its not there already
     ssh_dir = '{}/.ssh'.format(str(Path.home()))
     keypair_name = 'ps5benchmarking'
 
-    existing_keys = nova_client.keypairs.findall(name=keypair_name)
+    keypair_key = 'keypair/{}'.format(keypair_name)
+    # cached() does not store None, so a missing keypair is looked up again
+    # next run rather than remembered; it is cached once created below.
+    existing_keys = undercloud_cache.cached(
+        keypair_key,
+        lambda: bool(nova_client.keypairs.findall(name=keypair_name)) or None)
     key_file = '{}/id_rsa.pub'.format(ssh_dir, keypair_name)
 
     assert os.path.isfile(key_file), "Cannot find keyfile {}".format(key_file)
 
-    if not existing_keys:
+    def _create_keypair():
         with open(key_file, 'r') as kf:
             pub_key = kf.read()
         nova_client.keypairs.create(
             name=keypair_name,
             public_key=pub_key)
+        undercloud_cache.get_cache().set(keypair_key, True)
 
+    if not existing_keys:
+        _create_keypair()
+    keypair_lock = threading.Lock()
+
+    existing_servers = {
+        server.name
+        for server in nova_client.servers.list(
+            search_opts={'name': '^{}'.format(MACHINE_PREFIX)},
+            limit=-1)}
+    existing_ports = {
+        port['name']: port
+        for port in neutron_client.list_ports(
+            network_id=network['id'],
+            retrieve_all=True)['ports']
+        if port['name'].startswith(MACHINE_PREFIX) and
+        not port['device_id']}
+    vm_names = []
+    skipped = []
     for i in range(0, int(number_of_units)):
         if i == 0:
             vm_name = CONTROLLER_NAME
         else:
             vm_name = "{}-{}".format(MACHINE_PREFIX, i)
-
-        try:
-            nova_client.servers.find(name=vm_name)
-            logging.warn("{} already exists, skipping".format(vm_name))
+        if vm_name in existing_servers:
+            logging.warning("{} already exists, skipping".format(vm_name))
+            skipped.append(vm_name)
             continue
-        except novaclient.exceptions.NotFound:
-            pass
-        port_name = "{}_port".format(vm_name)
+        vm_names.append(vm_name)
 
+    port_configs = []
+    for vm_name in vm_names:
+        port_name = "{}_port".format(vm_name)
+        if port_name in existing_ports:
+            logging.info("Reusing port {}".format(port_name))
+            continue
         port_config = {
-            'port': {
-                'admin_state_up': True,
-                'name': port_name,
-                'network_id': net['id'],
-                'port_security_enabled': port_security_enabled,
-            }
+            'admin_state_up': True,
+            'name': port_name,
+            'network_id': network['id'],
+            'port_security_enabled': port_security_enabled,
         }
         if vnic_type:
-            port_config['port']['binding:vnic_type'] = vnic_type
-            port_config['port']['binding:profile'] = {
+            port_config['binding:vnic_type'] = vnic_type
+            port_config['binding:profile'] = {
                 'capabilities': 'switchdev'}
-        port = neutron_client.create_port(body=port_config)['port']
+        port_configs.append(port_config)
+    ports = dict(existing_ports)
+    for i in range(0, len(port_configs), PORT_BATCH_SIZE):
+        batch = port_configs[i:i + PORT_BATCH_SIZE]
+        logging.info("Creating {} ports".format(len(batch)))
+        for port in neutron_client.create_port(
+                body={'ports': batch})['ports']:
+            ports[port['name']] = port
 
-        nics = [{'port-id': port.get('id')}]
+    def _launch(vm_name):
+        nics = [{'port-id': ports["{}_port".format(vm_name)]['id']}]
 
         bdmv2 = None
 
+        def _create():
+            return nova_client.servers.create(
+                name=vm_name,
+                image=image,
+                block_device_mapping_v2=bdmv2,
+                flavor=flavor,
+                key_name=keypair_name,
+                meta=meta,
+                nics=nics)
+
         logging.info('Launching instance {}'.format(vm_name))
-        instance = nova_client.servers.create(
-            name=vm_name,
-            image=image,
-            block_device_mapping_v2=bdmv2,
-            flavor=flavor,
-            key_name=keypair_name,
-            meta=meta,
-            nics=nics)
+        with tracing.span('launch', vm_name=vm_name):
+            try:
+                instance = _create()
+            except novaclient.exceptions.BadRequest as e:
+                # The cached keypair was deleted out of band
+                if 'key_name' not in str(e):
+                    raise
+                with keypair_lock:
+                    undercloud_cache.invalidate(keypair_key)
+                    if not nova_client.keypairs.findall(name=keypair_name):
+                        logging.warning("Recreating keypair {}".format(
+                            keypair_name))
+                        _create_keypair()
+                instance = _create()
+        # Time to active starts once nova has the request, not when the
+        # launch was queued behind --parallel others.
+        return instance, time.monotonic()
 
+    waiter = status_waiter.ServerWaiter(nova_client)
+    results = {SUCCEEDED: [], SKIPPED: skipped, FAILED: []}
+    active_futures = {}
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=parallel) as executor:
+        launches = {}
+        for vm_name in vm_names:
+            launches[executor.submit(_launch, vm_name)] = vm_name
+        for future in concurrent.futures.as_completed(launches):
+            vm_name = launches[future]
+            try:
+                instance, started = future.result()
+            except Exception as e:
+                logging.error("Launching {} failed: {}".format(vm_name, e))
+                results[FAILED].append(vm_name)
+                continue
+            if not wait:
+                results[SUCCEEDED].append(vm_name)
+                continue
+            active_futures[waiter.expect(
+                instance.id,
+                'active',
+                msg="Server active")] = (
+                    vm_name,
+                    time.monotonic() - started)
+    times_to_active = []
+    for future in concurrent.futures.as_completed(active_futures):
+        vm_name, launch_time = active_futures[future]
+        try:
+            times_to_active.append(launch_time + future.result())
+        except Exception as e:
+            logging.error("{} did not become active: {}".format(vm_name, e))
+            results[FAILED].append(vm_name)
+            continue
+        results[SUCCEEDED].append(vm_name)
+    if times_to_active:
+        times_to_active.sort()
+        logging.info(
+            "Time to active: p50 {:.1f}s, p90 {:.1f}s, p99 {:.1f}s, "
+            "max {:.1f}s".format(
+                percentile(times_to_active, 50),
+                percentile(times_to_active, 90),
+                percentile(times_to_active, 99),
+                times_to_active[-1]))
+    log_results(results, 'Add servers')
+    return results
 
-def add_new_hostkey(ip):
+
+def percentile(values, pct):
+    """Return the nearest rank percentile of sorted values.
+
+    :param values: Sorted values
+    :type values: List[float]
+    :param pct: Percentile to return, 0 to 100
+    :type pct: float
+    :returns: Percentile
+    :rtype: float
+    """
+    rank = max(int(math.ceil(pct / 100.0 * len(values))), 1)
+    return values[rank - 1]
+
+
+async def async_wait_for_ssh(ip, timeout=600, interval=5):
+    """Wait for the ssh port of a host to accept connections.
+
+    :param ip: IP address of host
+    :type ip: str
+    :param timeout: Seconds to wait for
+    :type timeout: float
+    :param interval: Seconds between connection attempts
+    :type interval: float
+    :raises: TimeoutError
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection(ip, 22),
+                interval)
+            writer.close()
+            await writer.wait_closed()
+            return
+        except (OSError, asyncio.TimeoutError):
+            if time.monotonic() > deadline:
+                raise TimeoutError(
+                    'ssh on {} not reachable after {}s'.format(ip, timeout))
+            await asyncio.sleep(interval)
+
+
+async def async_add_new_hostkey(ip):
     """Remove the existing hostkey and blindly add new one.
 
     :param ip: IP address entry to refresh
     :type ip: str
+    :raises: subprocess.CalledProcessError
     """
-    subprocess.check_call(
-        ['ssh-keygen', '-R', ip],
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.STDOUT)
     conn = 'ubuntu@{}'.format(ip)
-    subprocess.check_call(
-        ['ssh', '-o', 'StrictHostKeyChecking=accept-new', conn, '"exit"'],
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.STDOUT)
+    for cmd in (['ssh-keygen', '-R', ip],
+                ['ssh', '-o', 'StrictHostKeyChecking=accept-new', conn,
+                 '"exit"']):
+        with tracing.span('subprocess.{}'.format(cmd[0]), host=ip):
+            proc = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.STDOUT)
+            returncode = await proc.wait()
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, cmd)
+
+
+def check_output(cmd):
+    """Run a command in a span named after it and return its output.
+
+    :param cmd: Command and arguments
+    :type cmd: List[str]
+    :returns: Output of command
+    :rtype: bytes
+    :raises: subprocess.CalledProcessError
+    """
+    with tracing.span('subprocess.{}'.format(' '.join(cmd[:2]))):
+        return subprocess.check_output(cmd)
 
 
+def add_new_hostkey(ip):
+    """Remove the existing hostkey and blindly add new one.
+
+    :param ip: IP address entry to refresh
+    :type ip: str
+    """
+    asyncio.run(async_add_new_hostkey(ip))
+
+
+@tracing.traced()
 def add_cloud(nova_client):
     """Register a manual cloud
 
@@ -370,11 +1023,13 @@ def add_cloud(nova_client):
     ip = [ips[0] for net, ips in controller.networks.items()][0]
     unit_address = 'ubuntu@{}'.format(ip)
     add_new_hostkey(ip)
-    clouds = yaml.load(
-        subprocess.check_output(['juju', 'list-clouds', '--format', 'yaml']),
-        Loader=yaml.FullLoader)
+    clouds = undercloud_cache.cached(
+        'juju-clouds',
+        lambda: yaml.load(
+            check_output(['juju', 'list-clouds', '--format', 'yaml']),
+            Loader=yaml.FullLoader))
     if CLOUD_NAME in clouds:
-        logging.warn('Cloud {} already exists'.format(CLOUD_NAME))
+        logging.warning('Cloud {} already exists'.format(CLOUD_NAME))
     else:
         contents = textwrap.dedent("""\
             clouds:
@@ -387,44 +1042,152 @@ def add_cloud(nova_client):
         with tempfile.NamedTemporaryFile(mode='w', delete=False) as tfile:
             tfile.write(contents)
             logging.info(tfile.name)
-        subprocess.check_output(
+        check_output(
             ['juju', 'add-cloud', '--client', CLOUD_NAME, tfile.name])
-    subprocess.check_output(
+        undercloud_cache.invalidate('juju-clouds')
+    check_output(
         ['juju', 'bootstrap', CLOUD_NAME, '{}-controller'.format(CLOUD_NAME)])
 
 
-def add_machines(nova_client):
+class AddMachineError(Exception):
+    """juju add-machine failed."""
+
+
+async def async_add_machine(ip):
+    """Add host to the current model with juju add-machine.
+
+    :param ip: IP address of host
+    :type ip: str
+    :raises: AddMachineError
+    """
+    cmd = ['juju', 'add-machine', 'ssh:ubuntu@{}'.format(ip)]
+    with tracing.span('subprocess.juju add-machine', host=ip):
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        stdout, stderr = await proc.communicate()
+    if proc.returncode != 0:
+        error = stderr.decode().strip()
+        if 'already provisioned' in error:
+            logging.warning('{} is already provisioned'.format(ip))
+            return
+        raise AddMachineError(error)
+
+
+@tracing.traced()
+def add_machines(nova_client, parallel=20, add_parallel=10, retries=3,
+                 report_file=None):
     """Add machines to manual cloud
 
+    Each machine is added as soon as its ssh port is reachable and its host
+    key has been refreshed, without waiting for the other machines. If a
+    report file from an earlier run exists the machines it lists as added
+    are skipped, so a rerun only retries the failures.
+
     :param nova_client: Nova client
     :type nova_client: novaclient.v2.client.Client
+    :param parallel: Maximum number of hosts to probe and key at once
+    :type parallel: int
+    :param add_parallel: Maximum number of juju add-machine runs at once
+    :type add_parallel: int
+    :param retries: Number of attempts at adding a machine
+    :type retries: int
+    :param report_file: JSON file to record added and failed hosts in
+    :type report_file: Union[str, None]
+    :returns: Added hosts and map of failed hosts to errors
+    :rtype: Dict
     """
+    report = {'added': [], 'failed': {}}
+    if report_file and os.path.exists(report_file):
+        with open(report_file, 'r') as f:
+            report['added'] = json.load(f).get('added', [])
     ips = []
     for server in nova_client.servers.list():
         if (server.name.startswith(MACHINE_PREFIX) and
                 not server.name == CONTROLLER_NAME):
             ip = [ips[0] for net, ips in server.networks.items()][0]
+            if ip in report['added']:
+                logging.info('Skipping {}, already added'.format(ip))
+                continue
             ips.append(ip)
-            add_new_hostkey(ip)
+
+    total = len(report['added']) + len(ips)
 
     async def _add_machines():
+        semaphore = asyncio.Semaphore(parallel)
+        add_semaphore = asyncio.Semaphore(add_parallel)
+
+        def log_progress():
+            logging.info('Progress: {}/{} added, {} failed'.format(
+                len(report['added']),
+                total,
+                len(report['failed'])))
+
+        async def prepare_host(ip):
+            async with semaphore:
+                start = time.monotonic()
+                with tracing.span('wait.ssh', host=ip):
+                    await async_wait_for_ssh(ip)
+                reachable = time.monotonic()
+                await async_add_new_hostkey(ip)
+                logging.info(
+                    '{} reachable after {:.1f}s, host key refreshed after '
+                    '{:.1f}s'.format(
+                        ip,
+                        reachable - start,
+                        time.monotonic() - reachable))
+
         async def run_add_machine(ip):
-            logging.info('Adding {}'.format(ip))
-            cmd = ['juju', 'add-machine', 'ssh:ubuntu@{}'.format(ip)]
-            proc = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            stdout, stderr = await proc.communicate()
-            if proc.returncode != 0:
-                logging.error(
-                    'Problem adding {}: {}'.format(ip,
-                                                   stderr.decode().strip()))
-            else:
-                logging.info('Finished adding {}'.format(ip))
-        await asyncio.gather(*[run_add_machine(ip) for ip in ips])
+            try:
+                await prepare_host(ip)
+            except Exception as e:
+                logging.error('Problem preparing {}: {}'.format(ip, e))
+                report['failed'][ip] = str(e)
+                log_progress()
+                return
+            async with add_semaphore:
+                logging.info('Adding {}'.format(ip))
+                start = time.monotonic()
+                try:
+                    async for attempt in tenacity.AsyncRetrying(
+                            stop=tenacity.stop_after_attempt(retries),
+                            wait=tenacity.wait_exponential(
+                                multiplier=1, min=5, max=60),
+                            retry=tenacity.retry_if_exception_type(
+                                AddMachineError),
+                            reraise=True):
+                        with attempt:
+                            if attempt.retry_state.attempt_number > 1:
+                                logging.warning('Retrying adding {}'.format(
+                                    ip))
+                            await async_add_machine(ip)
+                except Exception as e:
+                    logging.error('Problem adding {}: {}'.format(ip, e))
+                    report['failed'][ip] = str(e) or type(e).__name__
+                else:
+                    logging.info('Finished adding {} in {:.1f}s'.format(
+                        ip,
+                        time.monotonic() - start))
+                    report['added'].append(ip)
+            log_progress()
+        results = await asyncio.gather(
+            *[run_add_machine(ip) for ip in ips],
+            return_exceptions=True)
+        for ip, result in zip(ips, results):
+            if (isinstance(result, BaseException) and
+                    ip not in report['failed']):
+                logging.error('Problem adding {}: {}'.format(ip, result))
+                report['failed'][ip] = str(result) or type(result).__name__
     asyncio.run(_add_machines())
+    if report_file:
+        with open(report_file, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if report['failed']:
+        logging.error('Failed to add: {}'.format(
+            ', '.join(sorted(report['failed']))))
+    return report
 
 
 def parse_args(args):
@@ -453,21 +1216,70 @@ def parse_args(args):
                         dest='enable_port_security',
                         help='Whether to enable port security',
                         type=bool)
+    parser.add_argument('--parallel', dest='parallel',
+                        help='Number of units to operate on at once, '
+                             'the default depends on the action',
+                        type=manage_magpie_units.positive_int)
+    parser.add_argument('--add-machine-parallel', dest='add_parallel',
+                        help='Number of juju add-machine runs at once',
+                        type=manage_magpie_units.positive_int)
+    parser.add_argument('--retries', dest='retries',
+                        help='Number of attempts at adding a machine',
+                        type=int)
+    parser.add_argument('--report', dest='report_file',
+                        help='JSON file to record added and failed machines '
+                             'in, machines already added are skipped')
+    parser.add_argument('--wait', dest='wait',
+                        help='Wait for new servers to become active',
+                        action='store_true')
+    parser.add_argument('--remove-servers', dest='remove_servers',
+                        help='Have cleanup also delete the servers and '
+                             'ports created by add-servers',
+                        action='store_true')
+    parser.add_argument('--refresh-cache', dest='refresh_cache',
+                        help='Discard cached undercloud lookups',
+                        action='store_true')
+    parser.add_argument('--cache-ttl', dest='cache_ttl',
+                        help='Seconds undercloud lookups are cached for',
+                        type=float)
+    parser.add_argument('--trace', dest='trace_file',
+                        help='Time API calls, subprocesses and waits, log a '
+                             'summary and write a Chrome trace to file at '
+                             'exit')
     parser.add_argument('--log', dest='loglevel',
                         help='Loglevel [DEBUG|INFO|WARN|ERROR|CRITICAL]')
     parser.set_defaults(
         loglevel='INFO',
+        refresh_cache=False,
+        cache_ttl=undercloud_cache.DEFAULT_TTL,
         vnic_binding_type='direct',
-        enable_port_security=False)
+        enable_port_security=False,
+        parallel=None,
+        add_parallel=10,
+        retries=3,
+        wait=False,
+        remove_servers=False)
     return parser.parse_args(args)
 
 
 def main():
     args = parse_args(sys.argv[1:])
     cli_utils.setup_logging(log_level=args.loglevel.upper())
-    session = zaza_os.get_undercloud_keystone_session()
-    neutron_client = zaza_os.get_neutron_session_client(session)
-    nova_client = zaza_os.get_nova_session_client(session)
+    if args.trace_file:
+        tracing.enable(args.trace_file, action=args.action)
+    undercloud_cache.configure(
+        ttl=args.cache_ttl,
+        refresh=args.refresh_cache)
+    with tracing.span('keystone.session'):
+        session = undercloud_cache.get_keystone_session()
+    neutron_client = tracing.trace_client(
+        zaza_os.get_neutron_session_client(session),
+        'neutron')
+    nova_client = tracing.trace_client(
+        zaza_os.get_nova_session_client(session),
+        'nova',
+        tracing.NOVA_MANAGERS)
+    parallel = {'parallel': args.parallel} if args.parallel else {}
     if args.vnic_binding_type == 'dummy':
         logging.warning('Running in dummy mode')
         binding_type = None
@@ -475,27 +1287,39 @@ def main():
         binding_type = args.vnic_binding_type
     if args.action == 'cleanup':
         logging.info('Running cleanup')
-        cleanup(
+        results = cleanup(
             nova_client,
             neutron_client,
             args.network_name,
-            args.application_name)
+            args.application_name,
+            remove_servers=args.remove_servers,
+            **parallel)
+        if results[FAILED]:
+            sys.exit(1)
     elif args.action == 'add-ports':
         logging.info('Adding ports')
-        create_ports(
+        results = create_ports(
             nova_client,
             neutron_client,
             args.network_name,
             args.application_name,
             binding_type,
-            shutdown_move=True)
+            shutdown_move=True,
+            **parallel)
+        if results[FAILED]:
+            logging.error('Not adding to netplan, rerun add-ports to retry '
+                          'failed units')
+            sys.exit(1)
         logging.info('Adding to netplan')
-        add_port_to_netplan(
+        netplan_results = add_port_to_netplan(
             neutron_client,
             args.network_name,
-            args.application_name)
+            args.application_name,
+            **parallel)
+        if any(r.error for r in netplan_results):
+            sys.exit(1)
     elif args.action == 'add-servers':
-        add_servers(
+        results = add_servers(
             nova_client,
             neutron_client,
             args.network_name,
@@ -503,11 +1327,22 @@ def main():
             args.flavor,
             args.image_name,
             vnic_type=binding_type,
-            port_security_enabled=args.enable_port_security)
+            port_security_enabled=args.enable_port_security,
+            **parallel,
+            wait=args.wait)
+        if results[FAILED]:
+            sys.exit(1)
     elif args.action == 'add-manual-cloud':
         add_cloud(nova_client)
     elif args.action == 'add-machines':
-        add_machines(nova_client)
+        report = add_machines(
+            nova_client,
+            add_parallel=args.add_parallel,
+            retries=args.retries,
+            report_file=args.report_file,
+            **parallel)
+        if report['failed']:
+            sys.exit(1)
 
 
 if __name__ == "__main__":
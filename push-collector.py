@@ -0,0 +1,625 @@
+#!/usr/bin/env python3
+# A stand-in for a Prometheus push-gateway which keeps every pushed sample
+# on disk so benchmark results can be collected without Prometheus and
+# queried later.
+
+import argparse
+import base64
+import bisect
+import collections
+import gzip
+import json
+import logging
+import os
+import queue
+import re
+import struct
+import sys
+import threading
+import time
+import urllib.parse
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+SERIES_FILE = 'series.jsonl'
+SAMPLES_FILE = 'samples.bin'
+BLOCKS_FILE = 'blocks.bin'
+
+# series id, timestamp in seconds, value
+RECORD = struct.Struct('<Idd')
+
+# Offset and number of the records of one write to the samples file and the
+# earliest and latest of their timestamps, so queries can skip other times
+BLOCK = struct.Struct('<QQdd')
+
+# Records read from the samples file at once
+READ_RECORDS = 65536
+
+Sample = collections.namedtuple(
+    'Sample',
+    ['metric', 'labels', 'timestamp', 'value'])
+
+SAMPLE_RE = re.compile(
+    r'^(?P<metric>[a-zA-Z_:][a-zA-Z0-9_:]*)'
+    r'(\{(?P<labels>.*)\})?\s+'
+    r'(?P<value>\S+)'
+    r'(\s+(?P<timestamp>-?\d+))?\s*$')
+LABEL_RE = re.compile(
+    r'\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*(=~|!=|!~|=)\s*"((?:[^"\\]|\\.)*)"\s*,?')
+SELECTOR_RE = re.compile(
+    r'^\s*(?P<metric>[a-zA-Z_:][a-zA-Z0-9_:]*)?\s*(\{(?P<labels>.*)\})?\s*$')
+
+
+def _unescape(value):
+    return value.replace('\\"', '"').replace('\\n', '\n').replace('\\\\', '\\')
+
+
+def parse_labels(text):
+    """Parse the labels of a sample or selector.
+
+    :param text: Labels without braces eg a="1",b=~"x.*"
+    :type text: str
+    :returns: List of (name, operator, value)
+    :rtype: List[Tuple[str, str, str]]
+    """
+    labels = []
+    pos = 0
+    text = text or ''
+    while pos < len(text.rstrip()):
+        match = LABEL_RE.match(text, pos)
+        if not match:
+            raise ValueError('Bad labels: {}'.format(text))
+        labels.append((
+            match.group(1),
+            match.group(2),
+            _unescape(match.group(3))))
+        pos = match.end()
+    return labels
+
+
+def parse_exposition(body, grouping, now):
+    """Parse a push in the Prometheus text exposition format.
+
+    :param body: Pushed metrics
+    :type body: str
+    :param grouping: Grouping labels from the push URL, which override those
+                     of the samples as they do for the push-gateway
+    :type grouping: Dict[str, str]
+    :param now: Timestamp of samples without one
+    :type now: float
+    :returns: Samples
+    :rtype: List[Sample]
+    """
+    samples = []
+    for line in body.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        match = SAMPLE_RE.match(line)
+        if not match:
+            raise ValueError('Bad sample: {}'.format(line))
+        labels = {n: v for n, _, v in parse_labels(match.group('labels'))}
+        labels.update(grouping)
+        timestamp = match.group('timestamp')
+        samples.append(Sample(
+            match.group('metric'),
+            labels,
+            int(timestamp) / 1000.0 if timestamp else now,
+            float(match.group('value'))))
+    return samples
+
+
+def parse_grouping(path):
+    """Return the grouping labels of a /metrics/job/<job>/... push URL.
+
+    :param path: Path of push URL
+    :type path: str
+    :returns: Grouping labels
+    :rtype: Dict[str, str]
+    """
+    parts = [urllib.parse.unquote(p) for p in path.strip('/').split('/')]
+    if len(parts) < 3 or parts[0] != 'metrics' or len(parts) % 2 == 0:
+        raise ValueError('Bad push path: {}'.format(path))
+    grouping = {}
+    for name, value in zip(parts[1::2], parts[2::2]):
+        if name.endswith('@base64'):
+            name = name[:-len('@base64')]
+            value = base64.urlsafe_b64decode(
+                value + '=' * (-len(value) % 4)).decode()
+        grouping[name] = value
+    return grouping
+
+
+def series_key(metric, labels):
+    return (metric, tuple(sorted(labels.items())))
+
+
+class Store(object):
+    """Append-only on-disk store of samples.
+
+    Series are listed once each, as JSON lines, when first seen. Samples
+    are fixed size records of series id, timestamp and value, each write of
+    which is indexed by its time range. All writes happen on one thread
+    which batches whatever has been queued.
+
+    :param path: Directory of store
+    :type path: str
+    :param flush_interval: Maximum seconds between writes
+    :type flush_interval: float
+    """
+
+    def __init__(self, path, flush_interval=1.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        if not os.path.exists(path):
+            os.makedirs(path)
+        repair_store(path)
+        self.series = load_series(path)
+        self.ids = {series_key(s['metric'], s['labels']): i
+                    for i, s in self.series.items()}
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.received = 0
+        self.written = 0
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+
+    def add(self, samples):
+        """Queue samples to be written."""
+        with self.lock:
+            self.received += len(samples)
+        self.queue.put(samples)
+
+    def _write_loop(self):
+        series_fp = open(os.path.join(self.path, SERIES_FILE), 'a')
+        samples_fp = open(os.path.join(self.path, SAMPLES_FILE), 'ab')
+        blocks_fp = open(os.path.join(self.path, BLOCKS_FILE), 'ab')
+        while True:
+            batches = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                try:
+                    batches.append(self.queue.get(
+                        timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            stop = None in batches
+            flushed = [b for b in batches if isinstance(b, threading.Event)]
+            records = []
+            timestamps = []
+            for batch in batches:
+                if batch is None or batch in flushed:
+                    continue
+                for sample in batch:
+                    key = series_key(sample.metric, sample.labels)
+                    series_id = self.ids.get(key)
+                    if series_id is None:
+                        series_id = len(self.ids)
+                        self.ids[key] = series_id
+                        series = {
+                            'id': series_id,
+                            'metric': sample.metric,
+                            'labels': sample.labels}
+                        self.series[series_id] = series
+                        series_fp.write(json.dumps(series) + '\n')
+                    records.append(RECORD.pack(
+                        series_id,
+                        sample.timestamp,
+                        sample.value))
+                    timestamps.append(sample.timestamp)
+            # Series are flushed first so every sample on disk has a series
+            series_fp.flush()
+            if records:
+                offset = samples_fp.tell()
+                samples_fp.write(b''.join(records))
+                samples_fp.flush()
+                blocks_fp.write(BLOCK.pack(
+                    offset,
+                    len(records),
+                    min(timestamps),
+                    max(timestamps)))
+                blocks_fp.flush()
+            self.written += len(records)
+            for event in flushed:
+                event.set()
+            if stop:
+                series_fp.close()
+                samples_fp.close()
+                blocks_fp.close()
+                return
+
+    def flush(self):
+        """Wait for everything queued so far to be written."""
+        event = threading.Event()
+        self.queue.put(event)
+        event.wait()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+def _truncate(path, size):
+    if os.path.exists(path) and os.path.getsize(path) > size:
+        logging.warning("Dropping {} partly written bytes of {}".format(
+            os.path.getsize(path) - size,
+            path))
+        os.truncate(path, size)
+
+
+def repair_store(path):
+    """Drop a partly written last entry from each file of a store.
+
+    The collector may be killed in the middle of a write, appending after
+    the partial entry would corrupt the next one.
+
+    :param path: Directory of store
+    :type path: str
+    """
+    series_file = os.path.join(path, SERIES_FILE)
+    if os.path.exists(series_file):
+        with open(series_file, 'rb') as f:
+            end = f.seek(0, os.SEEK_END)
+            while end > 0:
+                start = max(0, end - 4096)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b'\n')
+                if newline >= 0:
+                    end = start + newline + 1
+                    break
+                end = start
+        _truncate(series_file, end)
+    samples_file = os.path.join(path, SAMPLES_FILE)
+    samples_size = 0
+    if os.path.exists(samples_file):
+        samples_size = os.path.getsize(samples_file)
+        samples_size -= samples_size % RECORD.size
+        _truncate(samples_file, samples_size)
+    blocks = load_blocks(path)
+    while blocks and (blocks[-1][0] + blocks[-1][1] * RECORD.size >
+                      samples_size):
+        blocks.pop()
+    _truncate(os.path.join(path, BLOCKS_FILE), len(blocks) * BLOCK.size)
+
+
+def load_blocks(path):
+    """Load the index of the writes to the samples file of a store.
+
+    :param path: Directory of store
+    :type path: str
+    :returns: Offset, number of records and earliest and latest timestamp
+              of each write
+    :rtype: List[Tuple[int, int, float, float]]
+    """
+    blocks_file = os.path.join(path, BLOCKS_FILE)
+    if not os.path.exists(blocks_file):
+        return []
+    with open(blocks_file, 'rb') as f:
+        data = f.read()
+    return list(BLOCK.iter_unpack(data[:len(data) - len(data) % BLOCK.size]))
+
+
+def load_series(path):
+    """Load the series of a store.
+
+    :param path: Directory of store
+    :type path: str
+    :returns: Map of series id to series
+    :rtype: Dict[int, Dict]
+    """
+    series = {}
+    series_file = os.path.join(path, SERIES_FILE)
+    if os.path.exists(series_file):
+        with open(series_file, 'r') as f:
+            for line in f:
+                if line.endswith('\n'):
+                    entry = json.loads(line)
+                    series[entry['id']] = entry
+    return series
+
+
+def match_series(series, selector):
+    """Return the ids of series matching a selector.
+
+    :param series: Map of series id to series
+    :type series: Dict[int, Dict]
+    :param selector: Metric name and optional labels eg fio_read_iops{unit="a"}
+    :type selector: str
+    :returns: Matching series ids
+    :rtype: List[int]
+    """
+    match = SELECTOR_RE.match(selector)
+    if not match or not (match.group('metric') or match.group('labels')):
+        raise ValueError('Only metric selectors are supported: {}'.format(
+            selector))
+    matchers = parse_labels(match.group('labels'))
+    if match.group('metric'):
+        matchers.append(('__name__', '=', match.group('metric')))
+    ids = []
+    for series_id, entry in series.items():
+        labels = dict(entry['labels'], __name__=entry['metric'])
+        matched = True
+        for name, op, value in matchers:
+            actual = labels.get(name, '')
+            if op == '=':
+                matched = actual == value
+            elif op == '!=':
+                matched = actual != value
+            elif op == '=~':
+                matched = re.fullmatch(value, actual) is not None
+            else:
+                matched = re.fullmatch(value, actual) is None
+            if not matched:
+                break
+        if matched:
+            ids.append(series_id)
+    return sorted(ids)
+
+
+def read_samples(path, series_ids, start=None, end=None):
+    """Read the samples of some series.
+
+    :param path: Directory of store
+    :type path: str
+    :param series_ids: Series to read
+    :type series_ids: List[int]
+    :param start: Earliest timestamp
+    :type start: Union[float, None]
+    :param end: Latest timestamp
+    :type end: Union[float, None]
+    Only the writes with timestamps between start and end are read, along
+    with any samples written after the last indexed write.
+
+    :returns: Map of series id to time ordered (timestamp, value) pairs
+    :rtype: Dict[int, List[Tuple[float, float]]]
+    """
+    wanted = set(series_ids)
+    samples = {i: [] for i in series_ids}
+    samples_file = os.path.join(path, SAMPLES_FILE)
+    # Nothing has been pushed yet
+    if not os.path.exists(samples_file):
+        return samples
+    # Byte ranges to read, None reads to the end of the file
+    ranges = []
+    indexed = 0
+    for offset, count, earliest, latest in load_blocks(path):
+        indexed = offset + count * RECORD.size
+        if start is not None and latest < start:
+            continue
+        if end is not None and earliest > end:
+            continue
+        if ranges and sum(ranges[-1]) == offset:
+            ranges[-1][1] += count * RECORD.size
+        else:
+            ranges.append([offset, count * RECORD.size])
+    ranges.append([indexed, None])
+    with open(samples_file, 'rb') as f:
+        for offset, length in ranges:
+            f.seek(offset)
+            while length is None or length > 0:
+                size = RECORD.size * READ_RECORDS
+                data = f.read(size if length is None else min(size, length))
+                # A record may be partly written
+                data = data[:len(data) - len(data) % RECORD.size]
+                if not data:
+                    break
+                if length is not None:
+                    length -= len(data)
+                for series_id, timestamp, value in RECORD.iter_unpack(data):
+                    if series_id not in wanted:
+                        continue
+                    if start is not None and timestamp < start:
+                        continue
+                    if end is not None and timestamp > end:
+                        continue
+                    samples[series_id].append((timestamp, value))
+    for points in samples.values():
+        points.sort()
+    return samples
+
+
+def query_range(path, selector, start, end, step, lookback=300):
+    """Evaluate a metric selector over a range like Prometheus query_range.
+
+    At each step the most recent sample no older than lookback is used.
+
+    :returns: Prometheus style matrix result
+    :rtype: List[Dict]
+    """
+    series = load_series(path)
+    ids = match_series(series, selector)
+    samples = read_samples(path, ids, start - lookback, end)
+    result = []
+    for series_id in ids:
+        points = samples[series_id]
+        times = [t for t, _ in points]
+        values = []
+        t = start
+        while t <= end:
+            i = bisect.bisect_right(times, t) - 1
+            if i >= 0 and t - times[i] <= lookback:
+                values.append([t, repr(points[i][1])])
+            t += step
+        if values:
+            entry = series[series_id]
+            result.append({
+                'metric': dict(entry['labels'], __name__=entry['metric']),
+                'values': values})
+    return result
+
+
+class CollectorServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+    # Hundreds of units may push at once
+    request_queue_size = 1024
+
+
+class PushHandler(BaseHTTPRequestHandler):
+
+    store = None
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+    def _reply(self, code, body=b'', content_type='text/plain'):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _push(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        if self.headers.get('Content-Encoding') == 'gzip':
+            try:
+                body = gzip.decompress(body)
+            except (OSError, EOFError, zlib.error) as e:
+                self._reply(400, 'Bad gzip body: {}'.format(e).encode())
+                return
+        try:
+            grouping = parse_grouping(urllib.parse.urlparse(self.path).path)
+            samples = parse_exposition(body.decode(), grouping, time.time())
+        except ValueError as e:
+            self._reply(400, str(e).encode())
+            return
+        self.store.add(samples)
+        self._reply(200)
+
+    do_PUT = _push
+    do_POST = _push
+
+    def do_DELETE(self):
+        # Pushed samples are kept, deleting a group only matters to scrapes
+        self._reply(202)
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        params = urllib.parse.parse_qs(url.query)
+        if url.path == '/-/healthy':
+            self._reply(200, b'OK')
+            return
+        if url.path != '/api/v1/query_range':
+            self._reply(404)
+            return
+        self.store.flush()
+        try:
+            result = query_range(
+                self.store.path,
+                params['query'][0],
+                float(params['start'][0]),
+                float(params['end'][0]),
+                float(params['step'][0]))
+        except (KeyError, ValueError) as e:
+            body = {'status': 'error', 'errorType': 'bad_data',
+                    'error': str(e)}
+            self._reply(400, json.dumps(body).encode(), 'application/json')
+            return
+        body = {'status': 'success',
+                'data': {'resultType': 'matrix', 'result': result}}
+        self._reply(200, json.dumps(body).encode(), 'application/json')
+
+
+def serve(args):
+    store = Store(args.store, args.flush_interval)
+    PushHandler.store = store
+    server = CollectorServer((args.address, args.port), PushHandler)
+    logging.info("Collecting pushes on {}:{} into {}".format(
+        args.address,
+        args.port,
+        args.store))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        last = 0
+        while thread.is_alive():
+            time.sleep(args.stats_interval)
+            if store.received != last:
+                last = store.received
+                logging.info(
+                    "{} samples received, {} written, {} series".format(
+                        store.received,
+                        store.written,
+                        len(store.ids)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        store.close()
+
+
+def query(args):
+    series = load_series(args.store)
+    ids = match_series(series, args.selector)
+    samples = read_samples(args.store, ids, args.start, args.end)
+    for series_id in ids:
+        entry = series[series_id]
+        labels = ','.join('{}="{}"'.format(k, v)
+                          for k, v in sorted(entry['labels'].items()))
+        for timestamp, value in samples[series_id]:
+            print('{}{{{}}} {} {:.3f}'.format(
+                entry['metric'],
+                labels,
+                value,
+                timestamp))
+
+
+def list_metrics(args):
+    counts = collections.Counter(
+        s['metric'] for s in load_series(args.store).values())
+    for metric, count in sorted(counts.items()):
+        print('{} {}'.format(metric, count))
+
+
+def parse_args(args):
+    """Parse command line arguments.
+
+    :returns: Parsed arguments
+    :rtype: Namespace
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--store', dest='store', default='push-store',
+                        help='Directory to store samples in')
+    parser.add_argument('--log', dest='loglevel', default='INFO',
+                        help='Loglevel [DEBUG|INFO|WARN|ERROR|CRITICAL]')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    serve_parser = subparsers.add_parser(
+        'serve', help='Accept pushes from push-gateway clients')
+    serve_parser.add_argument('-a', '--address', default='0.0.0.0',
+                              help='Address to listen on')
+    serve_parser.add_argument('-p', '--port', type=int, default=9091,
+                              help='Port to listen on')
+    serve_parser.add_argument('--flush-interval', type=float, default=1.0,
+                              help='Maximum seconds between writes')
+    serve_parser.add_argument('--stats-interval', type=float, default=60,
+                              help='Seconds between logging sample counts')
+    serve_parser.set_defaults(func=serve)
+    query_parser = subparsers.add_parser(
+        'query', help='Print the samples of series matching a selector')
+    query_parser.add_argument('selector',
+                              help='Metric name and optional labels eg '
+                                   'fio_read_iops{unit="woodpecker/0"}')
+    query_parser.add_argument('--start', type=float,
+                              help='Earliest unix timestamp')
+    query_parser.add_argument('--end', type=float,
+                              help='Latest unix timestamp')
+    query_parser.set_defaults(func=query)
+    metrics_parser = subparsers.add_parser(
+        'metrics', help='List metric names and their number of series')
+    metrics_parser.set_defaults(func=list_metrics)
+    return parser.parse_args(args)
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    logging.basicConfig(
+        format='%(asctime)s [%(levelname)s] %(message)s',
+        level=args.loglevel.upper())
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
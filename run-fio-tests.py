@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import collections
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+
+import zaza.utilities.cli as cli_utils
+
+import juju_session
+
+
+UnitResult = collections.namedtuple(
+    'UnitResult',
+    ['unit_name', 'status', 'duration'])
+
+
+def unit_number(unit_name):
+    """Return the number of a unit.
+
+    :param unit_name: Name of unit eg woodpecker/3
+    :type unit_name: str
+    :returns: Unit number
+    :rtype: int
+    """
+    return int(unit_name.split('/')[1])
+
+
+def combination_name(block_size, operation):
+    """Return the name a combination is recorded under in the state file.
+
+    :param block_size: fio block size
+    :type block_size: str
+    :param operation: fio operation
+    :type operation: str
+    :returns: Name of combination
+    :rtype: str
+    """
+    return '{}/{}'.format(block_size, operation)
+
+
+def parameters_hash(units, runtime):
+    """Return a hash of the parameters shared by every combination.
+
+    :param units: Names of units
+    :type units: List[str]
+    :param runtime: Seconds fio runs for on each unit
+    :type runtime: int
+    :returns: Hex digest
+    :rtype: str
+    """
+    parameters = json.dumps(
+        {'units': units, 'runtime': runtime},
+        sort_keys=True)
+    return hashlib.sha256(parameters.encode()).hexdigest()
+
+
+def load_state(state_file, parameters=None):
+    """Load the state of a sweep.
+
+    State saved by a sweep with other parameters is ignored, its
+    combinations were not run with the units and runtime of this one.
+
+    :param state_file: Path of state file
+    :type state_file: Union[str, None]
+    :param parameters: Hash of the parameters of the sweep
+    :type parameters: Union[str, None]
+    :returns: State of sweep
+    :rtype: Dict
+    """
+    if state_file and os.path.exists(state_file):
+        with open(state_file, 'r') as f:
+            state = json.load(f)
+        if state.get('parameters') == parameters:
+            return state
+        logging.warning(
+            "Ignoring {}, it is from a sweep with other units or "
+            "runtime".format(state_file))
+    return {'parameters': parameters, 'completed': {}}
+
+
+def save_state(state_file, state):
+    """Save the state of a sweep.
+
+    The state is written to a temporary file and moved into place so an
+    interrupted write does not lose the state.
+
+    :param state_file: Path of state file
+    :type state_file: Union[str, None]
+    :param state: State of sweep
+    :type state: Dict
+    """
+    if not state_file:
+        return
+    tmp_file = '{}.tmp'.format(state_file)
+    with open(tmp_file, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.rename(tmp_file, state_file)
+
+
+def run_combination(units, action_params, batch_size, ramp_interval):
+    """Run fio on all units, starting a batch of units every ramp interval.
+
+    Returns as soon as the last action completes.
+
+    :param units: Names of units
+    :type units: List[str]
+    :param action_params: Parameters of the fio action
+    :type action_params: Dict
+    :param batch_size: Number of units to start at once
+    :type batch_size: int
+    :param ramp_interval: Seconds between starting batches
+    :type ramp_interval: float
+    :returns: Result for each unit
+    :rtype: List[UnitResult]
+    """
+    async def _run_combination():
+        async def _run_unit(unit_name, delay):
+            await asyncio.sleep(delay)
+            start = time.monotonic()
+            try:
+                action = await juju_session.async_run_action(
+                    unit_name,
+                    'fio',
+                    action_params=action_params)
+                status = action.status
+            except Exception as e:
+                logging.error("fio on {} failed: {}".format(unit_name, e))
+                status = 'error'
+            return UnitResult(unit_name, status, time.monotonic() - start)
+        return await asyncio.gather(*[
+            _run_unit(unit_name, (i // batch_size) * ramp_interval)
+            for i, unit_name in enumerate(units)])
+    return asyncio.run(_run_combination())
+
+
+def sweep(units, block_sizes, operations, runtime, batch_size, ramp_interval,
+          state_file=None):
+    """Run fio for every block size and operation combination.
+
+    Each combination starts as soon as the previous one has finished on
+    every unit. Completed combinations are recorded in the state file and
+    skipped when the sweep is run again with the same units and runtime.
+
+    :param units: Names of units
+    :type units: List[str]
+    :param block_sizes: fio block sizes
+    :type block_sizes: List[str]
+    :param operations: fio operations
+    :type operations: List[str]
+    :param runtime: Seconds fio runs for on each unit
+    :type runtime: int
+    :param batch_size: Number of units to start at once
+    :type batch_size: int
+    :param ramp_interval: Seconds between starting batches
+    :type ramp_interval: float
+    :param state_file: Path of state file
+    :type state_file: Union[str, None]
+    :returns: Map of combination to units which failed
+    :rtype: Dict[str, List[str]]
+    """
+    state = load_state(state_file, parameters_hash(units, runtime))
+    failures = {}
+    if not units:
+        logging.warning("No units to run fio on")
+        return failures
+    for block_size in block_sizes:
+        for operation in operations:
+            name = combination_name(block_size, operation)
+            if name in state['completed']:
+                logging.info("Skipping {}, already completed".format(name))
+                continue
+            logging.info("Running {} on {} units".format(name, len(units)))
+            start = time.monotonic()
+            results = run_combination(
+                units,
+                {'operation': operation,
+                 'runtime': runtime,
+                 'block-size': block_size},
+                batch_size,
+                ramp_interval)
+            duration = time.monotonic() - start
+            if not results:
+                logging.error("{} returned no results".format(name))
+                failures[name] = list(units)
+                continue
+            failed = sorted(
+                (r.unit_name for r in results if r.status != 'completed'),
+                key=unit_number)
+            slowest = max(results, key=lambda r: r.duration)
+            logging.info(
+                "Finished {} in {:.0f}s, slowest unit {} took {:.0f}s, "
+                "{} failed".format(
+                    name,
+                    duration,
+                    slowest.unit_name,
+                    slowest.duration,
+                    len(failed)))
+            if failed:
+                logging.error("{} failed on: {}".format(
+                    name,
+                    ', '.join(failed)))
+                failures[name] = failed
+                continue
+            state['completed'][name] = {
+                'duration': duration,
+                'finished': time.time()}
+            save_state(state_file, state)
+    return failures
+
+
+def parse_args(args):
+    """Parse command line arguments.
+
+    :returns: Parsed arguments
+    :rtype: Namespace
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-a', '--application', dest='application_name',
+                        help='Name of woodpecker application')
+    parser.add_argument('-u', '--number-of-units', dest='number_of_units',
+                        type=int,
+                        help='Number of units to run on, defaults to all')
+    parser.add_argument('-o', '--operations', dest='operations',
+                        help='Space separated fio operations')
+    parser.add_argument('-b', '--block-sizes', dest='block_sizes',
+                        help='Space separated fio block sizes')
+    parser.add_argument('--runtime', dest='runtime', type=int,
+                        help='Seconds fio runs for on each unit')
+    parser.add_argument('--batch-size', dest='batch_size', type=int,
+                        help='Number of units to start at once')
+    parser.add_argument('--ramp-interval', dest='ramp_interval', type=float,
+                        help='Seconds between starting batches')
+    parser.add_argument('-s', '--state-file', dest='state_file',
+                        help='File recording completed combinations, used '
+                             'to resume a sweep')
+    parser.add_argument('--log', dest='loglevel',
+                        help='Loglevel [DEBUG|INFO|WARN|ERROR|CRITICAL]')
+    parser.set_defaults(
+        application_name='woodpecker',
+        operations='randwrite randread write read randrw',
+        block_sizes='4k 4M',
+        runtime=1800,
+        batch_size=20,
+        ramp_interval=90,
+        loglevel='INFO')
+    return parser.parse_args(args)
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    cli_utils.setup_logging(log_level=args.loglevel.upper())
+    units = sorted(
+        [u.entity_id for u in juju_session.get_units(args.application_name)],
+        key=unit_number)
+    if args.number_of_units:
+        units = units[:args.number_of_units]
+    failures = sweep(
+        units,
+        args.block_sizes.split(),
+        args.operations.split(),
+        args.runtime,
+        args.batch_size,
+        args.ramp_interval,
+        state_file=args.state_file)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
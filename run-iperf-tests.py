@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import collections
+import importlib
+import json
+import logging
+import re
+import statistics
+import sys
+import time
+
+import zaza.utilities.cli as cli_utils
+import zaza.openstack.utilities.openstack as zaza_os
+
+import juju_session
+import undercloud_cache
+
+manage_magpie_units = importlib.import_module('manage-magpie-units')
+
+
+PairResult = collections.namedtuple(
+    'PairResult',
+    ['speaker', 'target', 'status', 'duration', 'bandwidth'])
+
+BANDWIDTH_RE = re.compile(r'([\d.]+)\s*([KMGT]?)bits/sec')
+UNIT_MULTIPLIERS = {'': 1, 'K': 1e3, 'M': 1e6, 'G': 1e9, 'T': 1e12}
+
+
+def unit_number(unit_name):
+    """Return the number of a unit.
+
+    :param unit_name: Name of unit eg magpie/3
+    :type unit_name: str
+    :returns: Unit number
+    :rtype: int
+    """
+    return int(unit_name.split('/')[1])
+
+
+def fixed_pairs(units):
+    """Pair each unit in the first half with one in the second half.
+
+    :param units: Names of units
+    :type units: List[str]
+    :returns: Rounds of (speaker, target) pairs
+    :rtype: List[List[Tuple[str, str]]]
+    """
+    half = len(units) // 2
+    return [[(units[i], units[i + half]) for i in range(half)]]
+
+
+def ring_rounds(units, rounds=1):
+    """Have every unit speak to the unit an increasing offset away.
+
+    In round r every unit speaks to the unit r places after it so each unit
+    sends and receives one stream per round.
+
+    :param units: Names of units
+    :type units: List[str]
+    :param rounds: Number of rounds
+    :type rounds: int
+    :returns: Rounds of (speaker, target) pairs
+    :rtype: List[List[Tuple[str, str]]]
+    """
+    count = len(units)
+    return [
+        [(units[i], units[(i + r) % count]) for i in range(count)]
+        for r in range(1, min(rounds, count - 1) + 1)]
+
+
+def mesh_rounds(units):
+    """Pair every unit with every other unit once, spread over rounds.
+
+    Uses the circle method so each unit is in at most one pair per round.
+
+    :param units: Names of units
+    :type units: List[str]
+    :returns: Rounds of (speaker, target) pairs
+    :rtype: List[List[Tuple[str, str]]]
+    """
+    ring = list(units)
+    if len(ring) % 2:
+        ring.append(None)
+    count = len(ring)
+    rounds = []
+    for r in range(count - 1):
+        pairs = []
+        for i in range(count // 2):
+            speaker, target = ring[i], ring[count - 1 - i]
+            if speaker and target:
+                pairs.append((speaker, target) if r % 2 else
+                             (target, speaker))
+        rounds.append(pairs)
+        ring.insert(1, ring.pop())
+    return rounds
+
+
+TOPOLOGIES = {
+    'fixed': lambda units, args: fixed_pairs(units),
+    'ring': lambda units, args: ring_rounds(units, args.rounds),
+    'mesh': lambda units, args: mesh_rounds(units),
+}
+
+
+def get_unit_hypervisors(nova_client, application_name):
+    """Find which hypervisor each unit is on.
+
+    :param nova_client: Nova client
+    :type nova_client: novaclient.v2.client.Client
+    :param application_name: Name of application
+    :type application_name: Str
+    :returns: Map of unit name to hypervisor, None where nova does not
+              report one
+    :rtype: Dict[str, Union[str, None]]
+    """
+    placement = manage_magpie_units.get_placement(
+        nova_client,
+        application_name)
+    return {unit.unit_name: hypervisor
+            for hypervisor, units in placement.items()
+            for unit in units}
+
+
+def cross_hypervisor_only(rounds, hypervisors):
+    """Drop pairs whose units share a hypervisor.
+
+    Pairs with a unit whose hypervisor is not known are dropped too.
+
+    :param rounds: Rounds of (speaker, target) pairs
+    :type rounds: List[List[Tuple[str, str]]]
+    :param hypervisors: Map of unit name to hypervisor
+    :type hypervisors: Dict[str, Union[str, None]]
+    :returns: Rounds of (speaker, target) pairs
+    :rtype: List[List[Tuple[str, str]]]
+    """
+    unplaced = sorted(
+        {u for pairs in rounds for pair in pairs for u in pair
+         if hypervisors.get(u) is None},
+        key=unit_number)
+    if unplaced:
+        logging.warning(
+            "Not pairing units with no known hypervisor: {}".format(
+                ', '.join(unplaced)))
+    filtered = [
+        [(s, t) for s, t in pairs
+         if s not in unplaced and t not in unplaced and
+         hypervisors[s] != hypervisors[t]]
+        for pairs in rounds]
+    return [pairs for pairs in filtered if pairs]
+
+
+def parse_bandwidth(results):
+    """Return the bandwidth reported in run-iperf action results.
+
+    iperf reports bandwidth as eg '9.41 Gbits/sec'. Where '[SUM]' lines are
+    present they are used in preference to per stream lines, and the
+    highest bandwidth seen, ie that of the best concurrency, is returned.
+
+    :param results: Action results
+    :type results: Dict
+    :returns: Bandwidth in bits per second
+    :rtype: Union[float, None]
+    """
+    lines = []
+    for value in results.values():
+        if isinstance(value, dict):
+            nested = parse_bandwidth(value)
+            if nested is not None:
+                lines.append('[SUM] {:f} bits/sec'.format(nested))
+        elif isinstance(value, str):
+            lines.extend(value.splitlines())
+    sums = [line for line in lines if '[SUM]' in line]
+    bandwidths = []
+    for line in sums or lines:
+        for number, prefix in BANDWIDTH_RE.findall(line):
+            bandwidths.append(float(number) * UNIT_MULTIPLIERS[prefix])
+    return max(bandwidths) if bandwidths else None
+
+
+def run_round(pairs, action_params, parallel=100):
+    """Run iperf between each pair at the same time.
+
+    :param pairs: (speaker, target) pairs
+    :type pairs: List[Tuple[str, str]]
+    :param action_params: Parameters for the run-iperf action
+    :type action_params: Dict
+    :param parallel: Maximum number of actions to run at once
+    :type parallel: int
+    :returns: Result for each pair
+    :rtype: List[PairResult]
+    """
+    async def _run_round():
+        semaphore = asyncio.Semaphore(parallel)
+
+        async def _run_pair(speaker, target):
+            params = dict(action_params)
+            params['units'] = target
+            async with semaphore:
+                start = time.monotonic()
+                try:
+                    action = await juju_session.async_run_action(
+                        speaker,
+                        'run-iperf',
+                        action_params=params)
+                    status = action.status
+                    bandwidth = parse_bandwidth(
+                        action.data.get('results', {}))
+                except Exception as e:
+                    logging.error("iperf {} -> {} failed: {}".format(
+                        speaker,
+                        target,
+                        e))
+                    status = 'error'
+                    bandwidth = None
+            return PairResult(
+                speaker,
+                target,
+                status,
+                time.monotonic() - start,
+                bandwidth)
+        return await asyncio.gather(*[
+            _run_pair(speaker, target) for speaker, target in pairs])
+    return asyncio.run(_run_round())
+
+
+def summarise(results, hypervisors=None, slow_fraction=0.8):
+    """Log bandwidth per pair, flagging slow pairs and hypervisors.
+
+    :param results: Result for each pair
+    :type results: List[PairResult]
+    :param hypervisors: Map of unit name to hypervisor
+    :type hypervisors: Union[Dict[str, Union[str, None]], None]
+    :param slow_fraction: Fraction of the median below which a pair is slow
+    :type slow_fraction: float
+    """
+    measured = [r for r in results if r.bandwidth is not None]
+    if not measured:
+        logging.error("No bandwidth results")
+        return
+    median = statistics.median(r.bandwidth for r in measured)
+    logging.info("Median bandwidth {:.2f} Gbit/s over {} pairs".format(
+        median / 1e9,
+        len(measured)))
+    for r in sorted(measured, key=lambda r: r.bandwidth):
+        log = logging.warning if r.bandwidth < median * slow_fraction \
+            else logging.info
+        log("{:<14} -> {:<14} {:>7.2f} Gbit/s".format(
+            r.speaker,
+            r.target,
+            r.bandwidth / 1e9))
+    for r in results:
+        if r.bandwidth is None:
+            logging.error("{:<14} -> {:<14} {}".format(
+                r.speaker,
+                r.target,
+                r.status))
+    if not hypervisors:
+        return
+    by_hypervisor = collections.defaultdict(list)
+    unplaced = set()
+    for r in measured:
+        for unit_name in (r.speaker, r.target):
+            hypervisor = hypervisors.get(unit_name)
+            if hypervisor is None:
+                unplaced.add(unit_name)
+                continue
+            by_hypervisor[hypervisor].append(r.bandwidth)
+    if unplaced:
+        logging.warning(
+            "Hypervisor not known for {}, left out of the per hypervisor "
+            "bandwidth".format(', '.join(sorted(unplaced, key=unit_number))))
+    for hypervisor, bandwidths in sorted(
+            by_hypervisor.items(),
+            key=lambda h: statistics.mean(h[1])):
+        mean = statistics.mean(bandwidths)
+        log = logging.warning if mean < median * slow_fraction \
+            else logging.info
+        log("{:<20} mean {:>7.2f} Gbit/s over {} pairs".format(
+            hypervisor,
+            mean / 1e9,
+            len(bandwidths)))
+
+
+def bandwidth_matrix(results):
+    """Return bandwidth between each pair as a nested map.
+
+    :param results: Result for each pair
+    :type results: List[PairResult]
+    :returns: Map of speaker to map of target to bits per second
+    :rtype: Dict[str, Dict[str, Union[float, None]]]
+    """
+    matrix = collections.defaultdict(dict)
+    for r in results:
+        matrix[r.speaker][r.target] = r.bandwidth
+    return dict(matrix)
+
+
+def parse_args(args):
+    """Parse command line arguments.
+
+    :returns: Parsed arguments
+    :rtype: Namespace
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-a', '--application', dest='application_name',
+                        help='Name of magpie application')
+    parser.add_argument('-t', '--topology', dest='topology',
+                        choices=sorted(TOPOLOGIES.keys()),
+                        help='How to pair units')
+    parser.add_argument('-r', '--rounds', dest='rounds', type=int,
+                        help='Number of rounds for the ring topology')
+    parser.add_argument('-x', '--cross-hypervisor', dest='cross_hypervisor',
+                        action='store_true',
+                        help='Only pair units on different hypervisors')
+    parser.add_argument('-c', '--cidr', dest='cidr',
+                        help='Network cidr to test over')
+    parser.add_argument('--batch-time', dest='batch_time', type=int,
+                        help='Seconds per iperf batch')
+    parser.add_argument('--concurrency-progression',
+                        dest='concurrency_progression',
+                        help='iperf concurrency levels to run')
+    parser.add_argument('--total-run-time', dest='total_run_time', type=int,
+                        help='Seconds to run each pair for')
+    parser.add_argument('--tag', dest='tag',
+                        help='Tag for the pushed metrics')
+    parser.add_argument('--parallel', dest='parallel', type=int,
+                        help='Number of actions to run at once')
+    parser.add_argument('-o', '--output', dest='output',
+                        help='File to write the bandwidth matrix to as JSON')
+    parser.add_argument('--log', dest='loglevel',
+                        help='Loglevel [DEBUG|INFO|WARN|ERROR|CRITICAL]')
+    parser.set_defaults(
+        application_name='magpie',
+        topology='fixed',
+        rounds=1,
+        cross_hypervisor=False,
+        batch_time=30,
+        concurrency_progression='2 4',
+        total_run_time=120,
+        parallel=100,
+        loglevel='INFO')
+    return parser.parse_args(args)
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    cli_utils.setup_logging(log_level=args.loglevel.upper())
+    units = sorted(
+        [u.entity_id for u in juju_session.get_units(args.application_name)],
+        key=unit_number)
+    rounds = TOPOLOGIES[args.topology](units, args)
+    hypervisors = None
+    if args.cross_hypervisor:
+        undercloud_cache.configure()
+        hypervisors = get_unit_hypervisors(
+            zaza_os.get_nova_session_client(
+                undercloud_cache.get_keystone_session(),
+                version=2.56),
+            args.application_name)
+        rounds = cross_hypervisor_only(rounds, hypervisors)
+    action_params = {
+        'iperf-batch-time': args.batch_time,
+        'concurrency-progression': args.concurrency_progression,
+        'total-run-time': args.total_run_time}
+    if args.cidr:
+        action_params['network-cidr'] = args.cidr
+    if args.tag:
+        action_params['tag'] = args.tag
+    results = []
+    for i, pairs in enumerate(rounds):
+        logging.info("Round {}/{}: {} pairs".format(
+            i + 1,
+            len(rounds),
+            len(pairs)))
+        results.extend(run_round(pairs, action_params, args.parallel))
+    summarise(results, hypervisors)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(bandwidth_matrix(results), f, indent=2, sort_keys=True)
+    if any(r.status != 'completed' for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
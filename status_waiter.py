@@ -0,0 +1,335 @@
+"""Wait for many OpenStack resources to reach a status with one poller.
+
+Rather than each operation polling its own resource in a tight loop, every
+expected status change is registered with a waiter. A single background
+thread polls only the tracked resources, in batched calls, and resolves a
+future per expectation when its resource reaches the expected status.
+The poll interval backs off while nothing is changing and is jittered so
+several waiters do not poll the API in lock step.
+"""
+
+import abc
+import collections
+import concurrent.futures
+import logging
+import random
+import threading
+import time
+
+import novaclient.exceptions
+
+import tracing
+
+
+Transition = collections.namedtuple(
+    'Transition',
+    ['resource_id', 'status', 'duration'])
+
+Expectation = collections.namedtuple(
+    'Expectation',
+    ['status', 'future', 'started', 'deadline', 'msg'])
+
+
+class StatusWaiter(abc.ABC):
+    """Track expected status changes of many resources with one poller."""
+
+    name = 'resource'
+    # Statuses a resource will not leave, deleted is reported by fetch for
+    # resources which no longer exist
+    error_statuses = ('error', 'deleted')
+
+    def __init__(self, min_interval=2, max_interval=30, backoff=1.5,
+                 jitter=0.2, timeout=1200):
+        """Create waiter, polling starts when the first status is expected.
+
+        :param min_interval: Shortest time between polls in seconds
+        :type min_interval: float
+        :param max_interval: Longest time between polls in seconds
+        :type max_interval: float
+        :param backoff: Factor to grow the interval by when nothing changed
+        :type backoff: float
+        :param jitter: Fraction of the interval to randomly vary it by
+        :type jitter: float
+        :param timeout: Default time to wait for a status in seconds
+        :type timeout: float
+        """
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.timeout = timeout
+        self.timings = []
+        self.polls = 0
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.pending = collections.defaultdict(list)
+        self.last_statuses = {}
+        self.thread = None
+
+    @abc.abstractmethod
+    def fetch(self, resource_ids):
+        """Return the current status of resources.
+
+        :param resource_ids: Ids of resources to return status of
+        :type resource_ids: Set[str]
+        :returns: Map of resource id to lower case status
+        :rtype: Dict[str, str]
+        """
+
+    def expect(self, resource_id, status, timeout=None, msg=None):
+        """Start waiting for a resource to reach a status.
+
+        :param resource_id: Id of resource
+        :type resource_id: str
+        :param status: Status to wait for
+        :type status: str
+        :param timeout: Time to wait in seconds, defaults to waiter timeout
+        :type timeout: Union[float, None]
+        :param msg: Description of the change used in log messages
+        :type msg: Union[str, None]
+        :returns: Future resolving to the seconds taken to reach status
+        :rtype: concurrent.futures.Future
+        """
+        now = time.monotonic()
+        future = concurrent.futures.Future()
+        expectation = Expectation(
+            status.lower(),
+            future,
+            now,
+            now + (timeout or self.timeout),
+            msg or '{} {}'.format(self.name, status))
+        with self.lock:
+            self.pending[resource_id].append(expectation)
+            if not self.thread:
+                self.thread = threading.Thread(
+                    target=self._poll_loop,
+                    name='{}-waiter'.format(self.name),
+                    daemon=True)
+                self.thread.start()
+        self.wakeup.set()
+        return future
+
+    def wait(self, resource_id, status, timeout=None, msg=None):
+        """Block until a resource reaches a status.
+
+        :param resource_id: Id of resource
+        :type resource_id: str
+        :param status: Status to wait for
+        :type status: str
+        :param timeout: Time to wait in seconds, defaults to waiter timeout
+        :type timeout: Union[float, None]
+        :param msg: Description of the change used in log messages
+        :type msg: Union[str, None]
+        :returns: Seconds taken to reach status
+        :rtype: float
+        :raises: TimeoutError, RuntimeError
+        """
+        future = self.expect(
+            resource_id,
+            status,
+            timeout=timeout,
+            msg=msg)
+        with tracing.span(
+                'wait.{}.{}'.format(self.name, status),
+                **{self.name: resource_id}):
+            return future.result()
+
+    def _poll_loop(self):
+        interval = self.min_interval
+        last_poll = 0
+        while True:
+            self.wakeup.wait(
+                interval * random.uniform(1 - self.jitter, 1 + self.jitter))
+            if self.wakeup.is_set():
+                self.wakeup.clear()
+                interval = self.min_interval
+                since_last = time.monotonic() - last_poll
+                if since_last < self.min_interval:
+                    time.sleep(self.min_interval - since_last)
+            with self.lock:
+                if not self.pending:
+                    self.thread = None
+                    return
+                resource_ids = set(self.pending.keys())
+            last_poll = time.monotonic()
+            try:
+                statuses = self.fetch(resource_ids)
+                self.polls += 1
+            except Exception as e:
+                logging.warning("Polling {} status failed: {}".format(
+                    self.name,
+                    e))
+                statuses = {}
+            changed = self._resolve(statuses)
+            if changed:
+                interval = self.min_interval
+            else:
+                interval = min(interval * self.backoff, self.max_interval)
+
+    def _resolve(self, statuses):
+        now = time.monotonic()
+        changed = False
+        with self.lock:
+            for resource_id in list(self.pending.keys()):
+                status = statuses.get(resource_id)
+                if status and status != self.last_statuses.get(resource_id):
+                    changed = True
+                    self.last_statuses[resource_id] = status
+                remaining = []
+                for expectation in self.pending[resource_id]:
+                    if status == expectation.status:
+                        duration = now - expectation.started
+                        self.timings.append(
+                            Transition(resource_id, status, duration))
+                        logging.info("{} {} after {:.1f}s".format(
+                            expectation.msg,
+                            resource_id,
+                            duration))
+                        expectation.future.set_result(duration)
+                    elif status in self.error_statuses:
+                        expectation.future.set_exception(RuntimeError(
+                            "{} {}: {} in {} status".format(
+                                expectation.msg,
+                                resource_id,
+                                self.name,
+                                status)))
+                    elif now > expectation.deadline:
+                        expectation.future.set_exception(TimeoutError(
+                            "{} {}: timed out in {} status".format(
+                                expectation.msg,
+                                resource_id,
+                                status)))
+                    else:
+                        remaining.append(expectation)
+                if remaining:
+                    self.pending[resource_id] = remaining
+                else:
+                    del self.pending[resource_id]
+        return changed
+
+    def log_timings(self):
+        """Log how long resources took to reach each status."""
+        by_status = collections.defaultdict(list)
+        for transition in self.timings:
+            by_status[transition.status].append(transition.duration)
+        for status, durations in sorted(by_status.items()):
+            logging.info(
+                "{} {}: count {}, mean {:.1f}s, max {:.1f}s, "
+                "total {:.1f}s".format(
+                    self.name,
+                    status,
+                    len(durations),
+                    sum(durations) / len(durations),
+                    max(durations),
+                    sum(durations)))
+        logging.info("{} status polls: {}".format(self.name, self.polls))
+
+
+class ServerWaiter(StatusWaiter):
+    """Wait for nova servers to reach a vm_state.
+
+    Nova cannot list servers by id, so polls only list the servers which
+    changed since the previous poll. Servers tracked for the first time
+    which did not change are fetched one at a time, or with a single listing
+    of all servers when there are many of them.
+    """
+
+    name = 'server'
+    # Most new servers to fetch one at a time rather than listing all
+    get_limit = 20
+
+    def __init__(self, nova_client, **kwargs):
+        """Create waiter for servers.
+
+        :param nova_client: Nova client
+        :type nova_client: novaclient.v2.client.Client
+        """
+        super(ServerWaiter, self).__init__(**kwargs)
+        self.nova_client = nova_client
+        self.statuses = {}
+        self.changes_since = None
+
+    def _update(self, servers, tracked):
+        for server in servers:
+            self.changes_since = max(
+                self.changes_since or server.updated,
+                server.updated)
+            if server.id not in tracked and server.id not in self.statuses:
+                continue
+            if server.status == 'DELETED':
+                self.statuses[server.id] = 'deleted'
+            else:
+                self.statuses[server.id] = getattr(
+                    server,
+                    'OS-EXT-STS:vm_state').lower()
+
+    def fetch(self, resource_ids):
+        """Return the vm_state of servers.
+
+        :param resource_ids: Ids of servers to return status of
+        :type resource_ids: Set[str]
+        :returns: Map of server id to lower case vm_state, deleted for
+                  servers which no longer exist
+        :rtype: Dict[str, str]
+        """
+        if self.changes_since:
+            self._update(
+                self.nova_client.servers.list(
+                    detailed=True,
+                    search_opts={'changes-since': self.changes_since},
+                    limit=-1),
+                resource_ids)
+        unknown = resource_ids - set(self.statuses)
+        if len(unknown) > self.get_limit:
+            servers = self.nova_client.servers.list(detailed=True, limit=-1)
+            for server_id in unknown - {s.id for s in servers}:
+                self.statuses[server_id] = 'deleted'
+            self._update(servers, resource_ids)
+        else:
+            for server_id in unknown:
+                try:
+                    server = self.nova_client.servers.get(server_id)
+                except novaclient.exceptions.NotFound:
+                    self.statuses[server_id] = 'deleted'
+                    continue
+                self._update([server], resource_ids)
+        return {i: self.statuses[i] for i in resource_ids}
+
+
+class PortWaiter(StatusWaiter):
+    """Wait for neutron ports to be attached to or detached from a device."""
+
+    name = 'port'
+    # Keep the id filters of a listing within URL length limits
+    batch_size = 100
+
+    def __init__(self, neutron_client, **kwargs):
+        """Create waiter for ports.
+
+        :param neutron_client: Neutron client
+        :type neutron_client: neutronclient.v2_0.client.Client
+        """
+        super(PortWaiter, self).__init__(**kwargs)
+        self.neutron_client = neutron_client
+
+    def fetch(self, resource_ids):
+        """Return whether ports are attached.
+
+        :param resource_ids: Ids of ports to return status of
+        :type resource_ids: Set[str]
+        :returns: Map of port id to attached or detached, deleted for ports
+                  which no longer exist
+        :rtype: Dict[str, str]
+        """
+        port_ids = sorted(resource_ids)
+        statuses = {}
+        for i in range(0, len(port_ids), self.batch_size):
+            for port in self.neutron_client.list_ports(
+                    id=port_ids[i:i + self.batch_size],
+                    fields=['id', 'device_id'])['ports']:
+                statuses[port['id']] = (
+                    'attached' if port['device_id'] else 'detached')
+        statuses.update({
+            resource_id: 'deleted'
+            for resource_id in resource_ids - set(statuses)})
+        return statuses
@@ -0,0 +1,90 @@
+"""Shared helpers of the tests."""
+
+import contextlib
+import importlib
+import importlib.machinery
+import importlib.util
+import os
+import sys
+import unittest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+for path in (REPO, os.path.join(REPO, 'benchmarks')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+# Shortest time between server status polls of scripts run on a fake cloud
+POLL_INTERVAL = 0.001
+
+
+def load_script(name):
+    """Import a script whose name is not a valid identifier.
+
+    :param name: Name of script without .py, eg manage-sriov-ports
+    :type name: str
+    :returns: Module
+    :rtype: module
+    """
+    return importlib.import_module(name)
+
+
+def load_file(path):
+    """Import a script by path, eg one without a .py suffix.
+
+    The module is registered under the name a plain import of it would use
+    so that importing it normally later does not load a second copy.
+
+    :param path: Path of script relative to the top of the repository
+    :type path: str
+    :returns: Module
+    :rtype: module
+    """
+    name = os.path.splitext(os.path.basename(path))[0].replace('-', '_')
+    # Scripts import the modules next to them
+    directory = os.path.dirname(os.path.join(REPO, path))
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+    if name not in sys.modules:
+        loader = importlib.machinery.SourceFileLoader(
+            name,
+            os.path.join(REPO, path))
+        spec = importlib.util.spec_from_loader(name, loader)
+        module = importlib.util.module_from_spec(spec)
+        loader.exec_module(module)
+        sys.modules[name] = module
+    return sys.modules[name]
+
+
+class FakeCloudTestCase(unittest.TestCase):
+    """Run the scripts against a fake cloud set up as for a benchmark."""
+
+    def setUp(self):
+        import undercloud_cache
+        # Lookups cached by an earlier test refer to another fake cloud
+        undercloud_cache.get_cache().invalidate()
+
+    def make_cloud(self, scenario, units, **cloud_args):
+        """Populate a fake cloud and point the scripts at it until cleanup.
+
+        Sets self.cloud, self.nova and self.neutron.
+
+        :param scenario: Name of benchmark scenario whose setup to use
+        :type scenario: str
+        :param units: Number of units
+        :type units: int
+        :param cloud_args: Latency and failure settings of the fake cloud
+        :type cloud_args: Dict
+        :returns: Fake cloud
+        :rtype: fake_cloud.FakeCloud
+        """
+        import fake_cloud
+        bench = load_script('run-scale-benchmarks')
+        self.cloud = fake_cloud.FakeCloud(**cloud_args)
+        bench.SCENARIOS[scenario].setup(self.cloud, units)
+        self.nova = fake_cloud.FakeNova(self.cloud)
+        self.neutron = fake_cloud.FakeNeutron(self.cloud)
+        stack = contextlib.ExitStack()
+        stack.enter_context(bench.fake_backends(self.cloud, POLL_INTERVAL))
+        self.addCleanup(stack.close)
+        return self.cloud
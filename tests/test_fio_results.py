@@ -0,0 +1,98 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from tests import helpers
+
+fio_results = helpers.load_file('machine-fio-testing/fio_results.py')
+
+
+def make_job(i):
+    percentiles = {'{:.6f}'.format(p / 100.0): 1000 * (i + p)
+                   for p in range(1, 10000, 7)}
+    percentiles.update({'50.000000': 500 + i, '90.000000': 900 + i,
+                        '99.000000': 990 + i, '99.900000': 999 + i})
+    return {
+        'jobname': 'job{}'.format(i),
+        'job options': {'numjobs': '1'},
+        'read': {
+            'io_bytes': 4096 * (i + 1),
+            'runtime': 1000,
+            'iops': 10.5 * (i + 1),
+            'bw_bytes': 4096,
+            'clat_ns': {'mean': 1.25e3, 'percentile': percentiles}},
+        'write': {'io_bytes': 0},
+    }
+
+
+class ParseResultFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, 'optane-randread-4k.json')
+        self.data = {
+            'fio version': 'fio-3.16',
+            'global options': {'iodepth': '32', 'rw': 'randread'},
+            'jobs': [make_job(i) for i in range(20)],
+            'disk_util': [{'name': 'nvme0n1', 'util': 99.5}],
+        }
+        with open(self.path, 'w') as fp:
+            fp.write('note: both iodepth >= 1 and synchronous I/O engine\n')
+            json.dump(self.data, fp, indent=2)
+
+    def expected(self):
+        rows = []
+        for job in self.data['jobs']:
+            clat = job['read']['clat_ns']
+            rows.append((
+                'optane', 'randread', '4k', job['jobname'], 'read', 1, 32,
+                job['read']['io_bytes'], 1000, job['read']['iops'], 4096,
+                1.25e3, clat['percentile']['50.000000'],
+                clat['percentile']['90.000000'],
+                clat['percentile']['99.000000'],
+                clat['percentile']['99.900000']))
+        return rows
+
+    def test_rows(self):
+        for read_size in (7, 4096, fio_results.READ_SIZE):
+            with mock.patch.object(fio_results, 'READ_SIZE', read_size):
+                self.assertEqual(
+                    fio_results.parse_result_file(self.path),
+                    self.expected())
+
+    def test_one_job_buffered(self):
+        sizes = []
+        fill = fio_results._JSONStream._fill
+
+        def _fill(stream):
+            sizes.append(len(stream.buffer) - stream.pos)
+            return fill(stream)
+
+        with mock.patch.object(fio_results._JSONStream, '_fill', _fill):
+            fio_results.parse_result_file(self.path)
+        job_size = len(json.dumps(self.data['jobs'][0], indent=2))
+        self.assertLess(job_size * 5, os.path.getsize(self.path) / 4)
+        self.assertLess(max(sizes), job_size * 5)
+
+    def test_empty_jobs(self):
+        with open(self.path, 'w') as fp:
+            json.dump({'jobs': [], 'global options': {}}, fp)
+        self.assertEqual(fio_results.parse_result_file(self.path), [])
+
+    def test_truncated(self):
+        with open(self.path) as fp:
+            text = fp.read()
+        with open(self.path, 'w') as fp:
+            fp.write(text[:len(text) // 2])
+        with self.assertRaises(ValueError):
+            fio_results.parse_result_file(self.path)
+
+
+class LoadFileTest(unittest.TestCase):
+
+    def test_single_module(self):
+        import fio_results as imported
+        self.assertIs(imported, fio_results)
@@ -0,0 +1,187 @@
+import argparse
+import contextlib
+import glob
+import http.server
+import io
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from tests import helpers
+
+grafana_snapshots = helpers.load_file(
+    'grafana/snapshot-management/grafana-snapshots')
+
+
+def make_snapshot(title):
+    return {'meta': {}, 'dashboard': {'title': title, 'panels': [
+        {'id': i, 'snapshotData': list(range(100))} for i in range(50)]}}
+
+
+class FakeGrafana(http.server.ThreadingHTTPServer):
+    """Stand in for the snapshot API of grafana."""
+
+    def __init__(self):
+        super(FakeGrafana, self).__init__(('127.0.0.1', 0), FakeHandler)
+        self.snapshots = {}
+        # Keys whose download fails with a server error or is cut short
+        self.broken = set()
+        self.truncated = set()
+        self.downloads = []
+        self.uploads = []
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+    def add(self, key, name, updated):
+        self.snapshots[key] = {
+            'name': name,
+            'updated': updated,
+            'payload': make_snapshot(name)}
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+        self.thread.join()
+
+
+class FakeHandler(http.server.BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, data, code=200):
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        assert self.headers['Authorization'] == 'Bearer token'
+        if self.path == '/api/dashboard/snapshots':
+            return self.send_json([
+                {'key': k, 'name': s['name'], 'updated': s['updated']}
+                for k, s in server.snapshots.items()])
+        key = self.path.rsplit('/', 1)[1]
+        with server.lock:
+            server.downloads.append(key)
+        if key in server.broken:
+            return self.send_json({'message': 'broken'}, 500)
+        body = json.dumps(server.snapshots[key]['payload']).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if key in server.truncated:
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server
+        payload = json.loads(
+            self.rfile.read(int(self.headers['Content-Length'])))
+        with server.lock:
+            server.uploads.append(payload.get('key') or payload['name'])
+        self.send_json({'key': payload.get('key')})
+
+
+class GrafanaSnapshotsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.grafana = FakeGrafana()
+        self.addCleanup(self.grafana.close)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.dir = self.tmp.name
+        for i in range(10):
+            self.grafana.add('k{}'.format(i), 'Run {}'.format(i), '2021-01-01')
+
+    def run_command(self, func, archive=False):
+        args = argparse.Namespace(
+            url=self.grafana.url,
+            token='token',
+            dir=self.dir,
+            parallel=4,
+            archive=archive)
+        with contextlib.redirect_stdout(io.StringIO()):
+            return func(args)
+
+    def stored(self):
+        with open(os.path.join(self.dir, grafana_snapshots.INDEX_FILE)) as f:
+            index = json.load(f)
+        snapshots = {}
+        for key, entry in index.items():
+            # Failed downloads are indexed without updated to retry them
+            if 'updated' not in entry:
+                continue
+            with open(os.path.join(self.dir, entry['file'])) as f:
+                snapshots[key] = json.load(f)
+        return snapshots
+
+    def test_download_writes_every_snapshot(self):
+        self.assertEqual(self.run_command(grafana_snapshots.download), [])
+        self.assertEqual(
+            self.stored(),
+            {k: s['payload'] for k, s in self.grafana.snapshots.items()})
+        self.assertEqual(glob.glob(os.path.join(self.dir, '*.tmp')), [])
+
+    def test_failed_download_does_not_abort_others(self):
+        self.grafana.broken.add('k3')
+        self.grafana.truncated.add('k6')
+        failed = self.run_command(grafana_snapshots.download)
+        self.assertEqual(sorted(failed), ['k3', 'k6'])
+        self.assertEqual(
+            sorted(self.stored()),
+            ['k0', 'k1', 'k2', 'k4', 'k5', 'k7', 'k8', 'k9'])
+        # Nothing partial is left behind
+        self.assertEqual(
+            sorted(os.listdir(self.dir)),
+            sorted(['.index.json'] + [
+                'Run_{}.json'.format(i) for i in (0, 1, 2, 4, 5, 7, 8, 9)]))
+
+    def test_failed_download_keeps_previous_copy(self):
+        self.run_command(grafana_snapshots.download)
+        previous = self.stored()['k6']
+        self.grafana.snapshots['k6']['updated'] = '2021-02-01'
+        self.grafana.snapshots['k6']['payload'] = make_snapshot('Changed')
+        self.grafana.truncated.add('k6')
+        self.assertEqual(self.run_command(grafana_snapshots.download), ['k6'])
+        with open(os.path.join(self.dir, 'Run_6.json')) as f:
+            self.assertEqual(json.load(f), previous)
+        self.assertEqual(glob.glob(os.path.join(self.dir, '*.tmp')), [])
+        # and is fetched again once the server recovers
+        self.grafana.truncated.clear()
+        self.assertEqual(self.run_command(grafana_snapshots.download), [])
+        self.assertEqual(self.stored()['k6']['dashboard']['title'], 'Changed')
+
+    def test_download_is_incremental(self):
+        self.run_command(grafana_snapshots.download)
+        self.grafana.downloads.clear()
+        self.grafana.snapshots['k2']['updated'] = '2021-02-01'
+        self.run_command(grafana_snapshots.download)
+        self.assertEqual(self.grafana.downloads, ['k2'])
+
+    def test_upload_skips_existing(self):
+        for archive in (False, True):
+            self.run_command(grafana_snapshots.download, archive=archive)
+            for key in ('k1', 'k4'):
+                del self.grafana.snapshots[key]
+            self.assertEqual(
+                self.run_command(grafana_snapshots.upload, archive=archive),
+                [])
+            self.assertEqual(sorted(self.grafana.uploads), ['k1', 'k4'])
+            for key in ('k1', 'k4'):
+                self.grafana.add(key, 'Run', '2021-01-01')
+            self.grafana.uploads.clear()
+            self.dir = tempfile.mkdtemp(dir=self.tmp.name)
@@ -0,0 +1,55 @@
+import asyncio
+import threading
+
+from tests import helpers
+
+import juju_session
+
+bench = helpers.load_script('run-scale-benchmarks')
+
+
+class JujuSessionTest(helpers.FakeCloudTestCase):
+
+    def setUp(self):
+        super(JujuSessionTest, self).setUp()
+        self.make_cloud('balance', 6)
+
+    def test_calls_share_one_connection(self):
+        snapshot = juju_session.snapshot(bench.APPLICATION_NAME)
+        self.assertEqual(
+            {u: um.instance_id for u, um in snapshot.unit_machines.items()},
+            {u: unit['instance-id'] for u, unit in self.cloud.units.items()})
+        self.assertEqual(
+            len(juju_session.get_machines(bench.APPLICATION_NAME)),
+            6)
+        results = []
+
+        def _run(unit_name):
+            # Each thread awaits the session from its own event loop
+            results.append(asyncio.run(
+                juju_session.async_run_on_unit(unit_name, 'hostname')))
+
+        threads = [
+            threading.Thread(target=_run, args=(unit_name,))
+            for unit_name in self.cloud.units]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(
+            results,
+            [{'Code': '0', 'Stdout': '', 'Stderr': ''}] * 6)
+        action = asyncio.run(juju_session.async_run_action(
+            '{}/0'.format(bench.APPLICATION_NAME),
+            'advertise'))
+        self.assertEqual(action.status, 'completed')
+        self.assertEqual(self.cloud.calls['juju.connect'], 1)
+        self.assertEqual(self.cloud.calls['juju.run_on_unit'], 6)
+
+    def test_units_are_looked_up_again_once_added(self):
+        units = juju_session.get_units(bench.APPLICATION_NAME)
+        session = juju_session.get_session()
+        self.assertIs(session.get_unit(units[0].entity_id), units[0])
+        unit_name = '{}/6'.format(bench.APPLICATION_NAME)
+        self.cloud.units[unit_name] = {'machine': '6', 'instance-id': 'new'}
+        self.assertEqual(session.get_unit(unit_name).entity_id, unit_name)
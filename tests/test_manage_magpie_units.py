@@ -0,0 +1,119 @@
+import contextlib
+import io
+import types
+import unittest
+
+from tests import helpers
+
+manage_magpie_units = helpers.load_script('manage-magpie-units')
+
+
+def make_unit(name):
+    return manage_magpie_units.Unit(
+        name,
+        types.SimpleNamespace(flavor={'vcpus': 2, 'ram': 4096}))
+
+
+class PlanMovesTest(unittest.TestCase):
+
+    def test_units_without_hypervisor_are_left_out(self):
+        placement = {
+            'compute-0': [make_unit('magpie/0'), make_unit('magpie/1')],
+            'compute-1': [],
+            None: [make_unit('magpie/2')]}
+        capacity = {
+            'compute-0': manage_magpie_units.Capacity(64, 65536),
+            'compute-1': manage_magpie_units.Capacity(64, 65536)}
+        moves = manage_magpie_units.plan_moves(placement, capacity)
+        self.assertEqual(
+            [(m.unit.unit_name, m.source, m.target) for m in moves],
+            [('magpie/1', 'compute-0', 'compute-1')])
+
+    def test_large_inventory(self):
+        # 60 crowded hypervisors with 40 units each and 240 with 2 or 3
+        placement = {}
+        capacity = {}
+        units = 0
+        for i in range(300):
+            count = 40 if i < 60 else 2 + i % 2
+            hypervisor = 'compute-{}'.format(i)
+            placement[hypervisor] = [
+                make_unit('magpie/{}'.format(units + j))
+                for j in range(count)]
+            units += count
+            # Room for exactly the units they are short of
+            capacity[hypervisor] = manage_magpie_units.Capacity(
+                128 - 2 * count,
+                4096 * max(10 - count, 0))
+        self.assertEqual(units, 3000)
+        moves = manage_magpie_units.plan_moves(placement, capacity)
+        counts = {h: len(u) for h, u in placement.items()}
+        moved = {h: manage_magpie_units.Capacity(0, 0) for h in placement}
+        for move in moves:
+            self.assertGreater(counts[move.source], 10)
+            self.assertLess(counts[move.target], 10)
+            moved[move.target] = manage_magpie_units.Capacity(
+                moved[move.target].vcpus + 2,
+                moved[move.target].ram + 4096)
+        final = dict(counts)
+        for move in moves:
+            final[move.source] -= 1
+            final[move.target] += 1
+        self.assertEqual(set(final.values()), {10})
+        self.assertEqual(len(moves), 60 * 30)
+        self.assertEqual(
+            len({m.unit.unit_name for m in moves}),
+            len(moves))
+        for hypervisor, used in moved.items():
+            self.assertLessEqual(used.vcpus, capacity[hypervisor].vcpus)
+            self.assertLessEqual(used.ram, capacity[hypervisor].ram)
+
+
+class PlacementIndexTest(helpers.FakeCloudTestCase):
+
+    def setUp(self):
+        super(PlacementIndexTest, self).setUp()
+        self.make_cloud('balance', 16, transition_delay=0)
+        self.instance_ids = {
+            unit_name: unit['instance-id']
+            for unit_name, unit in self.cloud.units.items()}
+
+    def hosts(self):
+        return {
+            unit_name: self.cloud.servers[i]['host'].split('.')[0]
+            for unit_name, i in self.instance_ids.items()
+            if i in self.cloud.servers}
+
+    def test_one_listing_per_refresh(self):
+        index = manage_magpie_units.PlacementIndex(self.nova, 'bench')
+        self.assertEqual(index.locations(), self.hosts())
+        self.assertEqual(self.cloud.calls['nova.servers.list'], 1)
+        moved = self.instance_ids['bench/3']
+        self.cloud.server_action(moved, 'stop')
+        self.cloud.server_action(moved, 'migrate', host='compute-1.maas')
+        self.cloud.server_action(self.instance_ids['bench/5'], 'delete')
+        self.assertEqual(
+            sorted(index.refresh()),
+            [('bench/3', 'compute-0', 'compute-1'),
+             ('bench/5', 'compute-0', None)])
+        self.assertEqual(index.refresh(), [])
+        self.assertEqual(self.cloud.calls['nova.servers.list'], 3)
+        self.assertEqual(self.cloud.calls['nova.servers.get'], 0)
+        placement = manage_magpie_units.get_placement(self.nova, 'bench')
+        self.assertEqual(
+            sorted(u.unit_name for u in placement['compute-1']),
+            ['bench/3'])
+
+
+class ParseArgsTest(unittest.TestCase):
+
+    def test_parallel_must_be_positive(self):
+        for option in ('--parallel', '--per-hypervisor'):
+            for value in ('0', '-1'):
+                with self.assertRaises(SystemExit), \
+                        contextlib.redirect_stderr(io.StringIO()):
+                    manage_magpie_units.parse_args(
+                        ['-a', 'magpie', option, value, 'balance'])
+        args = manage_magpie_units.parse_args(
+            ['-a', 'magpie', '--parallel', '3', 'balance'])
+        self.assertEqual(args.parallel, 3)
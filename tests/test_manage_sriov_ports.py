@@ -0,0 +1,211 @@
+import asyncio
+import concurrent.futures
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+import warnings
+from unittest import mock
+
+import novaclient.exceptions
+
+from tests import helpers
+
+import fake_cloud
+import undercloud_cache
+
+bench = helpers.load_script('run-scale-benchmarks')
+manage_sriov_ports = bench.manage_sriov_ports
+
+
+class RemoveBenchServersTest(helpers.FakeCloudTestCase):
+
+    def setUp(self):
+        super(RemoveBenchServersTest, self).setUp()
+        self.make_cloud('teardown', 4)
+        controller = next(iter(self.cloud.servers.values()))
+        for port in self.cloud.ports.values():
+            if port['name'] == '{}_port'.format(controller['name']):
+                port['name'] = '{}_port'.format(
+                    manage_sriov_ports.CONTROLLER_NAME)
+        controller['name'] = manage_sriov_ports.CONTROLLER_NAME
+        self.controller_id = controller['id']
+
+    def test_controller_is_kept(self):
+        results = manage_sriov_ports.cleanup(
+            self.nova,
+            self.neutron,
+            bench.NETWORK_NAME,
+            remove_servers=True)
+        self.assertEqual(results[manage_sriov_ports.FAILED], [])
+        self.assertEqual(list(self.cloud.servers), [self.controller_id])
+        self.assertEqual(
+            [p['name'] for p in self.cloud.ports.values()],
+            ['{}_port'.format(manage_sriov_ports.CONTROLLER_NAME)])
+        self.assertNotIn(
+            manage_sriov_ports.CONTROLLER_NAME,
+            results[manage_sriov_ports.SUCCEEDED])
+
+
+class NetplanTest(helpers.FakeCloudTestCase):
+
+    def test_script_compiles_without_warnings(self):
+        with open(manage_sriov_ports.__file__) as f:
+            source = f.read()
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            compile(source, manage_sriov_ports.__file__, 'exec')
+        self.assertIn('$IFACE\\$', manage_sriov_ports.NETPLAN_SCRIPT)
+
+    def test_unit_without_port_is_skipped(self):
+        self.make_cloud('add_port_to_netplan', 3)
+        self.cloud.ports.popitem()
+        results = manage_sriov_ports.add_port_to_netplan(
+            self.neutron,
+            bench.NETWORK_NAME,
+            bench.APPLICATION_NAME)
+        errors = {r.unit_name: r.error for r in results if r.error}
+        self.assertEqual(len(results), 3)
+        self.assertEqual(list(errors), ['bench/2'])
+
+
+class InventoryTest(helpers.FakeCloudTestCase):
+
+    def lookup_every_machine(self, units):
+        cloud = self.make_cloud('cleanup', units)
+        network = next(iter(cloud.networks.values()))
+        inventory = manage_sriov_ports.Inventory(
+            self.neutron,
+            network,
+            nova_client=self.nova)
+        for unit in cloud.units.values():
+            machine = fake_cloud.FakeMachine(
+                unit['machine'],
+                unit['instance-id'])
+            port = inventory.get_port(
+                manage_sriov_ports.get_port_name(network, machine))
+            server = inventory.get_server(unit['instance-id'])
+            self.assertTrue(inventory.is_port_attached(server, port['id']))
+        return dict(cloud.calls)
+
+    def test_calls_do_not_grow_with_machines(self):
+        calls = self.lookup_every_machine(10)
+        self.assertEqual(calls, {
+            'neutron.list_ports': 1,
+            'nova.servers.list': 1})
+        self.assertEqual(self.lookup_every_machine(200), calls)
+
+
+class AddMachinesTest(helpers.FakeCloudTestCase):
+
+    def test_unexpected_error_fails_only_its_host(self):
+        self.make_cloud('add_machines', 5)
+        added = []
+
+        async def add_machine(ip):
+            if ip.endswith('.4'):
+                raise ConnectionError('websocket closed')
+            if ip.endswith('.5'):
+                raise asyncio.TimeoutError()
+            added.append(ip)
+
+        with mock.patch.object(manage_sriov_ports, 'async_add_machine',
+                               add_machine):
+            report = manage_sriov_ports.add_machines(self.nova)
+        self.assertEqual(report['failed'], {
+            '10.9.0.4': 'websocket closed',
+            '10.9.0.5': 'TimeoutError'})
+        self.assertEqual(sorted(report['added']), sorted(added))
+        self.assertEqual(len(added), 3)
+
+
+class ConcurrencyTest(unittest.TestCase):
+
+    def test_one_failure_is_reported(self):
+        done = []
+
+        def _delete(port):
+            if port == 'port-2':
+                raise fake_cloud.FakeAPIError('Port port-2 is busy')
+            done.append(port)
+
+        with self.assertLogs(level='ERROR') as logs:
+            failed = manage_sriov_ports.run_concurrently(
+                _delete,
+                {'unit/{}'.format(i): 'port-{}'.format(i) for i in range(4)},
+                2,
+                'Deleting port')
+        self.assertEqual(failed, ['unit/2'])
+        self.assertEqual(sorted(done), ['port-0', 'port-1', 'port-3'])
+        self.assertIn('Deleting port unit/2 failed', logs.output[0])
+
+    def test_one_failed_wait_is_reported(self):
+        futures = {}
+        for i in range(3):
+            futures['unit/{}'.format(i)] = concurrent.futures.Future()
+            futures['unit/{}'.format(i)].set_result(None)
+        futures['unit/1'] = concurrent.futures.Future()
+        futures['unit/1'].set_exception(TimeoutError('Port still attached'))
+        with self.assertLogs(level='ERROR'):
+            failed = manage_sriov_ports.wait_for_all(futures, 'Detaching')
+        self.assertEqual(failed, ['unit/1'])
+
+
+class ParseArgsTest(unittest.TestCase):
+
+    def test_parallel_must_be_positive(self):
+        for option in ('--parallel', '--add-machine-parallel'):
+            for value in ('0', '-1'):
+                with self.assertRaises(SystemExit), \
+                        contextlib.redirect_stderr(io.StringIO()):
+                    manage_sriov_ports.parse_args([option, value, 'cleanup'])
+        args = manage_sriov_ports.parse_args(['--parallel', '3', 'cleanup'])
+        self.assertEqual(args.parallel, 3)
+
+
+class AddServersTest(helpers.FakeCloudTestCase):
+
+    def setUp(self):
+        super(AddServersTest, self).setUp()
+        self.make_cloud('create_ports', 0)
+        home = tempfile.TemporaryDirectory()
+        self.addCleanup(home.cleanup)
+        os.mkdir(os.path.join(home.name, '.ssh'))
+        with open(os.path.join(home.name, '.ssh', 'id_rsa.pub'), 'w') as f:
+            f.write('ssh-rsa AAAA bench\n')
+        patcher = mock.patch.object(manage_sriov_ports, 'Path')
+        patcher.start().home.return_value = home.name
+        self.addCleanup(patcher.stop)
+        self.keypairs = set()
+        self.nova.keypairs = mock.Mock()
+        self.nova.keypairs.findall.side_effect = (
+            lambda name: [name] if name in self.keypairs else [])
+        self.nova.keypairs.create.side_effect = (
+            lambda name, public_key: self.keypairs.add(name))
+        self.nova.glance = mock.Mock()
+        self.nova.flavors = mock.Mock()
+        self.nova.servers.create = self.create_server
+
+    def create_server(self, name, key_name, **kwargs):
+        if key_name not in self.keypairs:
+            raise novaclient.exceptions.BadRequest(
+                400,
+                'Invalid key_name provided.')
+        return mock.Mock(id=name)
+
+    def test_deleted_keypair_is_recreated(self):
+        # Cached as existing, but deleted since
+        undercloud_cache.get_cache().set('keypair/ps5benchmarking', True)
+        results = manage_sriov_ports.add_servers(
+            self.nova,
+            self.neutron,
+            bench.NETWORK_NAME,
+            6,
+            'm1.small',
+            'focal',
+            parallel=3)
+        self.assertEqual(results[manage_sriov_ports.FAILED], [])
+        self.assertEqual(len(results[manage_sriov_ports.SUCCEEDED]), 6)
+        self.assertEqual(self.keypairs, {'ps5benchmarking'})
+        self.assertEqual(self.nova.keypairs.create.call_count, 1)
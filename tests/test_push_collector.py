@@ -0,0 +1,144 @@
+import argparse
+import contextlib
+import gzip
+import io
+import json
+import os
+import struct
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from tests import helpers
+
+push_collector = helpers.load_script('push-collector')
+
+
+class PushCollectorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.store = push_collector.Store(self.tmp.name, 0.01)
+        self.addCleanup(self.store.close)
+        handler = type(
+            'Handler',
+            (push_collector.PushHandler,),
+            {'store': self.store})
+        self.server = push_collector.CollectorServer(
+            ('127.0.0.1', 0),
+            handler)
+        thread = threading.Thread(
+            target=self.server.serve_forever,
+            daemon=True)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+
+    def push(self, body):
+        request = urllib.request.Request(
+            self.url + '/metrics/job/fio/instance/woodpecker-0',
+            data=body,
+            headers={'Content-Encoding': 'gzip'},
+            method='PUT')
+        try:
+            with urllib.request.urlopen(request, timeout=5) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    def query_range(self, query):
+        now = time.time()
+        params = urllib.parse.urlencode(
+            {'query': query, 'start': now - 60, 'end': now + 60, 'step': 30})
+        with urllib.request.urlopen(
+                self.url + '/api/v1/query_range?' + params,
+                timeout=5) as response:
+            return json.load(response)
+
+    def test_bad_gzip(self):
+        self.assertEqual(self.push(b'not gzip'), 400)
+        self.assertEqual(
+            self.push(gzip.compress(b'fio_read_iops 1\n')[:-8]),
+            400)
+        self.assertEqual(self.push(gzip.compress(b'fio_read_iops 1\n')), 200)
+        result = self.query_range('fio_read_iops')['data']['result']
+        self.assertEqual(len(result), 1)
+        self.assertEqual(result[0]['metric']['job'], 'fio')
+
+    def test_query_before_push(self):
+        args = argparse.Namespace(
+            store=tempfile.mkdtemp(dir=self.tmp.name),
+            selector='fio_read_iops',
+            start=None,
+            end=None)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            push_collector.query(args)
+        self.assertEqual(output.getvalue(), '')
+        self.assertEqual(
+            push_collector.read_samples(args.store, [0, 1]),
+            {0: [], 1: []})
+
+
+class CountingStruct(struct.Struct):
+
+    unpacked = 0
+
+    def iter_unpack(self, buffer):
+        self.unpacked += len(buffer) // self.size
+        return super().iter_unpack(buffer)
+
+
+class StoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def write(self, *batches):
+        store = push_collector.Store(self.tmp.name, 0.01)
+        for batch in batches:
+            store.add([
+                push_collector.Sample(metric, {}, timestamp, value)
+                for metric, timestamp, value in batch])
+            store.flush()
+        store.close()
+
+    def test_torn_writes_are_dropped(self):
+        self.write([('fio_read_iops', 10, 1.0)])
+        with open(os.path.join(self.tmp.name, 'series.jsonl'), 'a') as f:
+            f.write('{"id": 1, "metric": "fio_wr')
+        with open(os.path.join(self.tmp.name, 'samples.bin'), 'ab') as f:
+            f.write(push_collector.RECORD.pack(1, 20, 2.0)[:-3])
+        with self.assertLogs(level='WARNING'):
+            self.write([('fio_write_iops', 30, 3.0)])
+        series = push_collector.load_series(self.tmp.name)
+        self.assertEqual(
+            {i: s['metric'] for i, s in series.items()},
+            {0: 'fio_read_iops', 1: 'fio_write_iops'})
+        self.assertEqual(
+            push_collector.read_samples(self.tmp.name, [0, 1]),
+            {0: [(10, 1.0)], 1: [(30, 3.0)]})
+
+    def test_query_skips_other_times(self):
+        self.write(
+            [('fio_read_iops', t, 1.0) for t in range(100)],
+            [('fio_read_iops', t, 2.0) for t in range(100, 110)])
+        # Written without the index, as by an older collector
+        with open(os.path.join(self.tmp.name, 'samples.bin'), 'ab') as f:
+            f.write(push_collector.RECORD.pack(0, 110, 3.0))
+        counting = CountingStruct(push_collector.RECORD.format)
+        with unittest.mock.patch.object(push_collector, 'RECORD', counting):
+            samples = push_collector.read_samples(self.tmp.name, [0], 105)
+        self.assertEqual(
+            samples[0],
+            [(t, 2.0) for t in range(105, 110)] + [(110, 3.0)])
+        self.assertEqual(counting.unpacked, 11)
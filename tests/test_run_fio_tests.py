@@ -0,0 +1,73 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from tests import helpers
+
+run_fio_tests = helpers.load_script('run-fio-tests')
+
+
+class SweepTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.state_file = os.path.join(self.tmpdir.name, 'state.json')
+
+    def sweep(self, units):
+        return run_fio_tests.sweep(
+            units,
+            ['4k'],
+            ['read', 'write'],
+            1,
+            10,
+            0,
+            state_file=self.state_file)
+
+    def test_no_units(self):
+        self.assertEqual(self.sweep([]), {})
+        self.assertFalse(os.path.exists(self.state_file))
+
+    def test_empty_results(self):
+        with mock.patch.object(run_fio_tests, 'run_combination',
+                               return_value=[]), \
+                self.assertLogs(level='ERROR'):
+            self.assertEqual(
+                self.sweep(['woodpecker/0']),
+                {'4k/read': ['woodpecker/0'], '4k/write': ['woodpecker/0']})
+        self.assertFalse(os.path.exists(self.state_file))
+
+    def test_completed_combinations_skipped(self):
+        run_fio_tests.save_state(
+            self.state_file,
+            {'parameters': run_fio_tests.parameters_hash(['woodpecker/0'], 1),
+             'completed': {'4k/read': {}, '4k/write': {}}})
+        with mock.patch.object(run_fio_tests,
+                               'run_combination') as run_combination:
+            self.assertEqual(self.sweep(['woodpecker/0']), {})
+        run_combination.assert_not_called()
+
+    def test_state_of_other_parameters_ignored(self):
+        results = [
+            run_fio_tests.UnitResult(u, 'completed', 1)
+            for u in ('woodpecker/0', 'woodpecker/1')]
+        with mock.patch.object(run_fio_tests, 'run_combination',
+                               return_value=results[:1]):
+            self.assertEqual(self.sweep(['woodpecker/0']), {})
+        with mock.patch.object(run_fio_tests, 'run_combination',
+                               return_value=results) as run_combination, \
+                self.assertLogs(level='WARNING'):
+            self.assertEqual(
+                self.sweep(['woodpecker/0', 'woodpecker/1']),
+                {})
+        self.assertEqual(run_combination.call_count, 2)
+        with open(self.state_file) as f:
+            state = json.load(f)
+        self.assertEqual(
+            state['parameters'],
+            run_fio_tests.parameters_hash(
+                ['woodpecker/0', 'woodpecker/1'],
+                1))
+        self.assertEqual(sorted(state['completed']), ['4k/read', '4k/write'])
@@ -0,0 +1,39 @@
+import unittest
+
+from tests import helpers
+
+run_iperf_tests = helpers.load_script('run-iperf-tests')
+
+
+class HypervisorTest(unittest.TestCase):
+
+    hypervisors = {
+        'magpie/0': 'compute-0',
+        'magpie/1': 'compute-0',
+        'magpie/2': 'compute-1',
+        'magpie/3': None,
+    }
+
+    def test_cross_hypervisor_only(self):
+        rounds = run_iperf_tests.mesh_rounds(
+            ['magpie/{}'.format(i) for i in range(5)])
+        with self.assertLogs(level='WARNING') as logs:
+            rounds = run_iperf_tests.cross_hypervisor_only(
+                rounds,
+                self.hypervisors)
+        self.assertEqual(
+            sorted(sorted(pair) for pairs in rounds for pair in pairs),
+            [['magpie/0', 'magpie/2'], ['magpie/1', 'magpie/2']])
+        self.assertIn('magpie/3, magpie/4', logs.output[0])
+
+    def test_summarise_unplaced(self):
+        results = [
+            run_iperf_tests.PairResult(s, t, 'completed', 1, 1e9)
+            for s, t in (('magpie/0', 'magpie/2'),
+                         ('magpie/3', 'magpie/4'))]
+        with self.assertLogs(level='INFO') as logs:
+            run_iperf_tests.summarise(results, self.hypervisors)
+        output = '\n'.join(logs.output)
+        self.assertIn('compute-0', output)
+        self.assertIn('compute-1', output)
+        self.assertIn('Hypervisor not known for magpie/3, magpie/4', output)
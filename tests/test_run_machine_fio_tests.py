@@ -0,0 +1,103 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from tests import helpers
+
+run_machine_fio_tests = helpers.load_file(
+    'machine-fio-testing/run-machine-fio-tests.py')
+
+
+class GetDisksTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.sysfs = self.tmp.name
+        devices = 'devices/pci0000:00'
+        for disk, partition in (('sdb', 'sdb1'), ('nvme0n1', 'nvme0n1p1'),
+                                ('sdc', None)):
+            path = os.path.join(devices, 'block', disk)
+            self.link(os.path.join('class/block', disk), path)
+            self.link(os.path.join('block', disk), path)
+            if partition:
+                path = os.path.join(path, partition)
+                self.link(os.path.join('class/block', partition), path)
+                self.write(os.path.join(path, 'partition'), '1')
+        # bcache0 is backed by sdb1 and cached on nvme0n1p1
+        path = 'devices/virtual/block/bcache0'
+        self.link('class/block/bcache0', path)
+        self.link('block/bcache0', path)
+        self.write(os.path.join(path, 'slaves/sdb1'), '')
+        cache_set = 'fs/bcache/0f3f7b0e'
+        self.write(os.path.join(
+            devices, 'block/nvme0n1/nvme0n1p1/bcache/state'), 'clean')
+        self.link(
+            os.path.join(cache_set, 'cache0'),
+            os.path.join(devices, 'block/nvme0n1/nvme0n1p1/bcache'))
+        self.link(os.path.join(path, 'bcache/cache'), cache_set)
+
+    def path(self, path):
+        return os.path.join(self.sysfs, path)
+
+    def write(self, path, value):
+        os.makedirs(os.path.dirname(self.path(path)), exist_ok=True)
+        with open(self.path(path), 'w') as fp:
+            fp.write(value)
+
+    def link(self, path, target):
+        os.makedirs(os.path.dirname(self.path(path)), exist_ok=True)
+        os.makedirs(self.path(target), exist_ok=True)
+        os.symlink(self.path(target), self.path(path))
+
+    def test_bcache_device(self):
+        self.assertEqual(
+            run_machine_fio_tests.get_disks('/dev/bcache0', self.sysfs),
+            {'bcache0', 'sdb', 'nvme0n1'})
+
+    def test_plain_disk(self):
+        self.assertEqual(
+            run_machine_fio_tests.get_disks('/dev/sdc', self.sysfs),
+            {'sdc'})
+
+
+class ScheduleTest(unittest.TestCase):
+
+    def make_job(self, name, disks):
+        return run_machine_fio_tests.Job(
+            run_machine_fio_tests.Section(name, '/dev/' + name),
+            run_machine_fio_tests.WORKLOADS[0],
+            frozenset(disks))
+
+    def test_shared_disks_never_run_together(self):
+        jobs = [
+            self.make_job('bcache0', {'bcache0', 'sdb', 'nvme0n1'}),
+            self.make_job('bcache1', {'bcache1', 'sdc', 'nvme0n1'}),
+            self.make_job('hdd', {'sdb'}),
+            self.make_job('ssd', {'sdd'}),
+            self.make_job('optane', {'nvme1n1'}),
+        ] * 3
+        lock = threading.Lock()
+        busy = []
+        overlaps = []
+        concurrency = []
+
+        def run(job):
+            with lock:
+                for disks in busy:
+                    if disks & job.disks:
+                        overlaps.append((disks, job.disks))
+                busy.append(job.disks)
+                concurrency.append(len(busy))
+            time.sleep(0.01)
+            with lock:
+                busy.remove(job.disks)
+            return {'returncode': 0}
+
+        records = run_machine_fio_tests.schedule(jobs, run, 4)
+        self.assertEqual(overlaps, [])
+        self.assertEqual(len(records), len(jobs))
+        self.assertGreater(max(concurrency), 1)
+        self.assertLessEqual(max(concurrency), 4)
@@ -0,0 +1,59 @@
+import unittest
+
+from tests import helpers
+
+bench = helpers.load_script('run-scale-benchmarks')
+
+
+def make_result(wall_time=1.0, calls=100, peak_memory=2 ** 24):
+    return bench.Result(
+        'cleanup',
+        100,
+        wall_time,
+        {'nova.servers.list': calls},
+        peak_memory,
+        0)
+
+
+class FindRegressionsTest(unittest.TestCase):
+
+    def test_increase_over_threshold(self):
+        regressions = bench.find_regressions(
+            [make_result(wall_time=1.5, calls=130, peak_memory=2 ** 25)],
+            [make_result()],
+            20)
+        self.assertEqual(len(regressions), 3)
+        self.assertIn('wall time up 50%', regressions[0])
+        self.assertIn('API calls up 30%', regressions[1])
+        self.assertIn('peak memory up 100%', regressions[2])
+
+    def test_noise_ignored(self):
+        self.assertEqual(bench.find_regressions(
+            [make_result(wall_time=1.1, calls=110, peak_memory=2 ** 24 * 1.1)],
+            [make_result()],
+            20), [])
+        # Large relative changes of tiny measurements are noise too
+        self.assertEqual(bench.find_regressions(
+            [bench.Result('cleanup', 100, 0.05, {}, 2 ** 19, 0)],
+            [bench.Result('cleanup', 100, 0.01, {}, 2 ** 16, 0)],
+            20), [])
+
+    def test_new_scenario_not_compared(self):
+        self.assertEqual(bench.find_regressions(
+            [make_result(wall_time=10)],
+            [bench.Result('balance', 100, 1.0, {}, 2 ** 24, 0)],
+            20), [])
+
+
+class ScenarioTest(unittest.TestCase):
+
+    def test_scenarios_succeed(self):
+        for name in bench.SCENARIOS:
+            with self.subTest(scenario=name):
+                result = bench.run_scenario(
+                    name,
+                    6,
+                    4,
+                    helpers.POLL_INTERVAL)
+                self.assertEqual(result.failed, 0)
+                self.assertTrue(result.calls)
@@ -0,0 +1,64 @@
+import math
+import os
+import tempfile
+import unittest
+
+from tests import helpers
+
+sample_bcache = helpers.load_file('machine-fio-testing/sample-bcache')
+
+BCACHE = 'sys/block/bcache0/bcache'
+
+
+class SamplerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.root = self.tmp.name
+        self.set_counters(hits=100, misses=100)
+        self.write(os.path.join(BCACHE, 'dirty_data'), '1.5G')
+        # Enough devices for /proc/diskstats to be larger than one read
+        lines = [
+            '   8 {:>6} sd{} 1 2 3 4 5 6 7 8 9 10 11 0 0 0 0 0 0'.format(
+                i, i)
+            for i in range(2000)]
+        self.write('proc/diskstats', '\n'.join(lines) + '\n')
+        self.assertGreater(
+            os.path.getsize(os.path.join(self.root, 'proc/diskstats')),
+            65536)
+
+    def write(self, path, value):
+        path = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as fp:
+            fp.write(value)
+
+    def set_counters(self, hits, misses):
+        self.write(os.path.join(BCACHE, 'stats_total/cache_hits'),
+                   str(hits))
+        self.write(os.path.join(BCACHE, 'stats_total/cache_misses'),
+                   str(misses))
+
+    def sampler(self):
+        sampler = sample_bcache.Sampler(self.root, r'^sd')
+        self.addCleanup(sampler.close)
+        return sampler
+
+    def test_all_diskstats_devices(self):
+        sampler = self.sampler()
+        self.assertEqual(len(sampler.disks), 2000)
+        values = dict(zip(sampler.series, sampler.sample()))
+        self.assertEqual(values['sd1999.weighted_io_ms'], 11)
+        self.assertEqual(values['bcache0.dirty_data'], 1.5 * 2 ** 30)
+
+    def test_hit_ratio(self):
+        sampler = self.sampler()
+        ratios = []
+        for hits, misses in ((100, 100), (130, 110), (130, 110)):
+            self.set_counters(hits, misses)
+            values = dict(zip(sampler.series, sampler.sample()))
+            ratios.append(values['bcache0.cache_hit_ratio'])
+        self.assertTrue(math.isnan(ratios[0]))
+        self.assertEqual(ratios[1], 0.75)
+        self.assertTrue(math.isnan(ratios[2]))
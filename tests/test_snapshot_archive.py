@@ -0,0 +1,57 @@
+import os
+import tempfile
+import unittest
+
+from tests import helpers
+
+snapshot_archive = helpers.load_file(
+    'grafana/snapshot-management/snapshot_archive.py')
+
+
+def make_snapshot(key, start, values):
+    return {
+        'meta': {'type': 'snapshot', 'isSnapshot': True},
+        'dashboard': {
+            'id': None,
+            'uid': 'uid-{}'.format(key),
+            'version': 3,
+            'title': 'Woodpecker',
+            'time': {'from': start, 'to': start + 60000},
+            'snapshot': {'timestamp': '2026-10-17T10:00:00Z'},
+            'panels': [{
+                'id': 1,
+                'title': 'IOPS',
+                'snapshotData': [{
+                    'target': 'fio_read_iops',
+                    'datapoints': [
+                        [value, start + 1000 * i]
+                        for i, value in enumerate(values)]}]}]}}
+
+
+class SnapshotArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.archive = snapshot_archive.SnapshotArchive(
+            self.tmp.name,
+            compression='gzip')
+
+    def test_same_dashboard_stored_once(self):
+        snapshots = {
+            'run1': make_snapshot('run1', 1760000000000, [1, 2, None, 4]),
+            'run2': make_snapshot('run2', 1760090000000, [5.5, 6.5]),
+        }
+        for key, payload in snapshots.items():
+            self.archive.add(key, payload)
+        self.assertEqual(
+            len(os.listdir(os.path.join(self.tmp.name, 'dashboards'))),
+            1)
+        for key, payload in snapshots.items():
+            self.assertEqual(self.archive.extract(key), payload)
+
+    def test_large_integers_kept_exactly(self):
+        payload = make_snapshot(
+            'big', 1760000000000, [2 ** 53 + 1, -2 ** 60, 3])
+        self.archive.add('big', payload)
+        self.assertEqual(self.archive.extract('big'), payload)
@@ -0,0 +1,125 @@
+import json
+import math
+import unittest
+
+from tests import helpers
+
+snapshot_compare = helpers.load_file(
+    'grafana/snapshot-management/snapshot_compare.py')
+
+
+def make_series(name, times, values):
+    return snapshot_compare.Series(
+        name,
+        [],
+        snapshot_compare.np.asarray(times, dtype=float),
+        snapshot_compare.np.asarray(
+            [math.nan if v is None else v for v in values],
+            dtype=float))
+
+
+class ExtractSeriesTest(unittest.TestCase):
+
+    def test_legacy_and_frames(self):
+        dashboard = {
+            'panels': [
+                {'id': 1, 'title': 'IOPS',
+                 'targets': [{'refId': 'A',
+                              'expr': 'sum(rate(fio_iops[1m]))'}],
+                 'snapshotData': [{
+                     'refId': 'A',
+                     'target': 'read',
+                     'datapoints': [
+                         [30, 12000], [10, 10000], [None, 11000]]}]},
+                {'id': 2, 'title': 'Latency', 'snapshotData': [{
+                    'refId': 'B',
+                    'fields': [
+                        {'name': 'Time', 'type': 'time',
+                         'values': [14000, 16000]},
+                        {'name': 'Value', 'type': 'number',
+                         'labels': {'unit': 'woodpecker/0'},
+                         'config': {'displayName': 'clat'},
+                         'values': [1.5, 2.5]},
+                        {'name': 'Value', 'type': 'number',
+                         'labels': {'unit': 'woodpecker/1'},
+                         'values': [3.5, None]}]}]}]}
+        series = {s.name: s
+                  for s in snapshot_compare.extract_series(dashboard)}
+        self.assertEqual(sorted(series), [
+            'IOPS/read',
+            'Latency/Value{unit=woodpecker/1}',
+            'Latency/clat{unit=woodpecker/0}'])
+        read = series['IOPS/read']
+        self.assertEqual(read.metrics, ['fio_iops'])
+        # Sorted by time, relative to the earliest sample of the snapshot
+        self.assertEqual(list(read.times), [0, 1, 2])
+        self.assertEqual(read.values[0], 10)
+        self.assertTrue(math.isnan(read.values[1]))
+        clat = series['Latency/clat{unit=woodpecker/0}']
+        self.assertEqual(list(clat.times), [4, 6])
+        self.assertEqual(list(clat.values), [1.5, 2.5])
+
+
+class AlignedChangeTest(unittest.TestCase):
+
+    def test_interpolated(self):
+        # The candidate is only sampled in between the baseline samples
+        baseline = make_series('iops', [1, 3, 5, 7, 9], [100] * 5)
+        candidate = make_series(
+            'iops', [0, 2, 4, 6, 8, 10],
+            [100 + 2 * t for t in (0, 2, 4, 6, 8, 10)])
+        self.assertAlmostEqual(
+            snapshot_compare.aligned_change(baseline, candidate),
+            10)
+
+    def test_gaps_are_interpolated_over(self):
+        baseline = make_series('iops', [0, 1, 2, 3], [100, None, 100, 100])
+        candidate = make_series('iops', [0, 1, 2, 3], [90, 90, None, 90])
+        self.assertAlmostEqual(
+            snapshot_compare.aligned_change(baseline, candidate),
+            -10)
+
+    def test_no_overlap(self):
+        baseline = make_series('iops', [0, 1], [100, 100])
+        candidate = make_series('iops', [2, 3], [100, 100])
+        self.assertTrue(math.isnan(
+            snapshot_compare.aligned_change(baseline, candidate)))
+
+
+class CompareTest(unittest.TestCase):
+
+    def compare(self, name, base, cand):
+        times = list(range(20))
+        results = snapshot_compare.compare(
+            [make_series(name, times, [base] * 20)],
+            [make_series(name, times, [cand] * 20)],
+            threshold=5)
+        self.assertEqual(len(results), 1)
+        return results[0]
+
+    def test_verdicts(self):
+        self.assertEqual(
+            self.compare('fio/clat latency', 10, 12)['verdict'],
+            'REGRESSION')
+        self.assertEqual(
+            self.compare('fio/clat latency', 10, 8)['verdict'],
+            'better')
+        self.assertEqual(
+            self.compare('fio/read iops', 100, 80)['verdict'],
+            'REGRESSION')
+        self.assertEqual(
+            self.compare('fio/read iops', 100, 120)['verdict'],
+            'better')
+        self.assertEqual(
+            self.compare('fio/read iops', 100, 103)['verdict'],
+            'same')
+
+    def test_zero_baseline_is_valid_json(self):
+        result = self.compare('fio/errors', 0, 0)
+        self.assertEqual(result['verdict'], 'same')
+        self.assertTrue(math.isnan(result['change']))
+        text = json.dumps(
+            snapshot_compare.json_results([result]),
+            allow_nan=False)
+        self.assertIsNone(json.loads(text)[0]['change'])
+        self.assertIsNone(json.loads(text)[0]['aligned_change'])
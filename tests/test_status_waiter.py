@@ -0,0 +1,90 @@
+import unittest
+from unittest import mock
+
+from tests import helpers
+
+import status_waiter
+
+
+class FakeWaiter(status_waiter.StatusWaiter):
+
+    def __init__(self, statuses, **kwargs):
+        super(FakeWaiter, self).__init__(
+            min_interval=0.001,
+            max_interval=0.01,
+            **kwargs)
+        self.statuses = statuses
+
+    def fetch(self, resource_ids):
+        return {i: self.statuses.get(i, 'deleted') for i in resource_ids}
+
+
+class StatusWaiterTest(unittest.TestCase):
+
+    def test_expected_status(self):
+        waiter = FakeWaiter({'a': 'active'})
+        waiter.wait('a', 'active', timeout=5)
+        self.assertEqual(len(waiter.timings), 1)
+
+    def test_expected_deleted(self):
+        waiter = FakeWaiter({})
+        waiter.wait('a', 'deleted', timeout=5)
+
+    def test_deleted_fails_other_expectations(self):
+        waiter = FakeWaiter({})
+        future = waiter.expect('a', 'active', timeout=60)
+        with self.assertRaises(RuntimeError):
+            future.result(timeout=5)
+
+    def test_error_fails(self):
+        waiter = FakeWaiter({'a': 'error'})
+        with self.assertRaises(RuntimeError):
+            waiter.wait('a', 'active', timeout=60)
+
+
+    def test_fetch_is_abstract(self):
+        with self.assertRaises(TypeError):
+            status_waiter.StatusWaiter()
+
+
+class ServerWaiterTest(helpers.FakeCloudTestCase):
+
+    def setUp(self):
+        super(ServerWaiterTest, self).setUp()
+        self.make_cloud('balance', 200, transition_delay=0.01)
+        self.list = mock.patch.object(
+            self.nova.servers,
+            'list',
+            wraps=self.nova.servers.list).start()
+        self.addCleanup(mock.patch.stopall)
+        self.waiter = status_waiter.ServerWaiter(self.nova)
+
+    def listed_all(self):
+        return [c for c in self.list.call_args_list
+                if 'changes-since' not in (c[1].get('search_opts') or {})]
+
+    def test_polls_only_changed_servers(self):
+        server_ids = list(self.cloud.servers)
+        for server_id in server_ids[:3]:
+            self.cloud.server_action(server_id, 'stop')
+            self.waiter.wait(server_id, 'stopped', timeout=5)
+        for server_id in server_ids[:3]:
+            self.cloud.server_action(server_id, 'start')
+        for server_id in server_ids[:3]:
+            self.waiter.wait(server_id, 'active', timeout=5)
+        self.assertEqual(self.listed_all(), [])
+        self.assertLessEqual(self.cloud.calls['nova.servers.get'], 1)
+
+    def test_many_new_servers_listed_once(self):
+        server_ids = list(self.cloud.servers)[:50]
+        futures = [self.waiter.expect(i, 'active', timeout=5)
+                   for i in server_ids]
+        for future in futures:
+            future.result(timeout=5)
+        self.assertEqual(len(self.listed_all()), 1)
+        self.assertEqual(self.cloud.calls['nova.servers.get'], 0)
+
+    def test_missing_server_is_deleted(self):
+        with self.assertRaises(RuntimeError):
+            self.waiter.wait('no-such-server', 'active', timeout=5)
+        self.waiter.wait('no-such-server', 'deleted', timeout=5)
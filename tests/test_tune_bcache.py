@@ -0,0 +1,128 @@
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from tests import helpers
+
+tune_bcache = helpers.load_file('machine-fio-testing/tune-bcache')
+
+# Values as bcache reports them
+ORIGINAL = {
+    'sys/fs/bcache/uuid0/congested_read_threshold_us': '2000',
+    'sys/fs/bcache/uuid0/congested_write_threshold_us': '20000',
+    'sys/block/bcache0/bcache/sequential_cutoff': '4.0M',
+    'sys/block/bcache0/bcache/writeback_percent': '10',
+    'sys/block/bcache0/bcache/cache_mode':
+        '[writethrough] writeback writearound none',
+    'sys/block/bcache0/queue/read_ahead_kb': '128',
+}
+
+# Values as they are written back
+RESTORED = dict(ORIGINAL, **{
+    'sys/block/bcache0/bcache/sequential_cutoff': '4194304',
+    'sys/block/bcache0/bcache/cache_mode': 'writethrough',
+})
+
+
+class SweepTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.root = self.tmp.name
+        for path, value in ORIGINAL.items():
+            self.write(path, value)
+        self.applied = []
+
+    def write(self, path, value):
+        path = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as fp:
+            fp.write(value)
+
+    def read(self, path):
+        with open(os.path.join(self.root, path)) as fp:
+            return fp.read()
+
+    def current(self):
+        return {path: self.read(path) for path in ORIGINAL}
+
+    def fake_probe(self, device, workload, runtime):
+        """Score the settings applied to the fake sysfs tree."""
+        self.applied.append(self.current())
+        score = 100.0
+        if self.read('sys/block/bcache0/bcache/cache_mode') == 'writeback':
+            score += 50
+        if self.read('sys/block/bcache0/queue/read_ahead_kb') == '2048':
+            score += 10 if workload.startswith('read') else -10
+        return score
+
+    def sweep(self, grid, adaptive=False, probe=None):
+        args = argparse.Namespace(
+            root=self.root,
+            grid=grid,
+            workloads=['randread:4k', 'read:128k'],
+            device='/dev/bcache0',
+            runtime=1,
+            adaptive=adaptive,
+            results=os.path.join(self.root, 'results.json'))
+        output = io.StringIO()
+        with mock.patch.object(tune_bcache, 'fio_probe',
+                               probe or self.fake_probe), \
+                contextlib.redirect_stdout(output):
+            tune_bcache.sweep(args)
+        return output.getvalue()
+
+    def test_grid_is_applied(self):
+        self.sweep(['cache_mode=writethrough,writeback',
+                    'read_ahead_kb=128,2048'])
+        combinations = {
+            (a['sys/block/bcache0/bcache/cache_mode'],
+             a['sys/block/bcache0/queue/read_ahead_kb'])
+            for a in self.applied}
+        self.assertEqual(combinations, {
+            ('writethrough', '128'), ('writethrough', '2048'),
+            ('writeback', '128'), ('writeback', '2048')})
+        self.assertEqual(len(self.applied), 8)
+
+    def test_best_combination_is_chosen(self):
+        for adaptive in (False, True):
+            output = self.sweep(['cache_mode=writethrough,writeback',
+                                 'read_ahead_kb=128,2048'],
+                                adaptive=adaptive)
+            self.assertIn(
+                'Best for randread:4k: {"cache_mode": "writeback", '
+                '"read_ahead_kb": "128"} (150 IOPS)', output)
+            self.assertIn(
+                'Best for read:128k: {"cache_mode": "writeback", '
+                '"read_ahead_kb": "2048"} (160 IOPS)', output)
+
+    def test_originals_are_restored(self):
+        self.sweep(['cache_mode=writeback', 'sequential_cutoff=0'])
+        self.assertEqual(self.current(), RESTORED)
+
+    def test_originals_are_restored_when_probe_raises(self):
+        def failing_probe(device, workload, runtime):
+            if self.applied:
+                raise RuntimeError('fio failed')
+            return self.fake_probe(device, workload, runtime)
+
+        with self.assertRaises(RuntimeError):
+            self.sweep(['cache_mode=writethrough,writeback',
+                        'sequential_cutoff=0'],
+                       probe=failing_probe)
+        self.assertEqual(self.current(), RESTORED)
+
+    def test_default_grid(self):
+        self.sweep([], adaptive=True)
+        tried = {
+            os.path.basename(path)
+            for applied in self.applied
+            for path, value in applied.items()
+            if value != RESTORED[path] and value != ORIGINAL[path]}
+        self.assertEqual(tried, set(tune_bcache.DEFAULT_GRID))
+        self.assertEqual(self.current(), RESTORED)
@@ -0,0 +1,350 @@
+"""Time the steps of the manage-* scripts with named spans.
+
+API calls, subprocesses and waits are wrapped in spans tagged with the
+unit, server and action they belong to. Tags of enclosing spans are
+inherited, so a span opened for a unit tags every call made for it. When
+tracing is enabled the spans can be exported as a Chrome trace, viewable in
+chrome://tracing or Perfetto, and are summarised per span name at exit.
+Until enable() is called span() returns a shared no-op context manager and
+clients are not wrapped, so instrumentation costs next to nothing.
+"""
+
+import asyncio
+import atexit
+import collections
+import contextvars
+import functools
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+
+Span = collections.namedtuple(
+    'Span',
+    ['name', 'start', 'duration', 'track', 'tags', 'error'])
+
+PhaseSummary = collections.namedtuple(
+    'PhaseSummary',
+    ['name', 'count', 'total', 'p50', 'p95', 'max', 'errors'])
+
+_tracer = None
+_tags = contextvars.ContextVar('tracing_tags', default={})
+
+
+class _NullSpan(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _SpanContext(object):
+
+    def __init__(self, tracer, name, tags):
+        self.tracer = tracer
+        self.name = name
+        self.tags = tags
+
+    def __enter__(self):
+        self.token = _tags.set(dict(_tags.get(), **self.tags))
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        tags = _tags.get()
+        _tags.reset(self.token)
+        self.tracer.record(
+            self.name,
+            self.start,
+            duration,
+            tags,
+            exc_type.__name__ if exc_type else None)
+        return False
+
+
+class Tracer(object):
+    """Collect finished spans."""
+
+    def __init__(self, tags=None):
+        """Create tracer.
+
+        :param tags: Tags added to every span, eg the action being run
+        :type tags: Union[Dict[str, str], None]
+        """
+        self.tags = tags or {}
+        self.lock = threading.Lock()
+        self.spans = []
+        self.tracks = {}
+        self.origin = time.perf_counter()
+
+    def _track(self):
+        thread = threading.current_thread()
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        if task is None:
+            return thread.name
+        return '{} {}'.format(thread.name, task.get_name())
+
+    def record(self, name, start, duration, tags, error=None):
+        """Record a finished span.
+
+        :param name: Name of span
+        :type name: str
+        :param start: time.perf_counter() when the span started
+        :type start: float
+        :param duration: Seconds span lasted
+        :type duration: float
+        :param tags: Tags of span
+        :type tags: Dict[str, str]
+        :param error: Name of exception raised in span
+        :type error: Union[str, None]
+        """
+        span = Span(
+            name,
+            start - self.origin,
+            duration,
+            self._track(),
+            dict(self.tags, **tags),
+            error)
+        with self.lock:
+            self.spans.append(span)
+
+    def summarise(self):
+        """Return count, total and percentiles of span durations by name.
+
+        :returns: Summary of each span name, longest total first
+        :rtype: List[PhaseSummary]
+        """
+        durations = collections.defaultdict(list)
+        errors = collections.Counter()
+        with self.lock:
+            spans = list(self.spans)
+        for span in spans:
+            durations[span.name].append(span.duration)
+            if span.error:
+                errors[span.name] += 1
+        summaries = []
+        for name, values in durations.items():
+            values.sort()
+            summaries.append(PhaseSummary(
+                name,
+                len(values),
+                sum(values),
+                _percentile(values, 50),
+                _percentile(values, 95),
+                values[-1],
+                errors[name]))
+        return sorted(summaries, key=lambda s: s.total, reverse=True)
+
+    def log_summary(self):
+        """Log the per span name summary."""
+        summaries = self.summarise()
+        if not summaries:
+            return
+        width = max(len(s.name) for s in summaries)
+        logging.info("{:<{w}} {:>6} {:>9} {:>8} {:>8} {:>8} {:>6}".format(
+            'span', 'count', 'total', 'p50', 'p95', 'max', 'errors',
+            w=width))
+        for s in summaries:
+            logging.info(
+                "{:<{w}} {:>6} {:>8.2f}s {:>7.3f}s {:>7.3f}s {:>7.3f}s "
+                "{:>6}".format(
+                    s.name, s.count, s.total, s.p50, s.p95, s.max, s.errors,
+                    w=width))
+
+    def chrome_trace(self):
+        """Return the spans in Chrome trace event format.
+
+        :returns: Trace
+        :rtype: Dict
+        """
+        pid = os.getpid()
+        with self.lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        tids = {}
+        events = []
+        for span in spans:
+            if span.track not in tids:
+                tids[span.track] = len(tids) + 1
+                events.append({
+                    'name': 'thread_name',
+                    'ph': 'M',
+                    'pid': pid,
+                    'tid': tids[span.track],
+                    'args': {'name': span.track}})
+            args = dict(span.tags)
+            if span.error:
+                args['error'] = span.error
+            events.append({
+                'name': span.name,
+                'cat': span.name.split('.')[0],
+                'ph': 'X',
+                'ts': round(span.start * 1e6),
+                'dur': round(span.duration * 1e6),
+                'pid': pid,
+                'tid': tids[span.track],
+                'args': args})
+        return {
+            'traceEvents': events,
+            'displayTimeUnit': 'ms',
+            'otherData': self.tags}
+
+    def export(self, trace_file):
+        """Write the spans to a Chrome trace file.
+
+        :param trace_file: File to write
+        :type trace_file: str
+        """
+        with open(trace_file, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+        logging.info("Wrote {} spans to {}".format(
+            len(self.spans),
+            trace_file))
+
+
+def _percentile(values, pct):
+    rank = max(int(math.ceil(pct / 100.0 * len(values))), 1)
+    return values[rank - 1]
+
+
+def enable(trace_file=None, **tags):
+    """Start recording spans, they are summarised and exported at exit.
+
+    :param trace_file: Chrome trace file to write at exit
+    :type trace_file: Union[str, None]
+    :param tags: Tags added to every span, eg the action being run
+    :type tags: Dict[str, str]
+    :returns: Tracer
+    :rtype: Tracer
+    """
+    global _tracer
+    _tracer = Tracer(tags)
+    atexit.register(finish, _tracer, trace_file)
+    return _tracer
+
+
+def finish(tracer, trace_file=None):
+    """Log the summary of tracer and export it.
+
+    :param tracer: Tracer
+    :type tracer: Tracer
+    :param trace_file: Chrome trace file to write
+    :type trace_file: Union[str, None]
+    """
+    tracer.log_summary()
+    if trace_file:
+        tracer.export(trace_file)
+
+
+def get_tracer():
+    """Return the current tracer, None when tracing is disabled."""
+    return _tracer
+
+
+def span(name, **tags):
+    """Return a context manager timing the code run in it.
+
+    :param name: Name of span, the text before the first '.' is used as its
+                 category
+    :type name: str
+    :param tags: Tags of span, eg unit, server or port
+    :type tags: Dict[str, str]
+    :returns: Context manager
+    :rtype: ContextManager
+    """
+    if _tracer is None:
+        return _NULL_SPAN
+    return _SpanContext(_tracer, name, tags)
+
+
+def traced(name=None, **tags):
+    """Decorate a function or coroutine function to run it in a span.
+
+    :param name: Name of span, defaults to the name of the function
+    :type name: Union[str, None]
+    :param tags: Tags of span
+    :type tags: Dict[str, str]
+    """
+    def decorator(func):
+        span_name = name or func.__name__
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if _tracer is None:
+                    return await func(*args, **kwargs)
+                with _SpanContext(_tracer, span_name, tags):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return func(*args, **kwargs)
+            with _SpanContext(_tracer, span_name, tags):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TracedClient(object):
+    """Proxy for an API client which runs each method call in a span."""
+
+    def __init__(self, client, name, managers=()):
+        """Wrap client.
+
+        :param client: Client to wrap
+        :type client: Any
+        :param name: Prefix of span names, eg nova
+        :type name: str
+        :param managers: Attributes of client which are themselves wrapped,
+                         eg servers for nova_client.servers.list
+        :type managers: Iterable[str]
+        """
+        self._client = client
+        self._name = name
+        self._managers = set(managers)
+
+    def __getattr__(self, attr):
+        value = getattr(self._client, attr)
+        span_name = '{}.{}'.format(self._name, attr)
+        if attr in self._managers:
+            return TracedClient(value, span_name)
+        if not callable(value):
+            return value
+
+        @functools.wraps(value)
+        def call(*args, **kwargs):
+            with span(span_name):
+                return value(*args, **kwargs)
+        return call
+
+
+NOVA_MANAGERS = ('servers', 'hypervisors', 'flavors', 'keypairs', 'glance')
+
+
+def trace_client(client, name, managers=()):
+    """Return client wrapped to trace its calls if tracing is enabled.
+
+    :param client: Client to wrap
+    :type client: Any
+    :param name: Prefix of span names, eg nova
+    :type name: str
+    :param managers: Attributes of client which are themselves wrapped
+    :type managers: Iterable[str]
+    :returns: Wrapped or unchanged client
+    :rtype: Union[TracedClient, Any]
+    """
+    if _tracer is None:
+        return client
+    return TracedClient(client, name, managers)
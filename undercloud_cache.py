@@ -0,0 +1,231 @@
+"""Cache undercloud lookups between invocations of the manage-* scripts.
+
+Looking up the same network, flavor, image or hypervisors every time a
+script runs is slow against a busy cloud, as is authenticating with
+keystone. Lookups are cached in memory and, once configure() has been
+called, in a JSON file so that several actions run one after another share
+them. Entries expire after a TTL and can be invalidated explicitly. The
+keystone token is reused until shortly before it expires.
+"""
+
+import datetime
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import zaza.openstack.utilities.openstack as zaza_os
+
+
+DEFAULT_PATH = os.path.join(
+    os.path.expanduser('~'),
+    '.cache',
+    'openstack-performance-testing',
+    'undercloud.json')
+DEFAULT_TTL = 3600
+AUTH_STATE_KEY = 'keystone-auth-state'
+# Do not hand out tokens which expire sooner than this many seconds
+TOKEN_MARGIN = 300
+
+
+class Cache(object):
+    """Key value cache with expiry, optionally persisted to a JSON file."""
+
+    def __init__(self, path=None, ttl=DEFAULT_TTL, namespace=''):
+        """Create cache.
+
+        :param path: File to persist the cache in, None to keep it in memory
+        :type path: Union[str, None]
+        :param ttl: Default seconds entries are valid for
+        :type ttl: float
+        :param namespace: Prefix for keys so caches of different clouds
+                          sharing a file do not collide
+        :type namespace: str
+        """
+        self.path = path
+        self.ttl = ttl
+        self.namespace = namespace
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    self.entries = json.load(f)
+            except ValueError:
+                logging.warning('Ignoring corrupt cache {}'.format(path))
+
+    def _key(self, key):
+        return '{}:{}'.format(self.namespace, key)
+
+    def _save(self):
+        if not self.path:
+            return
+        now = time.time()
+        entries = {k: v for k, v in self.entries.items()
+                   if v['expires'] > now}
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, mode=0o700)
+        tmp_file = '{}.tmp'.format(self.path)
+        # The cache holds keystone tokens
+        fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entries, f, indent=2, sort_keys=True)
+        os.rename(tmp_file, self.path)
+
+    def get(self, key):
+        """Return the value of key, or None if missing or expired.
+
+        :param key: Key
+        :type key: str
+        :returns: Cached value
+        :rtype: Any
+        """
+        with self.lock:
+            entry = self.entries.get(self._key(key))
+            if entry and entry['expires'] > time.time():
+                return entry['value']
+        return None
+
+    def set(self, key, value, ttl=None, expires=None):
+        """Store value, it must be serialisable as JSON.
+
+        :param key: Key
+        :type key: str
+        :param value: Value
+        :type value: Any
+        :param ttl: Seconds value is valid for, defaults to the cache TTL
+        :type ttl: Union[float, None]
+        :param expires: Time value expires at, overrides ttl
+        :type expires: Union[float, None]
+        """
+        if expires is None:
+            expires = time.time() + (self.ttl if ttl is None else ttl)
+        with self.lock:
+            self.entries[self._key(key)] = {
+                'value': value,
+                'expires': expires}
+            self._save()
+
+    def invalidate(self, prefix=''):
+        """Remove entries whose key starts with prefix, by default all.
+
+        :param prefix: Prefix of keys to remove
+        :type prefix: str
+        """
+        prefix = self._key(prefix)
+        with self.lock:
+            removed = [k for k in self.entries if k.startswith(prefix)]
+            for key in removed:
+                del self.entries[key]
+            self._save()
+        logging.info('Invalidated {} cached entries'.format(len(removed)))
+
+    def cached(self, key, lookup, ttl=None):
+        """Return the cached value of key, calling lookup on a miss.
+
+        :param key: Key
+        :type key: str
+        :param lookup: Function returning the value
+        :type lookup: Callable[[], Any]
+        :param ttl: Seconds value is valid for, defaults to the cache TTL
+        :type ttl: Union[float, None]
+        :returns: Value
+        :rtype: Any
+        """
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            logging.info('Cache hit for {}'.format(key))
+            return value
+        self.misses += 1
+        logging.info('Cache miss for {}'.format(key))
+        value = lookup()
+        if value is not None:
+            self.set(key, value, ttl=ttl)
+        return value
+
+
+_cache = Cache()
+
+
+def configure(path=DEFAULT_PATH, ttl=DEFAULT_TTL, refresh=False):
+    """Persist the cache used by cached() and get_keystone_session().
+
+    Entries are namespaced by the undercloud auth URL, project and user.
+
+    :param path: File to persist the cache in, None to keep it in memory
+    :type path: Union[str, None]
+    :param ttl: Default seconds entries are valid for
+    :type ttl: float
+    :param refresh: Whether to discard everything cached so far
+    :type refresh: bool
+    :returns: Cache
+    :rtype: Cache
+    """
+    global _cache
+    auth = zaza_os.get_undercloud_auth()
+    namespace = hashlib.sha256(json.dumps([
+        auth.get('OS_AUTH_URL'),
+        auth.get('OS_PROJECT_NAME') or auth.get('OS_TENANT_NAME'),
+        auth.get('OS_USERNAME')]).encode()).hexdigest()[:16]
+    _cache = Cache(path, ttl, namespace)
+    if refresh:
+        _cache.invalidate()
+    return _cache
+
+
+def get_cache():
+    """Return the cache used by cached() and get_keystone_session()."""
+    return _cache
+
+
+def cached(key, lookup, ttl=None):
+    """Return the cached value of key, calling lookup on a miss.
+
+    :param key: Key
+    :type key: str
+    :param lookup: Function returning the value
+    :type lookup: Callable[[], Any]
+    :param ttl: Seconds value is valid for, defaults to the cache TTL
+    :type ttl: Union[float, None]
+    :returns: Value
+    :rtype: Any
+    """
+    return _cache.cached(key, lookup, ttl=ttl)
+
+
+def invalidate(prefix=''):
+    """Remove entries whose key starts with prefix, by default all."""
+    _cache.invalidate(prefix)
+
+
+def get_keystone_session():
+    """Return an undercloud keystone session reusing a cached token.
+
+    :returns: Keystone session
+    :rtype: keystoneauth1.session.Session
+    """
+    session = zaza_os.get_undercloud_keystone_session()
+    state = _cache.get(AUTH_STATE_KEY)
+    if state:
+        logging.info('Cache hit for {}'.format(AUTH_STATE_KEY))
+        session.auth.set_auth_state(state)
+    else:
+        logging.info('Cache miss for {}'.format(AUTH_STATE_KEY))
+    # Authenticates, unless the cached token is still valid
+    session.get_token()
+    if not state:
+        expires = session.auth.auth_ref.expires
+        now = datetime.datetime.now(expires.tzinfo)
+        lifetime = (expires - now).total_seconds() - TOKEN_MARGIN
+        if lifetime > 0:
+            _cache.set(
+                AUTH_STATE_KEY,
+                session.auth.get_auth_state(),
+                ttl=lifetime)
+    return session